@@ -0,0 +1,827 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import json
+import fnmatch
+import time
+import queue
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from image_resizer import (ImageResizer, add_processing_arguments, add_instrumentation_arguments, processing_options,
+                           apply_processing, create_resizer, normalize_format)
+from result_cache import ResultCache, add_cache_arguments, write_file_atomic
+from processing_stats import ProcessingStats, JsonlStatsSink, count_open_files, peak_rss
+
+# 支持的图片扩展名（与GUI批量处理保持一致）
+SUPPORTED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff", ".tif", ".webp")
+
+# 默认输出文件夹的名称，扫描子文件夹时跳过
+OUTPUT_FOLDER_NAME = "resized_images"
+
+# 同时提交给进程池的最多任务数（每个工作进程），其余任务在扫描到后等待提交
+MAX_PENDING_PER_WORKER = 4
+
+# 流水线模式：默认的读取线程数和写入线程数，以及阶段之间队列的长度（每个工作进程）
+DEFAULT_READ_WORKERS = 2
+DEFAULT_WRITE_WORKERS = 2
+PIPELINE_QUEUE_PER_WORKER = 2
+
+
+class FileFilter:
+    """按文件名通配符和文件大小筛选图片
+
+    include和exclude为通配符列表，同时匹配相对于扫描目录的路径（使用/分隔）和文件名；
+    未指定include时匹配所有支持的图片扩展名。min_size和max_size以字节为单位。
+    """
+
+    def __init__(self, include=None, exclude=None, min_size=None, max_size=None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def match_name(self, rel_path):
+        """根据相对路径判断文件名是否符合条件"""
+        name = os.path.basename(rel_path)
+        if self.include:
+            if not any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in self.include):
+                return False
+        elif not name.lower().endswith(SUPPORTED_EXTENSIONS):
+            return False
+        return not any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in self.exclude)
+
+    def needs_size(self):
+        """是否需要读取文件大小"""
+        return self.min_size is not None or self.max_size is not None
+
+    def match_size(self, size):
+        """判断文件大小是否符合条件"""
+        if self.min_size is not None and size < self.min_size:
+            return False
+        return self.max_size is None or size <= self.max_size
+
+
+def scan_directory(root, recursive=True, file_filter=None, skip_dirs=()):
+    """用os.scandir逐层扫描目录，找到一个符合条件的图片就立即返回一个，不预先列出所有文件
+
+    文件类型使用目录项中已有的信息判断，只在设置了大小条件时读取文件大小；
+    不进入符号链接的文件夹（避免循环）；跳过名为resized_images的文件夹和skip_dirs中的文件夹，
+    避免把输出的图片再次作为输入。
+    文件按目录中的顺序返回，不排序。
+    """
+    file_filter = file_filter or FileFilter()
+    skip = {os.path.abspath(path) for path in skip_dirs}
+    stack = [(root, "")]
+
+    while stack:
+        directory, rel_dir = stack.pop()
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            # 没有权限或目录在扫描过程中被删除
+            continue
+
+        with it:
+            for entry in it:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and entry.name != OUTPUT_FOLDER_NAME and os.path.abspath(entry.path) not in skip:
+                            stack.append((entry.path, rel_path))
+                        continue
+                    if not entry.is_file() or not file_filter.match_name(rel_path):
+                        continue
+                    if file_filter.needs_size() and not file_filter.match_size(entry.stat().st_size):
+                        continue
+                except OSError:
+                    continue
+                yield entry.path
+
+
+def iter_input_files(inputs, recursive=False, file_filter=None, skip_dirs=()):
+    """根据目录、通配符或文件路径逐个返回待处理的图片文件 (文件路径, 扫描的根目录)
+
+    目录默认只扫描当前层级（与GUI一致），recursive为True时扫描所有子文件夹；
+    通配符和直接指定的文件没有根目录，返回None；其中位于skip_dirs中的文件（如之前输出的图片）跳过。
+    """
+    file_filter = file_filter or FileFilter()
+    # 只有多个输入可能重复时才需要去重
+    seen = set() if len(inputs) > 1 else None
+
+    for item in inputs:
+        root = None
+        if os.path.isdir(item):
+            root = item
+            candidates = scan_directory(item, recursive, file_filter, skip_dirs)
+        else:
+            if glob.has_magic(item):
+                paths = glob.iglob(item, recursive=True)
+            else:
+                paths = [item]
+            candidates = (path for path in paths if os.path.isfile(path) and _match_file(path, file_filter)
+                          and not any(is_within(path, folder) for folder in skip_dirs))
+
+        for file_path in candidates:
+            if seen is not None:
+                key = os.path.abspath(file_path)
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield file_path, root
+
+
+def is_within(path, folder):
+    """path是否为folder本身或位于其中（比较真实路径，符号链接指向同一位置时也视为相同）"""
+    path = os.path.realpath(path)
+    folder = os.path.realpath(folder)
+    return path == folder or path.startswith(os.path.join(folder, ""))
+
+
+def find_output_conflict(inputs, output_folder):
+    """返回与输出文件夹相同或位于输出文件夹中的输入目录，没有时返回None
+
+    这时输出的图片会在扫描（或监视）过程中被再次作为输入；输出文件夹位于输入目录之中时则由skip_dirs跳过。
+    """
+    if output_folder:
+        for item in inputs:
+            if os.path.isdir(item) and is_within(item, output_folder):
+                return item
+    return None
+
+
+def _match_file(file_path, file_filter):
+    """判断通配符或直接指定的文件是否符合筛选条件"""
+    if not file_filter.match_name(os.path.basename(file_path)):
+        return False
+    return not file_filter.needs_size() or file_filter.match_size(os.path.getsize(file_path))
+
+
+def collect_input_files(inputs, recursive=False, file_filter=None):
+    """根据目录或通配符收集待处理的图片文件"""
+    return [file_path for file_path, _ in iter_input_files(inputs, recursive, file_filter)]
+
+
+def build_output_path(file_path, output_folder=None, root=None):
+    """生成输出路径，默认保存到原图所在文件夹下的resized_images中
+
+    指定了输出文件夹和扫描的根目录时，在输出文件夹中保持原图相对于根目录的子文件夹结构。
+    """
+    if not output_folder:
+        output_folder = os.path.join(os.path.dirname(file_path), OUTPUT_FOLDER_NAME)
+    elif root:
+        rel_dir = os.path.relpath(os.path.dirname(os.path.abspath(file_path)), os.path.abspath(root))
+        if rel_dir != "." and not rel_dir.startswith(".."):
+            output_folder = os.path.join(output_folder, rel_dir)
+    return os.path.join(output_folder, f"resized_{os.path.basename(file_path)}")
+
+
+class BatchManifest:
+    """批量处理清单：以JSON Lines格式逐条记录每个输入的处理状态、输出路径、输出大小和耗时
+
+    重新运行同一批任务时，跳过已完成的输入。判断是否已完成只比较输入和输出文件的大小、
+    修改时间（os.stat），不读取文件内容；处理参数变化时所有输入都会重新处理。
+    """
+
+    def __init__(self, path, options):
+        self.path = path
+        self.options_digest = hashlib.sha1(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()
+        self.records = {}
+        self._load()
+
+    def _load(self):
+        """读取已有的清单，同一输入以最后一条记录为准"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 进程中断时最后一行可能不完整
+                    continue
+                self.records[record["input"]] = record
+
+    def is_done(self, file_path, output_path):
+        """判断输入是否已经以相同参数处理完成，且输入和输出文件都未改变"""
+        record = self.records.get(os.path.abspath(file_path))
+        if not record or record["status"] != "done" or record["options"] != self.options_digest:
+            return False
+        if record["output"] != os.path.abspath(output_path):
+            return False
+
+        try:
+            input_stat = os.stat(file_path)
+            output_stat = os.stat(output_path)
+        except OSError:
+            return False
+
+        return (input_stat.st_size == record["input_size"]
+                and input_stat.st_mtime_ns == record["input_mtime_ns"]
+                and output_stat.st_size == record["output_size"])
+
+    def record(self, result):
+        """追加一条处理结果并立即写入磁盘"""
+        record = {
+            "input": os.path.abspath(result["input"]),
+            "status": "done" if result["success"] else "failed",
+            "options": self.options_digest,
+            "input_size": result["input_size"],
+            "input_mtime_ns": result["input_mtime_ns"],
+            "output": os.path.abspath(result["output"]),
+            "output_size": result["output_size"],
+            "elapsed": round(result["elapsed"], 4),
+            "error": result["error"],
+            "time": time.time(),
+        }
+        self.records[record["input"]] = record
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+# 每个工作进程各自持有的结果缓存对象，按(缓存目录, 大小上限)复用
+_worker_caches = {}
+
+
+def _get_worker_cache(cache_config):
+    """获取当前进程的结果缓存对象"""
+    if not cache_config:
+        return None
+    if cache_config not in _worker_caches:
+        _worker_caches[cache_config] = ResultCache(*cache_config)
+    return _worker_caches[cache_config]
+
+
+def _new_result(file_path, output_path):
+    """创建单个文件的处理结果"""
+    return {
+        "input": file_path,
+        "output": output_path,
+        "success": False,
+        "error": "",
+        "input_size": 0,
+        "input_mtime_ns": 0,
+        "output_size": 0,
+        "probes": 0,
+        "cache": None,
+        "elapsed": 0.0,
+        "stats": None,
+        # 处理该文件的进程及其处理完成、释放图片后的资源占用，见_record_resources
+        "pid": None,
+        "open_files": None,
+        "peak_rss": None,
+    }
+
+
+def _crashed_result(file_path, output_path, error):
+    """工作进程异常退出、没有返回结果的文件记为失败"""
+    result = _new_result(file_path, output_path)
+    result["error"] = f"错误: 工作进程异常退出: {str(error)}"
+    return result
+
+
+class WorkerPool:
+    """可替换的工作进程池
+
+    工作进程异常退出（如被OOM终止）后进程池无法再使用，由replace替换为新的进程池，
+    多个线程同时发现同一个进程池损坏时只替换一次。restarts为替换的次数。
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.restarts = 0
+        self.lock = threading.Lock()
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, fn, *args):
+        """把任务提交给进程池，返回(future, 进程池)
+
+        进程池已损坏时替换为新的进程池后重试一次，仍然失败时抛出BrokenProcessPool。
+        """
+        with self.lock:
+            executor = self.executor
+        try:
+            return executor.submit(fn, *args), executor
+        except BrokenProcessPool:
+            executor = self.replace(executor)
+            return executor.submit(fn, *args), executor
+
+    def replace(self, broken):
+        """用新的进程池替换已损坏的进程池，返回当前的进程池"""
+        with self.lock:
+            if self.executor is broken:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                broken.shutdown(wait=False)
+                self.restarts += 1
+            return self.executor
+
+    def shutdown(self):
+        """等待正在处理的任务完成后关闭进程池"""
+        self.executor.shutdown()
+
+
+def _record_resources(result):
+    """记录当前进程打开的文件数和峰值内存（在工作进程中释放图片后调用）"""
+    result["pid"] = os.getpid()
+    result["open_files"] = count_open_files()
+    result["peak_rss"] = peak_rss()
+
+
+def process_file(task):
+    """处理单个文件（在工作进程中执行），返回处理结果
+
+    task为(输入路径, 输出路径, 处理参数, 缓存配置)，缓存配置为(缓存目录, 大小上限)或None。
+    """
+    file_path, output_path, options, cache_config = task
+    start_time = time.perf_counter()
+    result = _new_result(file_path, output_path)
+
+    # 工作进程中不输出处理细节（安静模式），避免多个进程的输出交错
+    resizer = create_resizer(options, quiet=True)
+    resizer._reset_stats(file_path)
+    try:
+        input_stat = os.stat(file_path)
+        result["input_size"] = input_stat.st_size
+        result["input_mtime_ns"] = input_stat.st_mtime_ns
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+        # 查找结果缓存，命中时直接写入缓存的输出，无需解码
+        cache = _get_worker_cache(cache_config)
+        if cache:
+            with resizer.stats.measure("cache") as cache_event:
+                cache_key = cache.make_key(file_path, options, resizer._get_format(output_path))
+                cache_event["hit"] = cache.fetch(cache_key, output_path)
+            if cache_event["hit"]:
+                result["success"] = True
+                result["cache"] = "hit"
+                result["output_size"] = cache_event["bytes"] = os.path.getsize(output_path)
+                result["stats"] = resizer.finish_stats(True).to_dict()
+                result["elapsed"] = time.perf_counter() - start_time
+                return result
+            result["cache"] = "miss"
+
+        # 加载图片时会重置统计，保留缓存查找的记录
+        success = resizer.load_image(file_path)
+        if cache:
+            resizer.stats.events.insert(0, cache_event)
+        success = (success
+                   and apply_processing(resizer, options)
+                   and resizer.save_image(output_path))
+
+        if success:
+            result["success"] = True
+            result["output_size"] = os.path.getsize(output_path)
+            result["probes"] = resizer.last_search_probes
+            if cache:
+                cache.store_file(cache_key, output_path)
+        else:
+            result["error"] = resizer.last_error or "处理失败"
+    except Exception as e:
+        result["error"] = f"错误: {str(e)}"
+    finally:
+        # 无论成功、失败还是命中缓存都立即释放图片，工作进程长期运行，文件句柄和内存不能累积
+        resizer.close()
+        _record_resources(result)
+
+    result["stats"] = resizer.finish_stats(result["success"]).to_dict()
+    result["elapsed"] = time.perf_counter() - start_time
+    return result
+
+
+def process_data(task):
+    """处理已读入内存的图片（在工作进程中执行），返回编码后的数据
+
+    task为(图片数据, 输入路径, 输出格式, 处理参数)。流水线模式中文件的读取和写入由主进程中的线程完成，
+    工作进程只负责解码、处理和编码，返回字典：success、error、data、probes、stats，
+    以及释放图片后的资源占用（pid、open_files、peak_rss）。
+    """
+    data, file_path, output_format, options = task
+    result = {"success": False, "error": "", "data": None, "probes": 0, "stats": None}
+
+    with create_resizer(options, quiet=True) as resizer:
+        try:
+            if resizer.load_image_data(data, resizer._get_format(file_path)) and apply_processing(resizer, options):
+                result["data"] = resizer.get_encoded_data(output_format)
+                result["probes"] = resizer.last_search_probes
+                result["success"] = True
+            else:
+                result["error"] = resizer.last_error or "处理失败"
+        except Exception as e:
+            result["error"] = f"错误: {str(e)}"
+        result["stats"] = resizer.finish_stats(result["success"]).to_dict()
+
+    _record_resources(result)
+    return result
+
+
+def _run_pipeline(tasks, pool, read_workers, write_workers, collect):
+    """流水线模式：读取、处理、写入三个阶段同时进行，阶段之间用有界队列连接
+
+    读取线程预读文件并查找结果缓存，把数据提交给工作进程；写入线程等待处理结果并原子写入输出文件。
+    磁盘（或网络存储）的读写与工作进程中的编码重叠；队列有长度上限，读入内存的图片数量不会无限增长。
+    处理结果在调用线程中逐个交给collect。pool为WorkerPool，工作进程异常退出时当时正在处理的文件
+    记为失败，进程池替换后继续处理其余的文件。
+    """
+    queue_size = pool.workers * PIPELINE_QUEUE_PER_WORKER
+    read_queue = queue.Queue(queue_size)
+    write_queue = queue.Queue(queue_size)
+    done_queue = queue.Queue()
+    cache_lock = threading.Lock()
+    remaining = {"read": read_workers, "write": write_workers}
+    remaining_lock = threading.Lock()
+
+    def stage_finished(stage, next_queue, count):
+        # 一个阶段的最后一个线程结束时，通知下一个阶段的所有线程结束
+        with remaining_lock:
+            remaining[stage] -= 1
+            last = remaining[stage] == 0
+        if last:
+            for _ in range(count):
+                next_queue.put(None)
+
+    def feed():
+        try:
+            for task in tasks:
+                read_queue.put(task)
+        finally:
+            for _ in range(read_workers):
+                read_queue.put(None)
+
+    def read_stage():
+        while True:
+            task = read_queue.get()
+            if task is None:
+                break
+
+            file_path, output_path, options, cache_config = task
+            start_time = time.perf_counter()
+            result = _new_result(file_path, output_path)
+            stats = ProcessingStats(file_path)
+            try:
+                input_stat = os.stat(file_path)
+                result["input_size"] = input_stat.st_size
+                result["input_mtime_ns"] = input_stat.st_mtime_ns
+                os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+                with stats.measure("read", input_stat.st_size):
+                    with open(file_path, "rb") as f:
+                        data = f.read()
+
+                # 查找结果缓存，命中时直接写入缓存的输出，无需提交给工作进程
+                output_format = normalize_format(os.path.splitext(output_path)[1])
+                cache = _get_worker_cache(cache_config)
+                cache_key = None
+                if cache:
+                    with stats.measure("cache") as cache_event:
+                        cache_key = cache.make_key(file_path, options, output_format, source_data=data)
+                        with cache_lock:
+                            cache_event["hit"] = cache.fetch(cache_key, output_path)
+                    if cache_event["hit"]:
+                        result["success"] = True
+                        result["cache"] = "hit"
+                        result["output_size"] = cache_event["bytes"] = os.path.getsize(output_path)
+                        stats.success = True
+                        result["stats"] = stats.to_dict()
+                        result["elapsed"] = time.perf_counter() - start_time
+                        done_queue.put(result)
+                        continue
+                    result["cache"] = "miss"
+
+                future, executor = pool.submit(process_data, (data, file_path, output_format, options))
+                del data
+            except Exception as e:
+                result["error"] = f"错误: {str(e)}"
+                stats.success = False
+                result["stats"] = stats.to_dict()
+                result["elapsed"] = time.perf_counter() - start_time
+                done_queue.put(result)
+                continue
+
+            write_queue.put((result, stats, future, executor, cache, cache_key, start_time))
+
+        stage_finished("read", write_queue, write_workers)
+
+    def write_stage():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+
+            result, stats, future, executor, cache, cache_key, start_time = item
+            try:
+                processed = future.result()
+                stats.events.extend(processed["stats"]["events"])
+                for key in ("pid", "open_files", "peak_rss"):
+                    result[key] = processed[key]
+                if processed["success"]:
+                    data = processed["data"]
+                    with stats.measure("write", len(data)):
+                        write_file_atomic(result["output"], data)
+                    result["success"] = True
+                    result["output_size"] = len(data)
+                    result["probes"] = processed["probes"]
+                    if cache:
+                        with cache_lock:
+                            cache.store(cache_key, data)
+                else:
+                    result["error"] = processed["error"]
+            except BrokenProcessPool as e:
+                # 只替换一次：已被替换的进程池中的其他文件不会导致再次替换
+                pool.replace(executor)
+                result["error"] = f"错误: 工作进程异常退出: {str(e)}"
+            except Exception as e:
+                result["error"] = f"错误: {str(e)}"
+
+            stats.success = result["success"]
+            result["stats"] = stats.to_dict()
+            result["elapsed"] = time.perf_counter() - start_time
+            done_queue.put(result)
+
+        stage_finished("write", done_queue, 1)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=read_stage, daemon=True) for _ in range(read_workers)]
+    threads += [threading.Thread(target=write_stage, daemon=True) for _ in range(write_workers)]
+    for thread in threads:
+        thread.start()
+
+    while True:
+        result = done_queue.get()
+        if result is None:
+            break
+        collect(result)
+
+    for thread in threads:
+        thread.join()
+
+
+def run_batch(files, options, output_folder=None, workers=None, on_result=None, cache_config=None, manifest=None,
+              stats_sink=None, pipeline=None):
+    """使用进程池批量处理图片，返回汇总信息
+
+    files可以是文件路径或(文件路径, 扫描的根目录)的列表或生成器（如iter_input_files的结果）。
+    文件边扫描边提交，同时提交给进程池的任务数有上限，扫描到第一个文件就开始处理。
+    cache_config为(缓存目录, 大小上限)时启用结果缓存；manifest为BatchManifest时记录每个文件的
+    处理结果，并跳过清单中已完成的文件；stats_sink为JsonlStatsSink时写入每个文件各阶段的统计。
+    on_result(result, 已完成数, 总数)的总数在扫描结束前为None。
+    pipeline为(读取线程数, 写入线程数)时使用流水线模式（见_run_pipeline），文件的读写在主进程的线程中进行。
+
+    汇总信息中的资源占用：open_files为工作进程处理完一个文件后打开的文件数的最大值，
+    open_files_growth为其中相对每个工作进程处理完第一个文件时的最大增加量（正常应为0，
+    持续增加说明有文件句柄泄漏）；peak_rss和main_peak_rss分别为工作进程和主进程的峰值内存。
+    无法获取时为None。pool_restarts为工作进程异常退出后重建进程池的次数，当时正在处理的文件记为失败。
+    """
+    if not workers or workers < 1:
+        workers = os.cpu_count() or 1
+
+    summary = {
+        "total": 0,
+        "skipped": 0,
+        "success": 0,
+        "failed": 0,
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "input_bytes": 0,
+        "output_bytes": 0,
+        "elapsed": 0.0,
+        "workers": workers,
+        "pipeline": pipeline,
+        "open_files": None,
+        "open_files_growth": 0,
+        "peak_rss": None,
+        "main_peak_rss": None,
+        "pool_restarts": 0,
+    }
+    scan_done = False
+    # 每个工作进程处理完第一个文件后打开的文件数
+    first_open_files = {}
+
+    def iter_tasks():
+        nonlocal scan_done
+        for item in files:
+            file_path, root = item if isinstance(item, tuple) else (item, None)
+            output_path = build_output_path(file_path, output_folder, root)
+            if manifest and manifest.is_done(file_path, output_path):
+                summary["skipped"] += 1
+                continue
+            summary["total"] += 1
+            yield (file_path, output_path, options, cache_config)
+        scan_done = True
+
+    def collect(result):
+        if manifest:
+            manifest.record(result)
+        if stats_sink and result["stats"]:
+            # 统计只在主进程中写入，避免多个进程同时写同一个文件
+            stats_sink.write(result["stats"])
+        if result["success"]:
+            summary["success"] += 1
+            summary["input_bytes"] += result["input_size"]
+            summary["output_bytes"] += result["output_size"]
+        else:
+            summary["failed"] += 1
+        if result["cache"] == "hit":
+            summary["cache_hits"] += 1
+        elif result["cache"] == "miss":
+            summary["cache_misses"] += 1
+        if result["open_files"] is not None:
+            first = first_open_files.setdefault(result["pid"], result["open_files"])
+            summary["open_files"] = max(summary["open_files"] or 0, result["open_files"])
+            summary["open_files_growth"] = max(summary["open_files_growth"], result["open_files"] - first)
+        if result["peak_rss"] is not None:
+            summary["peak_rss"] = max(summary["peak_rss"] or 0, result["peak_rss"])
+        if on_result:
+            on_result(result, summary["success"] + summary["failed"], summary["total"] if scan_done else None)
+
+    start_time = time.perf_counter()
+
+    if pipeline:
+        pool = WorkerPool(workers)
+        try:
+            _run_pipeline(iter_tasks(), pool, pipeline[0], pipeline[1], collect)
+        finally:
+            pool.shutdown()
+        summary["pool_restarts"] = pool.restarts
+    elif workers == 1:
+        # 单进程时直接在当前进程处理，便于调试
+        for task in iter_tasks():
+            collect(process_file(task))
+    else:
+        max_pending = workers * MAX_PENDING_PER_WORKER
+        pool = WorkerPool(workers)
+        # 已提交的任务及其所在的进程池
+        pending = {}
+
+        def finish(future):
+            # 工作进程异常退出时，该进程池中正在处理的文件都记为失败（同样写入清单），
+            # 替换进程池后继续处理其余的文件
+            task, executor = pending.pop(future)
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                pool.replace(executor)
+                result = _crashed_result(task[0], task[1], e)
+            collect(result)
+
+        try:
+            for task in iter_tasks():
+                future, executor = pool.submit(process_file, task)
+                pending[future] = (task, executor)
+                if len(pending) >= max_pending:
+                    # 等待部分任务完成后再继续扫描，避免扫描结果和任务在内存中堆积
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+
+            for future in as_completed(list(pending)):
+                finish(future)
+        finally:
+            pool.shutdown()
+        summary["pool_restarts"] = pool.restarts
+
+    summary["elapsed"] = time.perf_counter() - start_time
+    summary["main_peak_rss"] = peak_rss()
+    return summary
+
+
+def add_input_arguments(parser):
+    """添加输入目录、通配符和文件筛选相关的命令行参数"""
+    parser.add_argument("inputs", nargs="+", help="图片目录或通配符（如 'photos/**/*.jpg'）")
+    parser.add_argument("-r", "--recursive", action="store_true", help="同时处理目录中所有子文件夹的图片")
+    add_filter_arguments(parser)
+
+
+def add_filter_arguments(parser):
+    """添加按文件名和文件大小筛选的命令行参数"""
+    parser.add_argument("--include", action="append", default=[], metavar="PATTERN",
+                        help="只处理文件名或相对路径匹配通配符的文件（如 '*.jpg'），可指定多次，默认为所有支持的图片格式")
+    parser.add_argument("--exclude", action="append", default=[], metavar="PATTERN",
+                        help="跳过文件名或相对路径匹配通配符的文件（如 'raw/*'），可指定多次")
+    parser.add_argument("--min-size", type=int, help="只处理不小于该大小(KB)的文件")
+    parser.add_argument("--max-size", type=int, help="只处理不大于该大小(KB)的文件")
+
+
+def create_file_filter(args):
+    """根据命令行参数创建文件筛选条件"""
+    return FileFilter(args.include, args.exclude,
+                      args.min_size * 1024 if args.min_size is not None else None,
+                      args.max_size * 1024 if args.max_size is not None else None)
+
+
+def format_size(size_bytes):
+    """格式化文件大小显示"""
+    return ImageResizer().format_size(size_bytes)
+
+
+def print_result(result, done, total):
+    """打印单个文件的处理结果，扫描结束前总数未知（None）"""
+    progress = f"{done:>{len(str(total))}}/{total}" if total else str(done)
+    if result["success"]:
+        status = "缓存" if result["cache"] == "hit" else "成功"
+        print(f"[{progress}] {status} {result['input']} -> {result['output']} "
+              f"({format_size(result['input_size'])} -> {format_size(result['output_size'])}, {result['elapsed']:.2f}s)")
+    else:
+        print(f"[{progress}] 失败 {result['input']}: {result['error']}")
+
+
+def print_failure(result, done, total):
+    """安静模式下只打印失败的文件"""
+    if not result["success"]:
+        print_result(result, done, total)
+
+
+def print_summary(summary):
+    """打印批量处理的汇总信息"""
+    elapsed = summary["elapsed"]
+    files_per_sec = summary["total"] / elapsed if elapsed > 0 else 0
+    mb_per_sec = summary["input_bytes"] / (1024 * 1024) / elapsed if elapsed > 0 else 0
+
+    print(f"\n批量处理完成:")
+    print(f"- 总计: {summary['total']} 个文件")
+    if summary["skipped"]:
+        print(f"- 跳过: {summary['skipped']} 个（清单中已完成）")
+    print(f"- 成功: {summary['success']} 个")
+    print(f"- 失败: {summary['failed']} 个")
+    print(f"- 工作进程: {summary['workers']} 个")
+    if summary["pool_restarts"]:
+        print(f"- 进程池重建: {summary['pool_restarts']} 次（工作进程异常退出）")
+    if summary["pipeline"]:
+        print(f"- 流水线: 读取线程 {summary['pipeline'][0]} 个, 写入线程 {summary['pipeline'][1]} 个")
+    print(f"- 耗时: {elapsed:.2f}s")
+    print(f"- 吞吐量: {files_per_sec:.2f} 个/秒, {mb_per_sec:.2f} MB/秒")
+    print(f"- 总大小: {format_size(summary['input_bytes'])} -> {format_size(summary['output_bytes'])}")
+
+    lookups = summary["cache_hits"] + summary["cache_misses"]
+    if lookups:
+        print(f"- 缓存: 命中 {summary['cache_hits']} 个, 未命中 {summary['cache_misses']} 个, 命中率 {summary['cache_hits'] / lookups:.1%}")
+
+    if summary["open_files"] is not None:
+        print(f"- 打开的文件: 工作进程最多 {summary['open_files']} 个, 处理过程中增加 {summary['open_files_growth']} 个")
+    if summary["peak_rss"] is not None:
+        print(f"- 峰值内存: 工作进程 {format_size(summary['peak_rss'])}, 主进程 {format_size(summary['main_peak_rss'] or 0)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="image_resizer.py batch", description="批量处理图片 - 使用多个工作进程并行处理目录或通配符匹配的图片")
+    add_input_arguments(parser)
+    parser.add_argument("-o", "--output-dir", help="输出文件夹，默认为原图所在文件夹下的resized_images。"
+                        "扫描子文件夹时在输出文件夹中保持原来的子文件夹结构")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="工作进程数，默认为CPU核心数")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="流水线模式：由读取线程预读文件、写入线程写出结果，工作进程只负责处理，"
+                             "磁盘读写与编码同时进行，适合网络存储等读写较慢的情况")
+    parser.add_argument("--read-workers", type=int, default=DEFAULT_READ_WORKERS,
+                        help=f"流水线模式的读取线程数，默认为{DEFAULT_READ_WORKERS}")
+    parser.add_argument("--write-workers", type=int, default=DEFAULT_WRITE_WORKERS,
+                        help=f"流水线模式的写入线程数，默认为{DEFAULT_WRITE_WORKERS}")
+    add_processing_arguments(parser)
+    parser.add_argument("--manifest", help="批量处理清单文件(JSON Lines)。记录每个文件的处理结果，重新运行时跳过已完成的文件")
+    add_cache_arguments(parser)
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args(argv)
+    options = processing_options(args)
+
+    if args.method == "dimensions" and (args.width <= 0 or args.height <= 0):
+        print("\n错误: 使用dimensions方法时，必须指定宽度和高度")
+        return 1
+    if args.pipeline and (args.read_workers < 1 or args.write_workers < 1):
+        print("\n错误: 读取线程数和写入线程数必须大于0")
+        return 1
+
+    conflict = find_output_conflict(args.inputs, args.output_dir)
+    if conflict:
+        print(f"\n错误: 输出文件夹不能是输入目录或包含输入目录（输出的图片会被再次作为输入）: {conflict}")
+        return 1
+
+    file_filter = create_file_filter(args)
+    # 边扫描边处理，输出文件夹在输入目录中时不扫描它
+    files = iter_input_files(args.inputs, args.recursive, file_filter,
+                             skip_dirs=[args.output_dir] if args.output_dir else ())
+
+    cache_config = (args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+    manifest = BatchManifest(args.manifest, options) if args.manifest else None
+    stats_sink = JsonlStatsSink(args.stats_jsonl) if args.stats_jsonl else None
+    summary = run_batch(files, options, args.output_dir, args.workers,
+                        on_result=print_failure if args.quiet else print_result,
+                        cache_config=cache_config, manifest=manifest, stats_sink=stats_sink,
+                        pipeline=(args.read_workers, args.write_workers) if args.pipeline else None)
+    if summary["total"] + summary["skipped"] == 0:
+        print("\n错误: 没有找到支持的图片文件")
+        return 1
+    if not args.quiet:
+        print_summary(summary)
+
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
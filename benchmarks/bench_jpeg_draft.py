@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""JPEG缩放解码（draft模式）基准测试
+
+比较调整尺寸时"原始分辨率解码+LANCZOS"与"缩放解码+LANCZOS"两种方式的耗时，
+并用PSNR衡量两者输出的差异。
+"""
+
+import os
+import sys
+import io
+import json
+import math
+import time
+import argparse
+import tempfile
+import contextlib
+from PIL import Image, ImageChops, ImageStat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_resizer import ImageResizer
+
+
+def create_test_jpeg(path, width, height):
+    """生成包含细节和噪声的合成照片"""
+    fractal = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 200).convert("RGB")
+    noise = Image.effect_noise((width, height), 25).convert("RGB")
+    Image.blend(fractal, noise, 0.3).save(path, format="JPEG", quality=92)
+
+
+def psnr(image_a, image_b):
+    """计算两张图片之间的PSNR（dB）"""
+    diff = ImageChops.difference(image_a.convert("RGB"), image_b.convert("RGB"))
+    mse = sum(ImageStat.Stat(diff).sum2) / (diff.width * diff.height * 3)
+    return float("inf") if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+
+def run_once(path, width, height, fast_decode):
+    """执行一次调整尺寸处理，返回(耗时, 处理后的图片)"""
+    resizer = ImageResizer(fast_decode=fast_decode)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        resizer.load_image(path)
+        resizer.process_image_dimensions(width, height)
+        elapsed = time.perf_counter() - start_time
+    return elapsed, resizer.processed_image
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JPEG缩放解码基准测试")
+    parser.add_argument("--source-width", type=int, default=6000, help="合成原图宽度，默认6000（约24MP）")
+    parser.add_argument("--source-height", type=int, default=4000, help="合成原图高度，默认4000")
+    parser.add_argument("--target", type=int, nargs="+", default=[3000, 1600, 800, 320], help="目标长边尺寸，可指定多个")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式重复次数，取最短耗时")
+    parser.add_argument("--image", help="使用已有的JPEG图片代替合成图片")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = args.image
+        if not path:
+            path = os.path.join(temp_dir, "source.jpg")
+            create_test_jpeg(path, args.source_width, args.source_height)
+
+        results = []
+        for target in args.target:
+            full_time, full_image = min((run_once(path, target, target, False) for _ in range(args.repeat)), key=lambda r: r[0])
+            draft_time, draft_image = min((run_once(path, target, target, True) for _ in range(args.repeat)), key=lambda r: r[0])
+            results.append({
+                "target": target,
+                "size": list(draft_image.size),
+                "full_decode_seconds": round(full_time, 4),
+                "fast_decode_seconds": round(draft_time, 4),
+                "speedup": round(full_time / draft_time, 2),
+                "psnr_db": round(psnr(full_image, draft_image), 2),
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{'目标长边':>8} {'输出尺寸':>12} {'原始解码(s)':>12} {'缩放解码(s)':>12} {'加速比':>8} {'PSNR(dB)':>9}")
+    for r in results:
+        size = f"{r['size'][0]}x{r['size'][1]}"
+        print(f"{r['target']:>8} {size:>12} {r['full_decode_seconds']:>12.3f} {r['fast_decode_seconds']:>12.3f} "
+              f"{r['speedup']:>7.2f}x {r['psnr_db']:>9.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
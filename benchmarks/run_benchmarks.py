@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""图片处理基准测试
+
+生成固定内容的合成图片集（JPEG、PNG RGB/RGBA/调色板、WebP、GIF、大尺寸TIFF），
+对每种处理路径分别计时：调整质量（有/无目标大小、目标SSIM）、PNG目标大小（缩小/增大）、调整尺寸和保存。
+每个用例在独立的子进程中运行，记录耗时、编码次数、峰值内存（RSS）和最终大小与目标大小的误差。
+
+峰值内存还换算为原图（放大时为处理结果）解码后大小的倍数（帧数）。Pillow的像素数据不经过Python的内存分配器，
+tracemalloc只能看到编码数据等Python对象，因此帧数按RSS的增量计算，tracemalloc的峰值单独记录。
+测量前先用同格式的小图片执行一次相同的处理（见warm_up），帧数不包含库加载等固定开销。
+--check-memory检查每个用例的帧数不超过其处理路径的上限（见FRAME_BOUNDS），超过时返回非0，
+可用于发现多余的整图复制。Pillow解码WebP本身的峰值约为4帧，WebP的用例另外允许WEBP_DECODE_FRAMES帧：
+
+    python benchmarks/run_benchmarks.py --repeat 1 --check-memory
+
+缩小尺寸（--scale）时编解码器的工作缓冲区等与图片大小无关的开销占比更大，帧数会明显偏高，不适合做这项检查。
+
+结果可以用--output保存为JSON，再用--compare与另一次提交的结果比较：
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --compare before.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import importlib.util
+import tempfile
+import subprocess
+import tracemalloc
+import PIL
+from PIL import Image
+
+try:
+    import resource
+except ImportError:
+    # Windows下没有resource模块，不记录峰值内存
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+from image_resizer import ImageResizer
+from tiled_processing import decoded_bytes
+
+# 合成图片集：(名称, 文件扩展名, 颜色模式, 尺寸)
+CORPUS = [
+    ("jpeg_small", "jpg", "RGB", (1200, 900)),
+    ("jpeg_large", "jpg", "RGB", (4000, 3000)),
+    ("png_rgb", "png", "RGB", (1200, 900)),
+    ("png_rgba", "png", "RGBA", (1200, 900)),
+    ("png_palette", "png", "P", (1200, 900)),
+    ("webp", "webp", "RGB", (1600, 1200)),
+    ("gif", "gif", "P", (800, 600)),
+    ("tiff_large", "tif", "RGB", (6000, 4000)),
+]
+
+# 测量前预热使用的小图片尺寸，见warm_up
+WARM_UP_SIZE = (64, 64)
+
+# 各处理路径的峰值内存上限（帧数），比默认尺寸下的测量值留出约10%-20%的余量：
+# 调整质量和尺寸只需原图和处理结果；PNG目标大小的缩放搜索同时保留原图、缩放结果和上一次结果的编码数据；
+# 按目标SSIM查找时计算SSIM需要原图和每次尝试解码后的图片
+FRAME_BOUNDS = {
+    "quality": 2.5,
+    "quality_target": 2.5,
+    "dimensions": 2.5,
+    "png_shrink": 6.5,
+    "png_grow": 6.5,
+    "quality_ssim": 4.5,
+}
+
+# Pillow解码WebP本身的峰值内存（帧数），WebP的用例在上限之外另外允许
+WEBP_DECODE_FRAMES = 4
+
+# 支持按质量查找目标大小的有损格式
+LOSSY_EXTENSIONS = ("jpg", "webp")
+
+# 按目标SSIM查找质量值的用例使用的目标值（需要numpy，未安装时跳过）
+TARGET_SSIM = 0.95
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+
+def create_image(mode, size, seed):
+    """生成固定内容的合成图片：分形细节、渐变和固定种子的噪声"""
+    width, height = size
+    fractal = Image.effect_mandelbrot(size, (-2.0, -1.2, 1.0, 1.2), 200)
+    gradient = Image.linear_gradient("L").resize(size)
+    rng = random.Random(seed)
+    noise = Image.frombytes("L", size, rng.randbytes(width * height))
+    image = Image.merge("RGB", (fractal, gradient, Image.blend(fractal, noise, 0.5)))
+    image = Image.blend(image, Image.merge("RGB", (noise, noise, noise)), 0.15)
+
+    if mode == "RGBA":
+        image.putalpha(Image.radial_gradient("L").resize(size))
+    elif mode == "P":
+        image = image.convert("P", palette=Image.ADAPTIVE, colors=64)
+    return image
+
+
+def create_corpus(corpus_dir, scale=1.0):
+    """生成合成图片集，返回{名称: 文件路径}"""
+    paths = {}
+    for index, (name, ext, mode, size) in enumerate(CORPUS):
+        size = (max(16, int(size[0] * scale)), max(16, int(size[1] * scale)))
+        path = os.path.join(corpus_dir, f"{name}.{ext}")
+        image = create_image(mode, size, seed=index)
+        if ext == "jpg":
+            image.save(path, format="JPEG", quality=92)
+        elif ext == "webp":
+            image.save(path, format="WEBP", quality=90)
+        else:
+            image.save(path)
+        paths[name] = path
+    return paths
+
+
+def build_cases(corpus):
+    """根据图片集生成全部基准测试用例，每个用例的max_frames为其峰值内存上限"""
+    cases = []
+    for name, ext, mode, size in CORPUS:
+        path = corpus[name]
+        source_kb = os.path.getsize(path) / 1024
+
+        cases.append({"id": f"{name}/quality", "path": path, "op": "quality", "quality": 75, "target_kb": 0})
+        if ext in LOSSY_EXTENSIONS:
+            cases.append({"id": f"{name}/quality_target", "path": path, "op": "quality", "quality": 85,
+                          "target_kb": max(1, int(source_kb * 0.3))})
+            if HAS_NUMPY:
+                cases.append({"id": f"{name}/quality_ssim", "path": path, "op": "quality", "quality": 85,
+                              "target_kb": 0, "target_ssim": TARGET_SSIM})
+        if ext == "png":
+            cases.append({"id": f"{name}/png_shrink", "path": path, "op": "quality", "quality": 85,
+                          "target_kb": max(1, int(source_kb * 0.5))})
+            cases.append({"id": f"{name}/png_grow", "path": path, "op": "quality", "quality": 85,
+                          "target_kb": max(1, int(source_kb * 1.5))})
+
+        with Image.open(path) as img:
+            width, height = img.size
+        cases.append({"id": f"{name}/dimensions", "path": path, "op": "dimensions",
+                      "width": width // 4, "height": height // 4, "target_kb": 0})
+
+    for case in cases:
+        bound = FRAME_BOUNDS[case["id"].split("/")[1]]
+        case["max_frames"] = bound + WEBP_DECODE_FRAMES if case["path"].endswith(".webp") else bound
+    return cases
+
+
+def peak_rss_mb():
+    """当前进程的峰值内存（MB）"""
+    # Linux下优先读取VmHWM：ru_maxrss在exec后会保留父进程的峰值，不能反映子进程本身
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def process(resizer, case, target_kb):
+    """用resizer对已加载的图片执行用例的处理"""
+    if case["op"] == "quality":
+        return resizer.process_image_quality(case["quality"], target_kb, target_ssim=case.get("target_ssim", 0))
+    return resizer.process_image_dimensions(case["width"], case["height"])
+
+
+def warm_up(case):
+    """测量前用同格式的小图片执行一次相同的处理
+
+    第一次编解码时才会加载的库代码、numpy和内存分配器的初始开销与图片大小无关，
+    预先执行一次后，峰值内存的增量（帧数）只反映与图片大小成正比的部分。
+    """
+    # 只读取文件头，解码原图会抬高峰值内存的基准
+    with Image.open(case["path"]) as img:
+        img_format, mode = img.format, img.mode
+    buffer = io.BytesIO()
+    create_image(mode, WARM_UP_SIZE, seed=0).save(buffer, format=img_format)
+    with ImageResizer(quiet=True) as resizer:
+        resizer.load_image_data(buffer.getvalue())
+        process(resizer, dict(case, width=WARM_UP_SIZE[0] // 2, height=WARM_UP_SIZE[1] // 2), 1 if case["target_kb"] else 0)
+
+
+def run_case(case):
+    """在当前进程中运行一个用例，返回测量结果"""
+    resizer = ImageResizer(quiet=True)
+    output_path = os.path.join(tempfile.mkdtemp(), "out" + os.path.splitext(case["path"])[1])
+    with Image.open(case["path"]) as img:
+        frame_bytes = decoded_bytes(img.size, img.mode)
+    warm_up(case)
+    baseline_rss = peak_rss_mb()
+    tracemalloc.start()
+
+    start_time = time.perf_counter()
+    success = resizer.load_image(case["path"]) and process(resizer, case, case["target_kb"])
+    process_time = time.perf_counter() - start_time
+    encodes = resizer.encode_count
+    if success and resizer.processed_image is not None:
+        # 放大（如PNG增大文件）时以处理结果的大小为一帧
+        frame_bytes = max(frame_bytes, decoded_bytes(resizer.processed_image.size, resizer.processed_image.mode))
+
+    start_time = time.perf_counter()
+    success = success and resizer.save_image(output_path)
+    save_time = time.perf_counter() - start_time
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    peak_rss = peak_rss_mb()
+
+    output_size = os.path.getsize(output_path) if success else 0
+    if success:
+        os.remove(output_path)
+    os.rmdir(os.path.dirname(output_path))
+
+    target = case["target_kb"] * 1024
+    return {
+        "id": case["id"],
+        "success": bool(success),
+        "process_seconds": round(process_time, 4),
+        "save_seconds": round(save_time, 4),
+        "wall_seconds": round(process_time + save_time, 4),
+        "encodes": encodes,
+        "save_encodes": resizer.encode_count - encodes,
+        "probes": resizer.last_search_probes,
+        "output_size": output_size,
+        "target_size": target or None,
+        "size_error": round((output_size - target) / target, 4) if target and success else None,
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss,
+        "frame_mb": round(frame_bytes / (1024 * 1024), 1),
+        "peak_frames": round((peak_rss - baseline_rss) * 1024 * 1024 / frame_bytes, 2) if peak_rss is not None else None,
+        "max_frames": case["max_frames"],
+        "peak_traced_mb": round(traced_peak / (1024 * 1024), 1),
+        "stages": resizer.stats.to_dict()["stages"],
+    }
+
+
+def run_case_isolated(case):
+    """在独立的子进程中运行用例，使峰值内存只反映这一个用例"""
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_commit():
+    """当前提交的哈希值，不在git仓库中时返回None"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """打印与基准结果的比较"""
+    baseline_results = {r["id"]: r for r in baseline["results"]}
+    print(f"\n与 {baseline['meta'].get('commit') or '基准结果'} 比较:")
+    print(f"{'用例':<28} {'耗时(s)':>17} {'变化':>8} {'编码次数':>9} {'峰值内存(MB)':>17}")
+    for r in results:
+        old = baseline_results.get(r["id"])
+        if not old:
+            print(f"{r['id']:<28} {'(新用例)':>17}")
+            continue
+        change = (r["wall_seconds"] / old["wall_seconds"] - 1) if old["wall_seconds"] else 0
+        encodes = f"{old['encodes']}->{r['encodes']}"
+        rss = f"{old['peak_rss_mb']}->{r['peak_rss_mb']}"
+        print(f"{r['id']:<28} {old['wall_seconds']:>8.3f}->{r['wall_seconds']:<8.3f} {change:>+8.1%} {encodes:>9} {rss:>17}")
+
+
+def print_results(results):
+    """以表格形式打印结果"""
+    print(f"{'用例':<28} {'处理(s)':>8} {'保存(s)':>8} {'编码次数':>8} {'峰值内存(MB)':>12} {'帧数':>6} {'traced(MB)':>10} {'大小误差':>9}")
+    for r in results:
+        if not r["success"]:
+            print(f"{r['id']:<28} 失败")
+            continue
+        error = f"{r['size_error']:+.1%}" if r["size_error"] is not None else "-"
+        rss = r["peak_rss_mb"] if r["peak_rss_mb"] is not None else "-"
+        frames = r["peak_frames"] if r["peak_frames"] is not None else "-"
+        print(f"{r['id']:<28} {r['process_seconds']:>8.3f} {r['save_seconds']:>8.3f} {r['encodes']:>8} {rss:>12} "
+              f"{frames:>6} {r['peak_traced_mb']:>10} {error:>9}")
+
+
+def check_frames(results, max_frames=None):
+    """检查每个用例的峰值内存不超过其上限（指定max_frames时所有用例都使用该上限），返回超出的用例"""
+    exceeded = []
+    for r in results:
+        bound = max_frames if max_frames is not None else r["max_frames"]
+        if r["peak_frames"] is not None and r["peak_frames"] > bound:
+            exceeded.append(r)
+            print(f"超出内存上限: {r['id']} 峰值为 {r['peak_frames']} 帧（{r['frame_mb']}MB/帧），上限为 {bound} 帧",
+                  file=sys.stderr)
+    return exceeded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="图片处理基准测试")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数，取最短耗时，默认3")
+    parser.add_argument("--scale", type=float, default=1.0, help="合成图片的尺寸缩放比例，如0.25可快速运行，默认1.0")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的用例，如 png 或 /dimensions")
+    parser.add_argument("--output", help="把结果保存为JSON文件")
+    parser.add_argument("--compare", help="与之前保存的JSON结果比较")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    parser.add_argument("--check-memory", action="store_true",
+                        help="检查每个用例的峰值内存增量（原图解码后大小的倍数）不超过其处理路径的上限，超出时返回1")
+    parser.add_argument("--max-frames", type=float, help="与--check-memory相同，但所有用例都使用这个上限")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return 0
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus = create_corpus(temp_dir, args.scale)
+        cases = [case for case in build_cases(corpus) if args.filter in case["id"]]
+
+        results = []
+        for case in cases:
+            runs = [run_case_isolated(case) for _ in range(max(1, args.repeat))]
+            best = min(runs, key=lambda r: r["wall_seconds"])
+            if best["peak_rss_mb"] is not None:
+                best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in runs)
+            results.append(best)
+            if not args.json:
+                print(f"完成 {case['id']}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_results(results)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+    if (args.check_memory or args.max_frames is not None) and check_frames(results, args.max_frames):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import struct
+import argparse
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from image_resizer import add_processing_arguments, add_instrumentation_arguments, processing_options
+from batch_processor import (OUTPUT_FOLDER_NAME, BatchManifest, FileFilter, add_filter_arguments, create_file_filter,
+                             scan_directory, build_output_path, find_output_conflict, process_file, print_result,
+                             print_failure, _new_result)
+from result_cache import add_cache_arguments, write_file_atomic
+from processing_stats import JsonlStatsSink
+
+# 文件大小和修改时间保持不变多久（秒）后认为已写入完成
+DEFAULT_SETTLE_SECONDS = 2.0
+
+# 轮询模式的扫描间隔（秒）
+DEFAULT_POLL_INTERVAL = 2.0
+
+# 输出状态行的间隔（秒）
+DEFAULT_STATUS_INTERVAL = 60
+
+# 主循环的最长等待时间（秒），也是检查文件是否写入完成的间隔
+MAX_TICK = 0.5
+
+# 本次运行中记录的已处理文件数上限，超过时忘记最早的记录（只是可能重复处理，由清单跳过）
+MAX_PROCESSED_ENTRIES = 100000
+
+# inotify事件（见inotify(7)）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_MOVED_FROM
+
+# inotify事件头：wd、mask、cookie、文件名长度
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """用Linux的inotify（通过ctypes调用libc）监视目录，文件创建、写入后关闭、移入、删除或移走时返回
+
+    recursive为True时同时监视所有子文件夹，包括之后新建的子文件夹；跳过输出文件夹。
+    只按文件名筛选，文件大小在写入完成后由调用方判断。
+    """
+
+    backend = "inotify"
+
+    def __init__(self, roots, recursive=False, file_filter=None, skip_dirs=()):
+        import ctypes
+        import ctypes.util
+
+        self.roots = roots
+        self.recursive = recursive
+        self.file_filter = file_filter or FileFilter()
+        self.skip = {os.path.abspath(path) for path in skip_dirs}
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        # 监视描述符 -> (目录, 扫描的根目录, 相对于根目录的路径)
+        self.watches = {}
+
+    def close(self):
+        os.close(self.fd)
+
+    def scan(self):
+        """监视所有目录，并返回目录中已有的图片 [(文件路径, 扫描的根目录)]"""
+        files = []
+        for root in self.roots:
+            files.extend(self._watch_tree(root, root, ""))
+        return files
+
+    def _watch_tree(self, directory, root, rel_dir):
+        """监视目录（recursive时包括子文件夹），返回其中已有的图片
+
+        先监视再列出文件，监视开始前后写入的文件都不会遗漏（可能重复返回，由调用方去重）。
+        """
+        self._add_watch(directory, root, rel_dir)
+        files = []
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return files
+
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir():
+                    if self._should_watch(entry.path, entry.name):
+                        files.extend(self._watch_tree(entry.path, root, rel_path))
+                elif entry.is_file() and self.file_filter.match_name(rel_path):
+                    files.append((entry.path, root))
+            except OSError:
+                continue
+        return files
+
+    def _should_watch(self, directory, name):
+        """是否监视子文件夹：跳过输出文件夹"""
+        return self.recursive and name != OUTPUT_FOLDER_NAME and os.path.abspath(directory) not in self.skip
+
+    def _add_watch(self, directory, root, rel_dir):
+        import ctypes
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            # 目录在监视前被删除时忽略；其他错误（如超过max_user_watches）抛出
+            if code == errno.ENOENT:
+                return
+            raise OSError(code, f"无法监视目录 {directory}: {os.strerror(code)}")
+        self.watches[wd] = (directory, root, rel_dir)
+
+    def read(self, timeout):
+        """等待最多timeout秒，返回发生变化的图片 [(文件路径, 扫描的根目录)]"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        files = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0")
+            offset += INOTIFY_EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # 事件太多时内核会丢弃事件，重新扫描所有目录
+                files.extend(self.scan())
+                continue
+            if mask & IN_IGNORED:
+                # 目录已被删除
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name:
+                continue
+
+            directory, root, rel_dir = self.watches[wd]
+            name = os.fsdecode(name)
+            path = os.path.join(directory, name)
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            if mask & IN_ISDIR:
+                if self._should_watch(path, name):
+                    files.extend(self._watch_tree(path, root, rel_path))
+            elif self.file_filter.match_name(rel_path):
+                files.append((path, root))
+        return files
+
+
+class PollingWatcher:
+    """定期扫描目录（不支持inotify时使用），返回新增、删除或大小、修改时间变化的图片
+
+    与InotifyWatcher一致，只按文件名筛选。
+    """
+
+    backend = "polling"
+
+    def __init__(self, roots, recursive=False, file_filter=None, skip_dirs=(), interval=DEFAULT_POLL_INTERVAL):
+        self.roots = roots
+        self.recursive = recursive
+        file_filter = file_filter or FileFilter()
+        self.file_filter = FileFilter(file_filter.include, file_filter.exclude)
+        self.skip_dirs = skip_dirs
+        self.interval = interval
+        self.snapshot = {}
+        self.next_scan = 0.0
+
+    def close(self):
+        pass
+
+    def scan(self):
+        """扫描所有目录，返回发生变化的图片 [(文件路径, 扫描的根目录)]；第一次扫描返回所有已有的图片"""
+        snapshot = {}
+        files = []
+        for root in self.roots:
+            for file_path in scan_directory(root, self.recursive, self.file_filter, self.skip_dirs):
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                snapshot[file_path] = (stat.st_size, stat.st_mtime_ns)
+                if self.snapshot.get(file_path) != snapshot[file_path]:
+                    files.append((file_path, root))
+        # 已删除的文件也返回，由调用方清除其记录
+        files.extend((file_path, None) for file_path in self.snapshot if file_path not in snapshot)
+        self.snapshot = snapshot
+        self.next_scan = time.monotonic() + self.interval
+        return files
+
+    def read(self, timeout):
+        """等待最多timeout秒，到达扫描时间时扫描并返回发生变化的图片"""
+        wait = self.next_scan - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            return []
+        return self.scan()
+
+
+def create_watcher(roots, recursive=False, file_filter=None, skip_dirs=(), poll_interval=DEFAULT_POLL_INTERVAL,
+                   polling=False):
+    """创建目录监视器：Linux下优先使用inotify，不可用（或polling为True）时定期扫描"""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots, recursive, file_filter, skip_dirs)
+        except (OSError, AttributeError):
+            # 找不到libc或inotify实例数已达上限
+            pass
+    return PollingWatcher(roots, recursive, file_filter, skip_dirs, poll_interval)
+
+
+class FolderWatcher:
+    """监视文件夹的常驻处理：新图片写入完成后交给工作进程处理，只处理新增或变化的文件
+
+    文件的大小和修改时间在settle秒内保持不变才认为已写入完成，连续写入（或一次拷贝大量文件）期间
+    只在最后一次变化之后处理一次。manifest为BatchManifest时记录每个文件的处理结果，
+    重新启动后跳过已完成的文件。同时处理的文件数不超过工作进程数，其余文件在队列中等待。
+    """
+
+    def __init__(self, roots, options, output_folder=None, workers=None, recursive=False, file_filter=None,
+                 settle=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL, polling=False, manifest=None,
+                 cache_config=None, stats_sink=None, on_result=None):
+        self.roots = roots
+        self.options = options
+        self.output_folder = output_folder
+        self.workers = workers or os.cpu_count() or 1
+        self.file_filter = file_filter or FileFilter()
+        self.settle = settle
+        self.manifest = manifest
+        self.cache_config = cache_config
+        self.stats_sink = stats_sink
+        self.on_result = on_result
+        self.watcher = create_watcher(roots, recursive, file_filter, [output_folder] if output_folder else (),
+                                      poll_interval, polling)
+
+        # 等待写入完成的文件：路径 -> [根目录, (大小, 修改时间), 最后一次变化的时间, 发现的时间]
+        self.settling = {}
+        # 已写入完成、等待处理的文件：(路径, 根目录, 发现的时间)
+        self.queued = collections.deque()
+        # 正在处理的文件：future -> (路径, 输出路径, 发现的时间, 提交到的进程池)
+        self.active = {}
+        # 本次运行中已成功处理的文件及其(大小, 修改时间)，避免同一文件重复处理；
+        # 文件被删除时清除，最多记录MAX_PROCESSED_ENTRIES个
+        self.processed = {}
+        self.counters = {
+            "detected": 0,
+            "skipped": 0,
+            "success": 0,
+            "failed": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+            "latency_last": 0.0,
+            "pool_restarts": 0,
+        }
+        self.executor = None
+        self.started = time.time()
+
+    def status(self):
+        """返回队列深度和延迟等计数
+
+        settling为等待写入完成的文件数，queued为等待处理的文件数，active为正在处理的文件数；
+        延迟为从发现文件到处理完成的时间（秒，包括等待写入完成的时间）。
+        """
+        completed = self.counters["success"] + self.counters["failed"]
+        return {
+            "backend": self.watcher.backend,
+            "workers": self.workers,
+            "settling": len(self.settling),
+            "queued": len(self.queued),
+            "active": len(self.active),
+            "detected": self.counters["detected"],
+            "skipped": self.counters["skipped"],
+            "success": self.counters["success"],
+            "failed": self.counters["failed"],
+            "latency_avg": round(self.counters["latency_total"] / completed, 4) if completed else 0.0,
+            "latency_max": round(self.counters["latency_max"], 4),
+            "latency_last": round(self.counters["latency_last"], 4),
+            "pool_restarts": self.counters["pool_restarts"],
+            "started": self.started,
+            "updated": time.time(),
+        }
+
+    def run(self, stop, status_interval=DEFAULT_STATUS_INTERVAL, status_file=None, on_status=None):
+        """运行直到stop（threading.Event）被设置，返回最终的计数
+
+        每隔status_interval秒把计数写入status_file（JSON）并调用on_status(status)。
+        停止时不再开始处理新文件，等待正在处理的文件完成。
+        """
+        tick = max(0.05, min(MAX_TICK, self.settle / 2))
+        next_status = time.monotonic() + status_interval
+        self.executor = self._new_executor()
+        try:
+            for file_path, root in self.watcher.scan():
+                self._changed(file_path, root)
+
+            while not stop.is_set():
+                if self.active:
+                    # 有文件正在处理时等待其中一个完成，完成后立即提交下一个文件
+                    wait(self.active, timeout=tick, return_when=FIRST_COMPLETED)
+                    changes = self.watcher.read(0)
+                else:
+                    changes = self.watcher.read(tick)
+                for file_path, root in changes:
+                    self._changed(file_path, root)
+                self._check_settled()
+                self._submit()
+                self._collect(wait=False)
+
+                if status_interval > 0 and time.monotonic() >= next_status:
+                    next_status = time.monotonic() + status_interval
+                    self._report(status_file, on_status)
+        finally:
+            self._collect(wait=True)
+            self.executor.shutdown()
+            self.watcher.close()
+
+        self._report(status_file, None)
+        return self.status()
+
+    def _changed(self, file_path, root):
+        """记录新增或发生变化的文件，重新开始等待写入完成"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            # 文件已被删除或移走
+            self.settling.pop(file_path, None)
+            self.processed.pop(file_path, None)
+            return
+
+        now = time.monotonic()
+        signature = (stat.st_size, stat.st_mtime_ns)
+        entry = self.settling.get(file_path)
+        if entry is None:
+            if self.processed.get(file_path) == signature:
+                return
+            self.counters["detected"] += 1
+            self.settling[file_path] = [root, signature, now, now]
+        elif entry[1] != signature:
+            entry[1] = signature
+            entry[2] = now
+
+    def _check_settled(self):
+        """把大小和修改时间在settle秒内没有变化的文件移入等待处理的队列"""
+        now = time.monotonic()
+        for file_path, entry in list(self.settling.items()):
+            root, signature, changed, detected = entry
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                del self.settling[file_path]
+                continue
+
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                entry[1] = current
+                entry[2] = now
+            elif now - changed >= self.settle:
+                del self.settling[file_path]
+                if self.file_filter.needs_size() and not self.file_filter.match_size(stat.st_size):
+                    continue
+                self.queued.append((file_path, root, detected))
+
+    def _new_executor(self):
+        """创建工作进程池"""
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_ignore_interrupt)
+
+    def _restart_executor(self):
+        """工作进程异常退出（如被OOM终止）后进程池无法再使用，替换为新的进程池"""
+        self.executor.shutdown(wait=False)
+        self.executor = self._new_executor()
+        self.counters["pool_restarts"] += 1
+
+    def _submit(self):
+        """提交等待处理的文件，同时处理的文件数不超过工作进程数"""
+        while self.queued and len(self.active) < self.workers:
+            file_path, root, detected = self.queued[0]
+            output_path = build_output_path(file_path, self.output_folder, root)
+            if self.manifest and self.manifest.is_done(file_path, output_path):
+                self.queued.popleft()
+                self.counters["skipped"] += 1
+                continue
+            try:
+                future = self.executor.submit(process_file, (file_path, output_path, self.options, self.cache_config))
+            except BrokenProcessPool:
+                # 进程池已损坏但正在处理的文件都已收集（否则在_collect中替换），替换后下次再提交
+                if self.active:
+                    break
+                self._restart_executor()
+                continue
+            self.queued.popleft()
+            self.active[future] = (file_path, output_path, detected, self.executor)
+
+    def _collect(self, wait):
+        """处理已完成的文件的结果；wait为True时等待所有正在处理的文件完成
+
+        工作进程异常退出时，正在处理的文件都记为失败，并替换进程池。
+        """
+        broken = False
+        for future in list(self.active):
+            if not wait and not future.done():
+                continue
+            file_path, output_path, detected, executor = self.active.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # 只替换当前的进程池，已被替换的进程池中的文件不会导致再次替换
+                broken = broken or (isinstance(e, BrokenProcessPool) and executor is self.executor)
+                result = _new_result(file_path, output_path)
+                result["error"] = f"错误: 工作进程异常退出: {str(e)}" if isinstance(e, BrokenProcessPool) else f"错误: {str(e)}"
+
+            latency = time.monotonic() - detected
+            self.counters["latency_total"] += latency
+            self.counters["latency_max"] = max(self.counters["latency_max"], latency)
+            self.counters["latency_last"] = latency
+
+            if result["success"]:
+                self.counters["success"] += 1
+                self.processed.pop(file_path, None)
+                self.processed[file_path] = (result["input_size"], result["input_mtime_ns"])
+                if len(self.processed) > MAX_PROCESSED_ENTRIES:
+                    del self.processed[next(iter(self.processed))]
+            else:
+                self.counters["failed"] += 1
+            if self.manifest:
+                self.manifest.record(result)
+            if self.stats_sink and result["stats"]:
+                self.stats_sink.write(result["stats"])
+            if self.on_result:
+                self.on_result(result, self.counters["success"] + self.counters["failed"], None)
+
+        if broken:
+            self._restart_executor()
+
+    def _report(self, status_file, on_status):
+        """写入状态文件并调用on_status"""
+        status = self.status()
+        if status_file:
+            write_file_atomic(status_file, json.dumps(status, ensure_ascii=False, indent=2).encode("utf-8"))
+        if on_status:
+            on_status(status)
+
+
+def _ignore_interrupt():
+    """工作进程忽略Ctrl+C，由主进程停止监视并等待正在处理的文件完成"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def print_status(status):
+    """打印一行队列深度和延迟"""
+    print(f"[状态] 等待写入完成 {status['settling']} 个, 排队 {status['queued']} 个, 处理中 {status['active']} 个 | "
+          f"成功 {status['success']} 个, 失败 {status['failed']} 个, 跳过 {status['skipped']} 个 | "
+          f"延迟 平均 {status['latency_avg']:.2f}s, 最大 {status['latency_max']:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="image_resizer.py watch",
+                                     description="监视文件夹 - 常驻运行，新图片写入完成后自动处理，只处理新增或变化的文件")
+    parser.add_argument("inputs", nargs="+", help="要监视的图片目录")
+    parser.add_argument("-o", "--output-dir", help="输出文件夹，默认为原图所在文件夹下的resized_images。"
+                        "监视子文件夹时在输出文件夹中保持原来的子文件夹结构")
+    parser.add_argument("-r", "--recursive", action="store_true", help="同时监视所有子文件夹（包括之后新建的子文件夹）")
+    add_filter_arguments(parser)
+    parser.add_argument("-j", "--workers", type=int, default=0, help="同时处理的文件数（工作进程数），默认为CPU核心数")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help=f"文件大小和修改时间保持不变多少秒后开始处理，默认为{DEFAULT_SETTLE_SECONDS}")
+    parser.add_argument("--polling", action="store_true", help="定期扫描目录，不使用inotify（如网络文件系统上inotify收不到其他机器写入的文件）")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"轮询模式的扫描间隔(秒)，默认为{DEFAULT_POLL_INTERVAL}")
+    parser.add_argument("--status-interval", type=float, default=DEFAULT_STATUS_INTERVAL,
+                        help=f"输出队列深度和延迟的间隔(秒)，0为不输出，默认为{DEFAULT_STATUS_INTERVAL}")
+    parser.add_argument("--status-file", help="状态文件(JSON)，按--status-interval的间隔写入队列深度、处理数量和延迟")
+    add_processing_arguments(parser)
+    parser.add_argument("--manifest", help="处理清单文件(JSON Lines)，与批量处理相同。重新启动后跳过已完成的文件")
+    add_cache_arguments(parser)
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args(argv)
+    options = processing_options(args)
+
+    if args.method == "dimensions" and (args.width <= 0 or args.height <= 0):
+        print("\n错误: 使用dimensions方法时，必须指定宽度和高度")
+        return 1
+    for item in args.inputs:
+        if not os.path.isdir(item):
+            print(f"\n错误: 目录不存在: {item}")
+            return 1
+    conflict = find_output_conflict(args.inputs, args.output_dir)
+    if conflict:
+        # 输出的图片（临时文件重命名为目标文件时）会被当作新图片再次处理，无限循环
+        print(f"\n错误: 输出文件夹不能是监视的目录或包含监视的目录: {conflict}")
+        return 1
+    if args.settle < 0 or args.poll_interval <= 0:
+        print("\n错误: 等待时间不能小于0，扫描间隔必须大于0")
+        return 1
+
+    cache_config = (args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+    manifest = BatchManifest(args.manifest, options) if args.manifest else None
+    stats_sink = JsonlStatsSink(args.stats_jsonl) if args.stats_jsonl else None
+    watcher = FolderWatcher(args.inputs, options, args.output_dir, args.workers, args.recursive,
+                            create_file_filter(args), args.settle, args.poll_interval, args.polling, manifest,
+                            cache_config, stats_sink, on_result=print_failure if args.quiet else print_result)
+
+    # Ctrl+C或SIGTERM时停止监视，等待正在处理的文件完成
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stop.set())
+
+    if not args.quiet:
+        print(f"开始监视: {', '.join(args.inputs)}（{watcher.watcher.backend}，工作进程: {watcher.workers} 个）")
+        print("按 Ctrl+C 停止")
+    status = watcher.run(stop, args.status_interval, args.status_file, None if args.quiet else print_status)
+
+    if not args.quiet:
+        print(f"\n已停止监视:")
+        print_status(status)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 布尔类型编码参数可以使用的取值
+BOOL_VALUES = {"1": True, "true": True, "yes": True, "0": False, "false": False, "no": False}
+
+
+class EncoderKnob:
+    """一个编码参数：名称、类型、默认值和可选值
+
+    affects说明参数主要影响的是输出大小（"size"）还是编码耗时（"cost"），或两者都影响（"both"）。
+    默认值为None时使用Pillow的默认值。
+    """
+
+    def __init__(self, name, kind, default=None, choices=None, affects="size", description=""):
+        self.name = name
+        self.kind = kind
+        self.default = default
+        self.choices = choices
+        self.affects = affects
+        self.description = description
+
+    def convert(self, value):
+        """把字符串（如命令行参数）转换为参数值，取值无效时抛出ValueError"""
+        if not isinstance(value, str):
+            result = value
+        elif self.kind is bool:
+            if value.lower() not in BOOL_VALUES:
+                raise ValueError(f"编码参数{self.name}必须是true或false")
+            result = BOOL_VALUES[value.lower()]
+        elif self.kind is int:
+            try:
+                result = int(value)
+            except ValueError:
+                raise ValueError(f"编码参数{self.name}必须是整数")
+        else:
+            result = value
+
+        if self.choices is not None and result not in self.choices:
+            choices = f"{min(self.choices)}-{max(self.choices)}" if isinstance(self.choices, range) else "、".join(self.choices)
+            raise ValueError(f"编码参数{self.name}必须是 {choices} 之一")
+        return result
+
+
+class FormatStrategy:
+    """一种输出格式的编码策略：声明哪些编码参数影响大小和耗时，并生成保存时使用的参数
+
+    supports_quality为True的格式可以按目标大小或目标SSIM/PSNR查找质量值，查找范围为min_quality到100；
+    lossy为True的格式在不查找时也使用质量值编码（有损格式）。
+    """
+
+    format = ""
+    pil_format = ""
+    supports_quality = False
+    min_quality = 1
+    lossy = False
+    knobs = ()
+    # 可以直接保存的颜色模式，None为不限制；其他模式在编码前转换为convert_mode
+    modes = None
+    convert_mode = "RGB"
+
+    def quality_supported(self, options=None):
+        """使用这些编码参数（见save_params）时是否可以按质量值查找"""
+        return self.supports_quality
+
+    def get_knob(self, name):
+        """返回指定名称的编码参数，格式不支持该参数时返回None"""
+        for knob in self.knobs:
+            if knob.name == name:
+                return knob
+        return None
+
+    def save_params(self, quality=None, options=None):
+        """生成Image.save()的参数
+
+        options为用户指定的编码参数（如{"method": 6}），只使用本格式支持的参数；
+        quality不为None且格式支持质量值时加入质量参数。
+        """
+        params = {knob.name: knob.default for knob in self.knobs if knob.default is not None}
+        for name, value in (options or {}).items():
+            if self.get_knob(name) is not None:
+                params[name] = value
+        if quality is not None and self.quality_supported(options):
+            params.update(self.quality_params(quality))
+        return params
+
+    def quality_params(self, quality):
+        """质量值对应的编码参数"""
+        return {"quality": quality}
+
+    def prepare(self, image, params):
+        """把图片转换为可以用这些参数保存的颜色模式"""
+        if self.modes is not None and image.mode not in self.modes:
+            return image.convert(self.convert_mode)
+        return image
+
+
+class JpegStrategy(FormatStrategy):
+    format = "jpeg"
+    pil_format = "JPEG"
+    supports_quality = True
+    lossy = True
+    knobs = (
+        EncoderKnob("optimize", bool, affects="both", description="优化哈夫曼表，文件略小，编码稍慢"),
+        EncoderKnob("progressive", bool, affects="both", description="渐进式JPEG，通常略小，编码稍慢"),
+        EncoderKnob("subsampling", str, choices=("4:4:4", "4:2:2", "4:2:0"), description="色度抽样，4:2:0最小"),
+    )
+    modes = ("L", "RGB", "CMYK")
+
+
+class WebpStrategy(FormatStrategy):
+    format = "webp"
+    pil_format = "WEBP"
+    supports_quality = True
+    lossy = True
+    knobs = (
+        EncoderKnob("method", int, choices=range(0, 7), affects="both", description="压缩方法(0-6)，越大文件越小、编码越慢"),
+        EncoderKnob("lossless", bool, description="无损压缩"),
+    )
+
+
+class PngStrategy(FormatStrategy):
+    format = "png"
+    pil_format = "PNG"
+    knobs = (
+        EncoderKnob("compress_level", int, choices=range(0, 10), affects="both", description="zlib压缩级别(0-9)，越大文件越小、编码越慢"),
+        EncoderKnob("optimize", bool, affects="both", description="尽量压缩到最小，编码明显变慢"),
+    )
+
+
+class GifStrategy(FormatStrategy):
+    format = "gif"
+    pil_format = "GIF"
+    knobs = (
+        EncoderKnob("optimize", bool, affects="both", description="去掉未使用的调色板颜色"),
+    )
+
+
+class TiffStrategy(FormatStrategy):
+    """TIFF默认不压缩；按质量值查找时使用JPEG压缩，用户指定了其他压缩方式时不使用质量值"""
+
+    format = "tiff"
+    pil_format = "TIFF"
+    supports_quality = True
+    # libtiff的JPEG压缩在质量值低于24时量化表超出基线JPEG的范围，每次编码都会输出警告
+    min_quality = 24
+    knobs = (
+        EncoderKnob("compression", str, choices=("raw", "tiff_lzw", "tiff_adobe_deflate", "packbits", "jpeg"),
+                    description="压缩方式，jpeg为有损压缩"),
+    )
+
+    def quality_supported(self, options=None):
+        return (options or {}).get("compression", "jpeg") == "jpeg"
+
+    def quality_params(self, quality):
+        return {"compression": "jpeg", "quality": max(quality, self.min_quality)}
+
+    def prepare(self, image, params):
+        # JPEG压缩只支持灰度和RGB
+        if params.get("compression") == "jpeg" and image.mode not in ("L", "RGB"):
+            return image.convert("RGB")
+        return image
+
+
+class BmpStrategy(FormatStrategy):
+    format = "bmp"
+    pil_format = "BMP"
+
+
+# 格式名称（小写，见image_resizer.normalize_format）到编码策略的映射，新格式在这里注册
+FORMAT_STRATEGIES = {strategy.format: strategy() for strategy in (
+    JpegStrategy, WebpStrategy, PngStrategy, GifStrategy, TiffStrategy, BmpStrategy)}
+
+
+def get_strategy(img_format):
+    """返回格式的编码策略，未注册的格式使用不带任何参数的通用策略"""
+    strategy = FORMAT_STRATEGIES.get(img_format)
+    if strategy is None:
+        strategy = FormatStrategy()
+        strategy.format = img_format
+        strategy.pil_format = img_format.upper()
+    return strategy
+
+
+def parse_encoder_option(text):
+    """解析 名称=值 形式的编码参数（如 method=6），返回(名称, 值)，无效时抛出ValueError
+
+    同一名称可能被多种格式支持（如optimize），每种格式只使用自己支持的参数。
+    """
+    name, sep, value = text.partition("=")
+    name = name.strip()
+    if not sep or not name:
+        raise ValueError(f"无效的编码参数: {text}（格式为 名称=值）")
+
+    for strategy in FORMAT_STRATEGIES.values():
+        knob = strategy.get_knob(name)
+        if knob is not None:
+            return name, knob.convert(value.strip())
+
+    names = sorted({knob.name for strategy in FORMAT_STRATEGIES.values() for knob in strategy.knobs})
+    raise ValueError(f"未知的编码参数: {name}（可用: {'、'.join(names)}）")
@@ -4,111 +4,382 @@
 import os
 import sys
 import argparse
+import math
+import base64
+import struct
+import zlib
 from PIL import Image
 import io
+from result_cache import add_cache_arguments, create_cache, write_file_atomic
+from processing_stats import ProcessingStats, JsonlStatsSink
+from format_strategies import get_strategy, parse_encoder_option
+from tiled_processing import DEFAULT_MEMORY_LIMIT_MB, BandReader, decoded_bytes, lift_pixel_limit, resize_in_bands
+
+# 目标大小的允许误差（比例）
+SIZE_TOLERANCE = 0.05
+
+# 质量模型：样本图片的最大边长和采样的质量值
+QUALITY_MODEL_SIDE = 512
+QUALITY_MODEL_POINTS = (5, 20, 40, 60, 75, 85, 92, 97, 100)
+
+# 按目标SSIM/PSNR查找时第一次尝试的质量值
+METRIC_INITIAL_QUALITY = 80
+
+# PNG缩放查找：缩放比例范围、最小间隔和最多编码次数
+PNG_MIN_SCALE = 0.3
+PNG_MAX_SCALE = 3.0
+PNG_SCALE_STEP = 0.005
+PNG_SCALE_MAX_PROBES = 8
+
+# PNG填充：tEXt块的关键字、每个块的固定开销（长度、类型、CRC和关键字）以及单块最大文本长度
+PNG_PADDING_KEYWORD = b"padding"
+PNG_PADDING_OVERHEAD = 12 + len(PNG_PADDING_KEYWORD) + 1
+PNG_MAX_CHUNK_TEXT = 2 ** 31 - 1 - len(PNG_PADDING_KEYWORD) - 1
+
+# 生成多个尺寸的变体时，只从至少大这么多倍的已生成图片继续缩小，否则从原图缩小，避免两次重采样损失细节
+VARIANT_CASCADE_RATIO = 2.0
+
+
+# 重采样预设：值为两阶段缩放的reducing_gap
+#   quality  - 直接从原图做LANCZOS缩放，质量最好
+#   balanced - 先用Image.reduce整数倍缩小到目标尺寸的3倍以内，再做LANCZOS
+#   fast     - 先用Image.reduce整数倍缩小到目标尺寸的2倍以内，再做LANCZOS
+RESAMPLE_PRESETS = {
+    "quality": None,
+    "balanced": 3.0,
+    "fast": 2.0,
+}
+
+# 处理参数的默认值（与命令行参数的默认值一致）
+DEFAULT_OPTIONS = {
+    "method": "quality",
+    "quality": 85,
+    "target_size": 0,
+    "target_ssim": 0.0,
+    "target_psnr": 0.0,
+    "metric_side": 0,
+    "width": 0,
+    "height": 0,
+    "keep_ratio": True,
+    "search": "model",
+    "fast_decode": True,
+    "resample": "quality",
+    "encoder_options": {},
+    "memory_limit": DEFAULT_MEMORY_LIMIT_MB,
+}
+
+# 格式名称的别名
+FORMAT_ALIASES = {
+    "jpg": "jpeg",
+    "tif": "tiff",
+}
+
+
+def normalize_format(name):
+    """把扩展名或格式名称（如 jpg、JPEG、.tif）转换为统一的小写格式名称"""
+    img_format = name.lower().lstrip(".")
+    return FORMAT_ALIASES.get(img_format, img_format)
+
+
+def resample_image(image, size, preset="quality"):
+    """按重采样预设把图片缩放到指定尺寸
+    
+    缩小比例较大时，LANCZOS的耗时与原图覆盖的像素数成正比。两阶段缩放先用快速的整数倍盒式
+    缩小（Image.reduce）把图片缩到目标尺寸的几倍以内，再用LANCZOS完成剩余的缩放。
+    """
+    if preset not in RESAMPLE_PRESETS:
+        raise ValueError(f"未知的重采样预设: {preset}")
+    
+    reducing_gap = RESAMPLE_PRESETS[preset]
+    if reducing_gap is None:
+        return image.resize(size, Image.LANCZOS)
+    return image.resize(size, Image.LANCZOS, reducing_gap=reducing_gap)
+
+
+def _interpolate_log(model, quality):
+    """在质量模型上按对数大小插值，返回该质量值对应的样本大小"""
+    points = model["points"]
+    if quality <= points[0][0]:
+        return points[0][1]
+    for (q0, s0), (q1, s1) in zip(points, points[1:]):
+        if quality <= q1:
+            t = (quality - q0) / (q1 - q0)
+            return math.exp(math.log(s0) + t * (math.log(s1) - math.log(s0)))
+    return points[-1][1]
+
+
+def _inverse_interpolate_log(model, size):
+    """在质量模型上反推达到指定样本大小所需的质量值"""
+    points = model["points"]
+    if size <= points[0][1]:
+        return points[0][0]
+    for (q0, s0), (q1, s1) in zip(points, points[1:]):
+        if size <= s1:
+            if s1 == s0:
+                return q0
+            t = (math.log(size) - math.log(s0)) / (math.log(s1) - math.log(s0))
+            return q0 + t * (q1 - q0)
+    return points[-1][0]
+
+
+def _solve_calibrated(shape, anchors, target, lo, hi, integer=True):
+    """用实测点校准形状函数的比例，求解使估计值达到目标的参数
+    
+    只有一个实测点时比例为常数；有两个实测点时比例的对数随参数线性变化。
+    """
+    ratios = [(x, math.log(value / shape(x))) for x, value in anchors]
+    
+    def estimate(x):
+        if len(ratios) == 1:
+            log_ratio = ratios[0][1]
+        else:
+            (x0, r0), (x1, r1) = ratios
+            t = (x - x0) / (x1 - x0) if x1 != x0 else 0.0
+            log_ratio = r0 + t * (r1 - r0)
+        return math.log(shape(x)) + log_ratio
+    
+    # 估计值随参数单调递增，二分求解
+    log_target = math.log(target)
+    if estimate(lo) >= log_target:
+        return lo
+    if estimate(hi) <= log_target:
+        return hi
+    for _ in range(50):
+        if integer and hi - lo <= 1:
+            break
+        mid = (lo + hi) // 2 if integer else (lo + hi) / 2
+        if estimate(mid) <= log_target:
+            lo = mid
+        else:
+            hi = mid
+    if integer:
+        return lo if abs(estimate(lo) - log_target) <= abs(estimate(hi) - log_target) else hi
+    return (lo + hi) / 2
+
+
+class ProcessingCancelled(Exception):
+    """处理被取消（ImageResizer.cancel_check返回True）"""
+
 
 class ImageResizer:
-    def __init__(self):
+    def __init__(self, search_strategy="model", fast_decode=True, resample="quality", quiet=False, stats_sink=None,
+                 encoder_options=None, memory_limit=DEFAULT_MEMORY_LIMIT_MB * 1024 * 1024):
         self.source_image_path = ""
+        # 从内存加载时的原始图片数据，以及处理和保存时默认使用的格式
+        self.source_data = None
+        self.source_format = ""
+        # 图片只被替换、不在原处修改（写时复制），processed_image可以与original_image是同一个对象；
+        # 需要修改时（缩放、转换颜色模式）总是生成新图片
+        self.original_image = None
+        self.processed_image = None
+        # 缩小JPEG尺寸时是否直接以1/2、1/4或1/8比例解码（draft模式）
+        self.fast_decode = fast_decode
+        # 重采样预设，见RESAMPLE_PRESETS
+        self.resample = resample
+        # 目标大小查找策略："model"（样本模型+插值）或 "bisect"（二分查找）
+        self.search_strategy = search_strategy
+        self.last_search_probes = 0
+        # 用户指定的编码参数（如{"method": 6, "progressive": True}），每种格式只使用其编码策略支持的参数
+        self.encoder_options = dict(encoder_options or {})
+        # 原图解码后的内存上限（字节）：缩小尺寸时超过上限的图片分块读取和缩放，无法分块时拒绝处理
+        self.memory_limit = memory_limit
+        # 累计的编码次数（包括样本编码和保存时的编码），用于基准测试
+        self.encode_count = 0
+        # 返回True时在下一次编码前取消处理（如图形界面中的取消按钮），查找目标大小或质量时每次尝试都会检查
+        self.cancel_check = None
+        # 处理结果的编码数据及其编码参数，保存和显示大小时直接复用，避免重复编码
+        self.encoded_data = None
+        self.encoded_params = None
+        # 安静模式下不输出任何信息，错误信息记录在last_error中
+        self.quiet = quiet
+        self.last_error = ""
+        # 当前图片各阶段的耗时和字节数，每次加载图片时重置；处理结束后写入stats_sink（如JsonlStatsSink）
+        self.stats = ProcessingStats()
+        self.stats_sink = stats_sink
+        self._source_loaded = False
+        self._stats_written = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def close(self):
+        """释放当前图片：关闭原图的文件，释放像素数据、处理结果和编码数据
+        
+        关闭后可以继续加载其他图片；加载新图片时也会先关闭上一张图片。
+        长时间运行的批量处理中，每张图片处理完成后都应关闭（或使用with语句），
+        否则原图的文件句柄和内存映射要等到垃圾回收时才释放。
+        """
+        for image in (self.processed_image, self.original_image):
+            if image is not None:
+                image.close()
         self.original_image = None
         self.processed_image = None
+        self._source_loaded = False
+        self._clear_encoded()
     
     def load_image(self, image_path):
         """加载图片"""
         try:
+            self.close()
             self.source_image_path = image_path
-            self.original_image = Image.open(image_path)
+            self.source_data = None
+            self.source_format = self._get_format(image_path)
+            self._reset_stats(image_path)
             
-            # 打印原始图片信息
+            # 只读取文件头，像素数据在第一次使用时才解码
             file_size = os.path.getsize(image_path)
-            print(f"\n原始图片信息:")
-            print(f"路径: {image_path}")
-            print(f"大小: {self.format_size(file_size)}")
-            print(f"尺寸: {self.original_image.width} x {self.original_image.height}")
-            print(f"格式: {self.original_image.format}")
+            # 解码大小由内存上限控制（见_check_memory和_resize_tiled），打开时不按像素数拒绝大图片
+            with self.stats.measure("open", file_size), lift_pixel_limit():
+                self.original_image = Image.open(image_path)
+            
+            # 打印原始图片信息
+            self._log(f"\n原始图片信息:")
+            self._log(f"路径: {image_path}")
+            self._log(f"大小: {self.format_size(file_size)}")
+            self._log(f"尺寸: {self.original_image.width} x {self.original_image.height}")
+            self._log(f"格式: {self.original_image.format}")
             
             return True
         except Exception as e:
-            print(f"\n错误: 无法打开图片: {str(e)}")
+            self._error(f"无法打开图片: {str(e)}")
             return False
     
-    def process_image_quality(self, quality=85, target_size=0):
-        """通过调整质量处理图片"""
+    def load_image_data(self, data, img_format=None):
+        """从内存加载图片，不读写磁盘
+        
+        data为bytes或文件对象。img_format为处理和保存时使用的格式，默认根据图片内容判断。
+        """
+        try:
+            if hasattr(data, "read"):
+                data = data.read()
+            
+            self.close()
+            self.source_image_path = ""
+            self.source_data = bytes(data)
+            self._reset_stats("")
+            
+            with self.stats.measure("open", len(self.source_data)), lift_pixel_limit():
+                self.original_image = Image.open(io.BytesIO(self.source_data))
+            self.source_format = normalize_format(img_format or self.original_image.format)
+            
+            # 打印原始图片信息
+            self._log(f"\n原始图片信息:")
+            self._log(f"大小: {self.format_size(len(self.source_data))}")
+            self._log(f"尺寸: {self.original_image.width} x {self.original_image.height}")
+            self._log(f"格式: {self.original_image.format}")
+            
+            return True
+        except Image.UnidentifiedImageError:
+            self._error("无法打开图片: 无法识别的图片格式")
+            return False
+        except Exception as e:
+            self._error(f"无法打开图片: {str(e)}")
+            return False
+    
+    def process_image_quality(self, quality=85, target_size=0, target_ssim=0, target_psnr=0, metric_side=0):
+        """通过调整质量处理图片
+        
+        target_size为目标大小(KB)；target_ssim或target_psnr为解码结果的质量下限，使用满足下限的最小质量值，
+        metric_side大于0时在缩小到该尺寸以内的亮度通道上计算指标。
+        """
         if not self.original_image:
-            print("\n错误: 请先加载图片")
+            self._error("请先加载图片")
+            return False
+        
+        if sum(1 for target in (target_size, target_ssim, target_psnr) if target > 0) > 1:
+            self._error("目标大小、目标SSIM和目标PSNR只能指定一个")
             return False
         
         try:
             # 获取图片格式
-            img_format = os.path.splitext(self.source_image_path)[1].lower().replace(".", "")
-            if img_format == "jpg":
-                img_format = "jpeg"
+            img_format = self.source_format
+            
+            # 只调整质量时处理结果就是原图，直接编码原图，不复制
+            self._ensure_loaded()
+            self.processed_image = self.original_image
+            self._clear_encoded()
             
-            # 复制原始图片
-            self.processed_image = self.original_image.copy()
+            strategy = get_strategy(img_format)
             
             # 如果设置了目标大小，则尝试达到目标大小
             if target_size > 0:
-                print(f"\n尝试达到目标大小: {target_size} KB...")
+                self._log(f"\n尝试达到目标大小: {target_size} KB...")
                 
                 # 对于PNG格式，使用特殊处理方法
                 if img_format.lower() == "png":
                     success = self.process_png_for_target_size(target_size * 1024)
                     if success:
-                        # 计算处理后图片的大小
-                        buffer = io.BytesIO()
-                        self.processed_image.save(buffer, format=img_format)
-                        processed_size = len(buffer.getvalue())
+                        # 直接使用查找过程中得到的编码数据
+                        processed_size = len(self.encoded_data)
                         
                         # 打印处理后图片信息
-                        print(f"\n处理后图片信息:")
-                        print(f"大小: {self.format_size(processed_size)}")
-                        print(f"尺寸: {self.processed_image.width} x {self.processed_image.height}")
-                        print(f"注意: PNG是无损格式，调整质量效果有限")
+                        self._log(f"\n处理后图片信息:")
+                        self._log(f"大小: {self.format_size(processed_size)}")
+                        self._log(f"尺寸: {self.processed_image.width} x {self.processed_image.height}")
+                        self._log(f"注意: PNG是无损格式，调整质量效果有限")
                         
                         return True
-                else:
-                    # 对于JPEG等有损格式，使用质量调整
+                elif strategy.quality_supported(self.encoder_options):
+                    # 对于JPEG、WebP等支持质量值的格式，使用质量调整
                     quality = self.find_quality_for_target_size(target_size * 1024, img_format)
-                    print(f"找到合适的质量值: {quality}")
+                    self._log(f"找到合适的质量值: {quality}")
+                else:
+                    self._log(f"注意: {img_format.upper()}{self._no_quality_note(strategy)}不支持质量值，无法按目标大小调整")
             
-            # 计算处理后图片的大小
-            buffer = io.BytesIO()
-            if img_format.lower() in ["jpeg", "jpg"]:
-                self.processed_image.save(buffer, format=img_format, quality=quality)
-            else:
-                # 对于PNG格式，提示用户质量调整效果有限
-                if img_format.lower() == "png":
-                    print("\n注意: PNG是无损格式，调整质量参数效果有限，建议使用调整尺寸方法或转换为JPEG格式")
-                self.processed_image.save(buffer, format=img_format)
+            # 如果设置了目标SSIM/PSNR，则查找满足质量下限的最小质量值
+            elif target_ssim > 0 or target_psnr > 0:
+                metric, threshold = ("ssim", target_ssim) if target_ssim > 0 else ("psnr", target_psnr)
+                if not strategy.quality_supported(self.encoder_options):
+                    self._log(f"\n注意: {img_format.upper()}{self._no_quality_note(strategy)}不支持质量值，无需按目标{metric.upper()}查找质量值")
+                else:
+                    self._log(f"\n尝试达到目标{metric.upper()}: {threshold}...")
+                    quality = self.find_quality_for_metric(metric, threshold, img_format, max_side=metric_side)
+                    if quality is None:
+                        return False
+                    self._log(f"找到合适的质量值: {quality}")
+            
+            # 编码处理后的图片（目标大小查找时已保留了最佳编码结果，无需重新编码）
+            if self.encoded_data is None:
+                if strategy.lossy:
+                    self._set_encoded(self._encode(self.processed_image, img_format, quality=quality), img_format, quality=quality)
+                else:
+                    # 对于PNG格式，提示用户质量调整效果有限
+                    if img_format.lower() == "png":
+                        self._log("\n注意: PNG是无损格式，调整质量参数效果有限，建议使用调整尺寸方法或转换为JPEG格式")
+                    self._set_encoded(self._encode(self.processed_image, img_format), img_format)
             
-            processed_size = len(buffer.getvalue())
+            processed_size = len(self.encoded_data)
             
             # 打印处理后图片信息
-            print(f"\n处理后图片信息:")
-            print(f"大小: {self.format_size(processed_size)}")
-            print(f"尺寸: {self.processed_image.width} x {self.processed_image.height}")
-            print(f"质量: {quality}")
+            self._log(f"\n处理后图片信息:")
+            self._log(f"大小: {self.format_size(processed_size)}")
+            self._log(f"尺寸: {self.processed_image.width} x {self.processed_image.height}")
+            if strategy.quality_supported(self.encoder_options):
+                self._log(f"质量: {quality}")
             
             return True
+        except ProcessingCancelled as e:
+            self._error(str(e))
+            return False
         except Exception as e:
-            print(f"\n错误: 处理图片时出错: {str(e)}")
+            self._error(f"处理图片时出错: {str(e)}")
             return False
     
     def process_image_dimensions(self, width, height, keep_ratio=True):
         """通过调整尺寸处理图片"""
         if not self.original_image:
-            print("\n错误: 请先加载图片")
+            self._error("请先加载图片")
             return False
         
         try:
             # 获取图片格式
-            img_format = os.path.splitext(self.source_image_path)[1].lower().replace(".", "")
-            if img_format == "jpg":
-                img_format = "jpeg"
+            img_format = self.source_format
             
             if width <= 0 or height <= 0:
-                print("\n错误: 宽度和高度必须大于0")
+                self._error("宽度和高度必须大于0")
                 return False
             
             # 如果保持比例，则计算新的尺寸
@@ -117,30 +388,199 @@ class ImageResizer:
                 ratio = min(width / orig_width, height / orig_height)
                 width = int(orig_width * ratio)
                 height = int(orig_height * ratio)
-                print(f"\n保持宽高比，调整后的尺寸: {width} x {height}")
+                self._log(f"\n保持宽高比，调整后的尺寸: {width} x {height}")
             
-            # 调整尺寸
-            self.processed_image = self.original_image.resize((width, height), Image.LANCZOS)
+            # 先释放上一次的处理结果，缩放时不同时保留新旧两张图片
+            self.processed_image = None
+            self._clear_encoded()
             
-            # 计算处理后图片的大小
-            buffer = io.BytesIO()
-            if img_format.lower() in ["jpeg", "jpg"]:
-                self.processed_image.save(buffer, format=img_format, quality=85)
+            # 调整尺寸（JPEG缩小时先以较低分辨率解码，再用高质量重采样得到最终尺寸；
+            # 原图解码后超过内存上限时分块读取和缩放）
+            source_image = self._draft_source((width, height)) if self.fast_decode else None
+            self.processed_image = self._resize_tiled((width, height)) if source_image is None else None
+            if self.processed_image is None:
+                if source_image is None:
+                    self._ensure_loaded()
+                    source_image = self.original_image
+                with self.stats.measure("resize", source=list(source_image.size), target=[width, height], resample=self.resample):
+                    self.processed_image = resample_image(source_image, (width, height), self.resample)
+            
+            # 编码处理后的图片，保存时直接复用
+            if get_strategy(img_format).lossy:
+                self._set_encoded(self._encode(self.processed_image, img_format, quality=85), img_format, quality=85)
             else:
-                self.processed_image.save(buffer, format=img_format)
+                self._set_encoded(self._encode(self.processed_image, img_format), img_format)
             
-            processed_size = len(buffer.getvalue())
+            processed_size = len(self.encoded_data)
             
             # 打印处理后图片信息
-            print(f"\n处理后图片信息:")
-            print(f"大小: {self.format_size(processed_size)}")
-            print(f"尺寸: {self.processed_image.width} x {self.processed_image.height}")
+            self._log(f"\n处理后图片信息:")
+            self._log(f"大小: {self.format_size(processed_size)}")
+            self._log(f"尺寸: {self.processed_image.width} x {self.processed_image.height}")
             
             return True
+        except ProcessingCancelled as e:
+            self._error(str(e))
+            return False
         except Exception as e:
-            print(f"\n错误: 处理图片时出错: {str(e)}")
+            self._error(f"处理图片时出错: {str(e)}")
             return False
     
+    def process_variants(self, variants, quality=85):
+        """一次解码生成多个宽度的变体（如响应式图片的320、640、1280、2560）
+        
+        variants为[{"width": 宽度, "quality": 质量值或None, "target_size": 目标大小(KB)或0}, ...]，
+        未指定质量值时使用quality。原图只解码一次（JPEG按最大的变体缩放解码），变体按宽度从大到小生成，
+        每个变体从已生成的、宽度至少为其VARIANT_CASCADE_RATIO倍的最小图片缩小，不必每次都从原始分辨率缩放；
+        宽度不小于原图时不放大。原图解码后超过内存上限时，分块缩放得到最大的变体，其他变体都从它缩小。
+        
+        返回按宽度从大到小排列的结果列表，每项包括width、height、quality、target_size、format、data、source
+        （缩放所用图片的尺寸），失败时返回None。处理后的图片为最大的变体。
+        """
+        if not self.original_image:
+            self._error("请先加载图片")
+            return None
+        if not variants:
+            self._error("请至少指定一个变体")
+            return None
+        
+        try:
+            img_format = self.source_format
+            strategy = get_strategy(img_format)
+            orig_width, orig_height = self.original_image.size
+            variants = sorted(variants, key=lambda variant: variant["width"], reverse=True)
+            
+            def variant_size(width):
+                width = min(width, orig_width)
+                return width, max(1, int(orig_height * width / orig_width))
+            
+            # 只解码一次，最大的变体能使用缩放解码时，所有变体都能使用
+            largest = variant_size(variants[0]["width"])
+            source_image = self._draft_source(largest) if self.fast_decode and largest[0] < orig_width else None
+            if source_image is None and largest[0] < orig_width:
+                source_image = self._resize_tiled(largest)
+            if source_image is None:
+                self._ensure_loaded()
+                source_image = self.original_image
+            
+            # 可作为缩放来源的图片，按宽度从大到小排列
+            sources = [source_image]
+            results = []
+            
+            for variant in variants:
+                width, height = variant_size(variant["width"])
+                variant_quality = variant.get("quality") or quality
+                target_size = variant.get("target_size") or 0
+                
+                if width >= source_image.width:
+                    # 不放大：直接使用解码后的原图
+                    image = base = source_image
+                    self._log(f"\n变体 {width} x {height}:")
+                else:
+                    base = source_image
+                    for candidate in sources:
+                        if candidate.width >= width * VARIANT_CASCADE_RATIO:
+                            base = candidate
+                    # 变体从大到小生成，比本次缩放来源更大的图片不会再被使用，立即释放
+                    sources = [candidate for candidate in sources if candidate.width <= base.width]
+                    with self.stats.measure("resize", source=list(base.size), target=[width, height],
+                                            resample=self.resample, variant=variant["width"]):
+                        image = resample_image(base, (width, height), self.resample)
+                    sources.append(image)
+                    self._log(f"\n变体 {width} x {height}（从 {base.width} x {base.height} 缩小）:")
+                
+                # 编码：支持质量值的格式可以按目标大小查找质量值，其他格式直接编码
+                self._clear_encoded()
+                if target_size > 0 and strategy.quality_supported(self.encoder_options):
+                    variant_quality = self.find_quality_for_target_size(target_size * 1024, img_format, image)
+                    data = self.encoded_data
+                elif strategy.lossy:
+                    data = self._encode(image, img_format, quality=variant_quality)
+                else:
+                    if target_size > 0:
+                        self._log(f"注意: {img_format.upper()}{self._no_quality_note(strategy)}不支持质量值，变体不支持目标大小，直接编码")
+                    variant_quality = None
+                    data = self._encode(image, img_format)
+                
+                self._log(f"大小: {self.format_size(len(data))}" + (f", 质量: {variant_quality}" if variant_quality else ""))
+                results.append({
+                    "width": width,
+                    "height": height,
+                    "quality": variant_quality,
+                    "target_size": target_size,
+                    "format": img_format,
+                    "data": data,
+                    "source": [base.width, base.height],
+                })
+                if len(results) == 1:
+                    largest_image = image
+            
+            # 最大的变体作为处理结果，可以用save_image保存
+            self.processed_image = largest_image
+            params = {"quality": results[0]["quality"]} if results[0]["quality"] else {}
+            self._set_encoded(results[0]["data"], img_format, **params)
+            return results
+        except Exception as e:
+            self._error(f"处理图片时出错: {str(e)}")
+            return None
+    
+    def _draft_source(self, size):
+        """以不小于目标尺寸的最大DCT缩放比例重新解码JPEG原图，不适用时返回None"""
+        if self.original_image.format != "JPEG" or not (self.source_image_path or self.source_data is not None):
+            return None
+        
+        orig_width, orig_height = self.original_image.size
+        if size[0] * 2 > orig_width or size[1] * 2 > orig_height:
+            # 缩小不到一半时无法使用缩放解码
+            return None
+        
+        with self.stats.measure("decode", draft=True) as event:
+            with self._open_source() as draft_image:
+                draft_image.draft(draft_image.mode, size)
+                self._check_memory(draft_image)
+                with lift_pixel_limit():
+                    draft_image.load()
+            event["dimensions"] = list(draft_image.size)
+            event["bytes"] = draft_image.width * draft_image.height * len(draft_image.getbands())
+        
+        self._log(f"使用JPEG快速解码: {orig_width} x {orig_height} -> {draft_image.width} x {draft_image.height}")
+        return draft_image
+    
+    def _resize_tiled(self, size):
+        """原图解码后超过内存上限时，分块读取并缩放到指定尺寸；不需要或无法分块时返回None
+        
+        每次只解码原图的一个横条，横条的大小为内存上限减去输出图片后的一半（另一半留给缩放的中间结果）。
+        """
+        image = self.original_image
+        if self._source_loaded or decoded_bytes(image.size, image.mode) <= self.memory_limit:
+            return None
+        
+        reader = BandReader(self._open_source)
+        if not reader.supported:
+            return None
+        
+        output_bytes = decoded_bytes(size, image.mode)
+        if output_bytes * 2 > self.memory_limit:
+            raise ValueError(f"输出图片需要约{self.format_size(output_bytes)}内存，超过内存上限的一半"
+                             f"（{self.format_size(self.memory_limit)}），无法分块处理")
+        
+        band_bytes = (self.memory_limit - output_bytes) // 2
+        resized, bands = resize_in_bands(reader, size, band_bytes, RESAMPLE_PRESETS[self.resample], self.stats)
+        self._log(f"使用分块处理: {image.width} x {image.height} -> {resized.width} x {resized.height}（{bands} 块）")
+        return resized
+    
+    def _no_quality_note(self, strategy):
+        """格式不支持质量值的提示：支持质量值的格式是被编码参数（如TIFF的compression）关闭的"""
+        return "格式使用当前编码参数时" if strategy.supports_quality else "格式"
+    
+    def _check_memory(self, image):
+        """图片解码后超过内存上限时抛出ValueError"""
+        size = decoded_bytes(image.size, image.mode)
+        if size > self.memory_limit:
+            raise ValueError(f"图片解码后需要约{self.format_size(size)}内存，超过内存上限"
+                             f"（{self.format_size(self.memory_limit)}）。只有未压缩的BMP、PPM、TIFF缩小尺寸时可以分块处理，"
+                             f"可以用--memory-limit提高上限")
+    
     def process_png_for_target_size(self, target_size):
         """处理PNG图片以达到目标大小
         
@@ -151,41 +591,41 @@ class ImageResizer:
         4. 添加元数据或填充数据以增加文件大小
         5. 增加图片尺寸（如果需要增大文件）
         """
-        print("\nPNG是无损压缩格式，尝试特殊处理方法...")
+        self._log("\nPNG是无损压缩格式，尝试特殊处理方法...")
         
-        # 保存原始图像副本
-        original_copy = self.original_image.copy()
+        # 候选图片被更好的结果取代后立即释放，同一时间只保留当前最佳的一张
         best_image = None
+        best_data = None
         best_diff = float('inf')
         best_size = 0
         original_size = 0
         
         # 获取原始图片大小
-        buffer = io.BytesIO()
-        self.original_image.save(buffer, format='PNG')
-        original_size = len(buffer.getvalue())
-        print(f"原始PNG图片大小: {self.format_size(original_size)}")
+        original_data = self._encode(self.original_image, 'png')
+        original_size = len(original_data)
+        self._log(f"原始PNG图片大小: {self.format_size(original_size)}")
         
         # 检查是否需要增大文件
         need_increase = original_size < target_size
         if need_increase:
-            print(f"需要增加文件大小到: {self.format_size(target_size)}")
+            self._log(f"需要增加文件大小到: {self.format_size(target_size)}")
         
         # 尝试方法1：如果图片有Alpha通道，尝试移除它（仅当需要减小文件时）
         if not need_increase and self.original_image.mode == 'RGBA':
-            print("尝试移除Alpha通道...")
+            self._log("尝试移除Alpha通道...")
             rgb_image = self.original_image.convert('RGB')
-            buffer = io.BytesIO()
-            rgb_image.save(buffer, format='PNG')
-            current_size = len(buffer.getvalue())
+            data = self._encode(rgb_image, 'png')
+            current_size = len(data)
             
             diff = abs(current_size - target_size)
-            print(f"  移除Alpha通道后大小: {self.format_size(current_size)}")
+            self._log(f"  移除Alpha通道后大小: {self.format_size(current_size)}")
             
             if diff < best_diff:
                 best_diff = diff
                 best_image = rgb_image
                 best_size = current_size
+                best_data = data
+            del rgb_image, data
         
         # 尝试方法2：调整色彩模式和位深度（仅当需要减小文件时）
         if not need_increase:
@@ -194,204 +634,265 @@ class ImageResizer:
                 color_modes.append(('P', 256))  # 8位调色板模式
             
             for mode, colors in color_modes:
-                print(f"尝试转换为{mode}模式 ({colors}色)...")
+                self._log(f"尝试转换为{mode}模式 ({colors}色)...")
                 try:
                     converted_image = self.original_image.convert(mode, palette=Image.ADAPTIVE, colors=colors)
-                    buffer = io.BytesIO()
-                    converted_image.save(buffer, format='PNG')
-                    current_size = len(buffer.getvalue())
+                    data = self._encode(converted_image, 'png')
+                    current_size = len(data)
                     
                     diff = abs(current_size - target_size)
-                    print(f"  转换为{mode}模式后大小: {self.format_size(current_size)}")
+                    self._log(f"  转换为{mode}模式后大小: {self.format_size(current_size)}")
                     
                     if diff < best_diff:
                         best_diff = diff
                         best_image = converted_image
                         best_size = current_size
+                        best_data = data
+                    del converted_image, data
+                except ProcessingCancelled:
+                    raise
                 except Exception as e:
-                    print(f"  转换为{mode}模式失败: {str(e)}")
+                    self._log(f"  转换为{mode}模式失败: {str(e)}")
         
         # 尝试方法3：调整图片尺寸（缩小，仅当需要减小文件时）
         if not need_increase and (best_size > target_size or best_image is None):
-            print("尝试缩小图片尺寸...")
+            self._log("尝试缩小图片尺寸...")
             
-            # 从100%开始，每次减少5%
-            for scale in range(100, 29, -5):  # 最小缩小到30%
-                scale_factor = scale / 100.0
-                width = int(self.original_image.width * scale_factor)
-                height = int(self.original_image.height * scale_factor)
-                
-                resized_image = self.original_image.resize((width, height), Image.LANCZOS)
-                
-                # 如果之前找到了更好的色彩模式，应用它
-                if best_image is not None and best_image.mode != resized_image.mode:
-                    try:
-                        resized_image = resized_image.convert(best_image.mode)
-                    except:
-                        pass
-                
-                buffer = io.BytesIO()
-                resized_image.save(buffer, format='PNG')
-                current_size = len(buffer.getvalue())
-                
-                diff = abs(current_size - target_size)
-                print(f"  缩放到{scale}%后大小: {self.format_size(current_size)}")
-                
-                if diff < best_diff:
-                    best_diff = diff
-                    best_image = resized_image
-                    best_size = current_size
-                
-                # 如果已经小于目标大小，停止缩小
-                if current_size <= target_size:
-                    break
+            # 如果之前找到了更好的色彩模式，缩放后应用它
+            color_mode = best_image.mode if best_image is not None else None
+            base_size = best_size if best_image is not None else original_size
+            result = self._search_png_scale(self.original_image, base_size, target_size,
+                                            PNG_MIN_SCALE, 1.0, color_mode)
+            
+            if abs(result[2] - target_size) < best_diff:
+                best_image, best_data, best_size = result
+                best_diff = abs(best_size - target_size)
+            del result
         
         # 尝试方法4：增加图片尺寸（仅当需要增大文件时）
         if need_increase and (best_size < target_size or best_image is None):
-            print("尝试增大图片尺寸...")
+            self._log("尝试增大图片尺寸...")
             
-            # 从100%开始，每次增加10%
             base_image = best_image if best_image is not None else self.original_image
-            for scale in range(110, 301, 10):  # 最大放大到300%
-                scale_factor = scale / 100.0
-                width = int(base_image.width * scale_factor)
-                height = int(base_image.height * scale_factor)
-                
-                resized_image = base_image.resize((width, height), Image.LANCZOS)
-                
-                buffer = io.BytesIO()
-                resized_image.save(buffer, format='PNG')
-                current_size = len(buffer.getvalue())
-                
-                diff = abs(current_size - target_size)
-                print(f"  放大到{scale}%后大小: {self.format_size(current_size)}")
-                
-                if diff < best_diff:
-                    best_diff = diff
-                    best_image = resized_image
-                    best_size = current_size
-                
-                # 如果已经大于目标大小，停止放大
-                if current_size >= target_size:
-                    break
+            base_size = best_size if best_image is not None else original_size
+            result = self._search_png_scale(base_image, base_size, target_size, 1.0, PNG_MAX_SCALE)
+            del base_image
+            
+            if abs(result[2] - target_size) < best_diff:
+                best_image, best_data, best_size = result
+                best_diff = abs(best_size - target_size)
+            del result
         
         # 尝试方法5：添加元数据填充（仅当需要增大文件且其他方法效果不佳时）
         if need_increase and (best_size < target_size or abs(best_size - target_size) > target_size * 0.1):
-            print("尝试添加元数据填充...")
+            self._log("尝试添加元数据填充...")
             
-            base_image = best_image if best_image is not None else self.original_image
+            # 填充只能增大文件，因此选择不超过目标大小的图片作为基础，只编码一次
+            if best_image is not None and best_size <= target_size:
+                base_image, base_data = best_image, best_data
+            else:
+                base_image, base_data = self.original_image, original_data
             
-            # 创建一个新的图像，添加填充数据
-            padded_image = base_image.copy()
+            data = self._pad_png_data(base_data, target_size)
+            current_size = len(data)
+            self._log(f"  添加{self.format_size(current_size - len(base_data))}填充后大小: {self.format_size(current_size)}")
             
-            # 尝试不同大小的填充数据
-            for padding_size in range(1, 21):  # 尝试1KB到20KB的填充
-                padding_kb = padding_size * 1024
-                
-                # 创建一个临时缓冲区来保存图像和元数据
-                buffer = io.BytesIO()
-                
-                # 保存图像
-                padded_image.save(buffer, format='PNG', pnginfo=self._create_padding_metadata(padding_kb))
-                current_size = len(buffer.getvalue())
-                
-                diff = abs(current_size - target_size)
-                print(f"  添加{padding_kb/1024}KB填充后大小: {self.format_size(current_size)}")
-                
-                if diff < best_diff:
-                    best_diff = diff
-                    best_image = padded_image
-                    best_size = current_size
-                
-                # 如果已经达到或超过目标大小，停止添加
-                if current_size >= target_size:
-                    break
+            diff = abs(current_size - target_size)
+            if diff < best_diff:
+                best_diff = diff
+                best_image = base_image
+                best_size = current_size
+                best_data = data
+            del base_image, base_data, data
         
         # 如果找到了合适的处理方法
         if best_image is not None:
             self.processed_image = best_image
-            print(f"\n找到最佳处理方法，处理后大小: {self.format_size(best_size)}")
+            self._set_encoded(best_data, "png")
+            self._log(f"\n找到最佳处理方法，处理后大小: {self.format_size(best_size)}")
             
             # 如果处理后大小仍然与目标相差较大，给出建议
             if abs(best_size - target_size) > target_size * 0.1:  # 相差超过10%
-                print("\n提示: PNG是无损格式，难以精确控制文件大小。")
-                print("如果需要精确控制文件大小，建议考虑以下选项:")
-                print("1. 使用JPEG格式保存（有损但文件更小）")
-                print("2. 进一步调整图片尺寸")
-                print("3. 使用专业图像优化工具")
+                self._log("\n提示: PNG是无损格式，难以精确控制文件大小。")
+                self._log("如果需要精确控制文件大小，建议考虑以下选项:")
+                self._log("1. 使用JPEG格式保存（有损但文件更小）")
+                self._log("2. 进一步调整图片尺寸")
+                self._log("3. 使用专业图像优化工具")
             
             return True
         else:
-            print("\n无法达到目标大小，使用原始图片")
-            self.processed_image = original_copy
+            self._log("\n无法达到目标大小，使用原始图片")
+            self.processed_image = self.original_image
+            self._set_encoded(original_data, "png")
             return False
     
-    def _create_padding_metadata(self, padding_size):
-        """创建包含填充数据的元数据"""
-        from PIL import PngImagePlugin
+    def _search_png_scale(self, base_image, base_size, target_size, min_scale, max_scale, color_mode=None):
+        """查找使PNG大小接近目标的缩放比例（缩小和放大共用），返回(图片, 编码数据, 大小)
+        
+        PNG大小大致与像素数成正比，因此先按大小比例的平方根预测缩放比例，
+        再用插值查找在[min_scale, max_scale]内修正。只保留最接近目标的一张缩放结果，其他的立即释放。
+        """
+        best = {}
         
-        # 创建元数据对象
-        meta = PngImagePlugin.PngInfo()
+        def evaluate(scale):
+            width = max(1, int(base_image.width * scale))
+            height = max(1, int(base_image.height * scale))
+            with self.stats.measure("resize", source=list(base_image.size), target=[width, height], resample=self.resample):
+                resized_image = resample_image(base_image, (width, height), self.resample)
+            
+            if color_mode is not None and color_mode != resized_image.mode:
+                resized_image = self._convert_color_mode(resized_image, color_mode)
+            
+            data = self._encode(resized_image, 'png')
+            self._log(f"  缩放到{scale:.0%}后大小: {self.format_size(len(data))}")
+            if not best or abs(len(data) - target_size) < abs(best["size"] - target_size):
+                best.update(image=resized_image, data=data, size=len(data))
+            return len(data), None
         
-        # 生成填充数据（随机字符串）
-        import random
-        import string
+        guess = math.sqrt(target_size / base_size) if base_size > 0 else 1.0
+        self._interpolation_search(evaluate, target_size, min_scale, max_scale, guess,
+                                   shape=lambda scale: scale * scale, integer=False,
+                                   step=PNG_SCALE_STEP, max_probes=PNG_SCALE_MAX_PROBES)
+        return best["image"], best["data"], best["size"]
+    
+    def _convert_color_mode(self, image, mode):
+        """将图片转换为指定色彩模式，调色板模式使用自适应调色板"""
+        try:
+            if mode == 'P':
+                return image.convert('P', palette=Image.ADAPTIVE, colors=256)
+            return image.convert(mode)
+        except Exception:
+            return image
+    
+    def _pad_png_data(self, data, target_size):
+        """在PNG数据的IEND块之前插入填充用的tEXt块，使文件大小恰好达到目标大小
         
-        # 创建一个足够大的随机字符串
-        padding_chars = string.ascii_letters + string.digits
-        padding_data = ''.join(random.choice(padding_chars) for _ in range(padding_size))
+        块的结构开销是固定的，因此可以直接计算出需要的填充字节数。
+        差额小于一个块的开销时无法精确填充，返回原始数据。
+        """
+        missing = target_size - len(data)
+        if missing < PNG_PADDING_OVERHEAD or data[-8:-4] != b"IEND":
+            return data
         
-        # 添加到元数据中（分块添加，避免单个键值对过大）
-        chunk_size = 1024  # 每个键值对最大1KB
-        chunks = [padding_data[i:i+chunk_size] for i in range(0, len(padding_data), chunk_size)]
+        chunks = []
+        while missing > 0:
+            # 单个块的数据长度有上限，超过时拆分为多个块；确保剩余部分仍能容纳一个块
+            text_size = min(missing - PNG_PADDING_OVERHEAD, PNG_MAX_CHUNK_TEXT)
+            if 0 < missing - PNG_PADDING_OVERHEAD - text_size < PNG_PADDING_OVERHEAD:
+                text_size -= PNG_PADDING_OVERHEAD
+            chunks.append(self._create_padding_chunk(text_size))
+            missing -= PNG_PADDING_OVERHEAD + text_size
         
-        for i, chunk in enumerate(chunks):
-            meta.add_text(f"padding_{i}", chunk)
+        # IEND块固定为文件末尾的12字节
+        return data[:-12] + b"".join(chunks) + data[-12:]
+    
+    def _create_padding_chunk(self, text_size):
+        """创建包含指定长度随机文本的tEXt块"""
+        # 批量生成随机文本（base64编码的随机字节），避免逐字符生成
+        text = base64.b64encode(os.urandom(text_size * 3 // 4 + 3))[:text_size]
+        chunk_data = b"tEXt" + PNG_PADDING_KEYWORD + b"\0" + text
+        return struct.pack(">I", len(chunk_data) - 4) + chunk_data + struct.pack(">I", zlib.crc32(chunk_data) & 0xFFFFFFFF)
+    
+    def find_quality_for_target_size(self, target_size, img_format, image=None):
+        """查找合适的质量值，最佳质量对应的编码数据会被保留以供保存时复用
         
-        return meta
+        image默认为原图。search_strategy为"model"时使用样本尺寸模型+插值查找，为"bisect"时使用二分查找。
+        编码次数（包括建立模型时的样本编码）记录在last_search_probes中。
+        """
+        self._log("正在查找最佳质量值...")
         
-        # 如果找到了合适的处理方法
-        if best_image is not None:
-            self.processed_image = best_image
-            print(f"\n找到最佳处理方法，处理后大小: {self.format_size(best_size)}")
-            
-            # 如果处理后大小仍然与目标相差较大，给出建议
-            if abs(best_size - target_size) > target_size * 0.2:  # 相差超过20%
-                print("\n提示: PNG是无损格式，难以精确控制文件大小。")
-                print("如果需要精确控制文件大小，建议考虑以下选项:")
-                print("1. 使用JPEG格式保存（有损但文件更小）")
-                print("2. 进一步调整图片尺寸")
-                print("3. 使用专业图像优化工具")
-            
-            return True
+        if image is None:
+            image = self.original_image
+        if self.search_strategy == "bisect":
+            best_quality, best_data, probes = self._bisect_quality(target_size, img_format, image)
         else:
-            print("\n无法达到目标大小，使用原始图片")
-            self.processed_image = original_copy
-            return False
+            best_quality, best_data, probes = self._model_quality_search(target_size, img_format, image)
+        
+        self.last_search_probes = probes
+        self._log(f"  编码次数: {probes}")
+        
+        self._set_encoded(best_data, img_format, quality=best_quality)
+        return best_quality
     
-    def find_quality_for_target_size(self, target_size, img_format):
-        """二分查找合适的质量值"""
-        min_quality = 1
+    def find_quality_for_metric(self, metric, threshold, img_format, image=None, max_side=0):
+        """查找解码结果的SSIM或PSNR不低于threshold的最小质量值，对应的编码数据会被保留以供保存时复用
+        
+        每次编码后解码，与原图在亮度通道上比较（max_side大于0时先缩小到该尺寸以内）。复用插值查找，
+        指标随质量值的变化用quality_metrics.metric_score线性化。所有质量值都达不到下限时使用查找到的最高质量值。
+        需要安装numpy，未安装时返回None。
+        """
+        try:
+            from quality_metrics import MetricReference, metric_score
+        except ImportError:
+            self._error("按目标SSIM/PSNR查找质量值需要安装numpy（pip install numpy）")
+            return None
+        
+        self._log("正在查找最佳质量值...")
+        if image is None:
+            image = self.original_image
+        
+        with self.stats.measure("metric", metric=metric, reference=True):
+            reference = MetricReference(image, max_side)
+        threshold_score = metric_score(metric, threshold)
+        # 只保留满足下限的最小质量值和（都不满足时使用的）最高质量值的编码数据，其他的立即释放
+        best = {}
+        
+        def evaluate(quality):
+            data = self._encode(image, img_format, quality=quality)
+            with self.stats.measure("metric", metric=metric, quality=quality) as event:
+                # 解码结果与已解码的image尺寸相同
+                with lift_pixel_limit(), Image.open(io.BytesIO(data)) as decoded:
+                    if decoded.format == "JPEG":
+                        # 只解码亮度通道，省去颜色转换
+                        decoded.draft("L", decoded.size)
+                    value = reference.compare(metric, decoded)
+                event["value"] = round(value, 6)
+            self._log(f"  质量: {quality}, {metric.upper()}: {value:.4f}, 大小: {self.format_size(len(data))}")
+            score = metric_score(metric, value)
+            key = "passing" if score >= threshold_score else "highest"
+            if key not in best or (quality < best[key][0] if key == "passing" else quality > best[key][0]):
+                best[key] = (quality, value, data)
+            if "passing" in best:
+                best.pop("highest", None)
+            return score, None
+        
+        # 分数大致与质量值成正比；容差为0：查找到上下界相邻为止，再取满足下限的最小质量值
+        probes = self._interpolation_search(evaluate, threshold_score, get_strategy(img_format).min_quality, 100,
+                                            METRIC_INITIAL_QUALITY, shape=lambda quality: quality, tolerance=0)
+        
+        best_quality, value, best_data = best.get("passing") or best["highest"]
+        if "passing" not in best:
+            self._log(f"  最高质量值的{metric.upper()}为{value:.4f}，达不到目标")
+        
+        self.last_search_probes = len(probes)
+        self._log(f"  编码次数: {len(probes)}")
+        self._set_encoded(best_data, img_format, quality=best_quality)
+        return best_quality
+    
+    def _bisect_quality(self, target_size, img_format, image):
+        """二分查找合适的质量值，返回(质量值, 编码数据, 编码次数)"""
+        min_quality = get_strategy(img_format).min_quality
         max_quality = 100
         best_quality = 85
+        best_data = None
         best_diff = float('inf')
-        
-        print("正在查找最佳质量值...")
+        probes = 0
         
         while min_quality <= max_quality:
             mid_quality = (min_quality + max_quality) // 2
             
-            buffer = io.BytesIO()
-            self.original_image.save(buffer, format=img_format, quality=mid_quality)
-            current_size = len(buffer.getvalue())
+            data = self._encode(image, img_format, quality=mid_quality)
+            current_size = len(data)
+            probes += 1
             
             diff = abs(current_size - target_size)
             
-            print(f"  质量: {mid_quality}, 大小: {self.format_size(current_size)}, 目标: {self.format_size(target_size)}")
+            self._log(f"  质量: {mid_quality}, 大小: {self.format_size(current_size)}, 目标: {self.format_size(target_size)}")
             
             if diff < best_diff:
                 best_diff = diff
                 best_quality = mid_quality
+                best_data = data
             
             if current_size > target_size:
                 max_quality = mid_quality - 1
@@ -399,42 +900,294 @@ class ImageResizer:
                 min_quality = mid_quality + 1
             
             # 如果已经足够接近目标大小，就停止
-            if diff < target_size * 0.05:  # 5%误差内
+            if diff < target_size * SIZE_TOLERANCE:
                 break
         
-        return best_quality
+        return best_quality, best_data, probes
+    
+    def _model_quality_search(self, target_size, img_format, image):
+        """基于样本尺寸模型的插值查找，返回(质量值, 编码数据, 编码次数)
+        
+        先在图片的小样本上测量不同质量值对应的大小，得到大小-质量曲线的形状；
+        每次完整编码后用实测大小校准曲线的比例，再预测下一个质量值。
+        图片不大于样本尺寸时样本就是原图，建立模型比直接查找还慢，改用二分查找。
+        编码次数包括样本编码。
+        """
+        if max(image.size) <= QUALITY_MODEL_SIDE:
+            self._log("  图片不大于模型样本尺寸，使用二分查找")
+            return self._bisect_quality(target_size, img_format, image)
+        
+        model = self._build_quality_model(img_format, image)
+        
+        # 只保留最接近目标大小的编码数据，其他的立即释放
+        best = {}
+        
+        def evaluate(quality):
+            data = self._encode(image, img_format, quality=quality)
+            self._log(f"  质量: {quality}, 大小: {self.format_size(len(data))}, 目标: {self.format_size(target_size)}")
+            if not best or abs(len(data) - target_size) < abs(len(best["data"]) - target_size):
+                best.update(quality=quality, data=data)
+            return len(data), None
+        
+        def shape(quality):
+            return _interpolate_log(model, quality)
+        
+        # 初始比例按像素数估算
+        small_pixels = model["pixels"]
+        initial_scale = (image.width * image.height) / small_pixels
+        guess = _inverse_interpolate_log(model, target_size / initial_scale)
+        
+        probes = self._interpolation_search(evaluate, target_size, get_strategy(img_format).min_quality, 100, guess, shape=shape)
+        return best["quality"], best["data"], len(model["points"]) + len(probes)
+    
+    def _build_quality_model(self, img_format, image, max_side=QUALITY_MODEL_SIDE):
+        """在图片的小样本上测量各质量值对应的编码大小
+        
+        样本由均匀分布在原图上的若干原始分辨率小块拼接而成，保留了原图的细节密度，
+        因此其大小-质量曲线与原图的形状非常接近。低于格式最小质量值的采样点用最小质量值代替。
+        """
+        sample = self._sample_image(image, max_side)
+        min_quality = get_strategy(img_format).min_quality
+        
+        model = {"pixels": sample.width * sample.height, "points": []}
+        for quality in sorted({max(quality, min_quality) for quality in QUALITY_MODEL_POINTS}):
+            size = len(self._encode(sample, img_format, quality=quality))
+            model["points"].append((quality, size))
+        return model
     
-    def save_image(self, output_path=None, quality=85):
-        """保存处理后的图片"""
+    def _sample_image(self, image, max_side, grid=4):
+        """从图片均匀截取grid x grid个小块，拼接成不超过max_side的样本图片"""
+        width, height = image.size
+        if max(width, height) <= max_side:
+            return image
+        
+        tile_width = min(max_side // grid, width)
+        tile_height = min(max_side // grid, height)
+        sample = Image.new(image.mode, (tile_width * grid, tile_height * grid))
+        if image.mode == "P":
+            sample.putpalette(image.getpalette())
+        
+        for i in range(grid):
+            for j in range(grid):
+                left = int((width - tile_width) * (i + 0.5) / grid)
+                top = int((height - tile_height) * (j + 0.5) / grid)
+                tile = image.crop((left, top, left + tile_width, top + tile_height))
+                sample.paste(tile, (i * tile_width, j * tile_height))
+        
+        return sample
+    
+    def _interpolation_search(self, evaluate, target, lo, hi, guess, shape=None, integer=True,
+                              tolerance=SIZE_TOLERANCE, max_probes=12, step=None):
+        """插值（割线）查找：根据已测量的结果预测下一个参数值
+        
+        evaluate(x)返回(value, payload)，value随x单调递增。shape(x)是value随x变化的形状估计
+        （只需成比例），每次测量后用实测值校准比例再求解下一个参数；已有上下界时在两者之间
+        插值校准比例。未提供shape时在上下界之间做对数插值。
+        step是相邻两次测量参数的最小间隔。结果在目标值的tolerance比例内即停止，
+        返回所有测量结果 {x: (value, payload)}。
+        """
+        if shape is None:
+            shape = lambda x: 1.0
+        
+        min_step = step if step is not None else (1 if integer else (hi - lo) / 1000)
+        probes = {}
+        history = []
+        below = None  # 结果不大于目标的最大参数 (x, value)
+        above = None  # 结果大于目标的最小参数 (x, value)
+        last_side = None
+        same_side_count = 0
+        x = guess
+        
+        while len(probes) < max_probes:
+            x = min(max(x, lo), hi)
+            if integer:
+                x = int(round(x))
+            
+            value, payload = evaluate(x)
+            probes[x] = (value, payload)
+            history.append((x, value))
+            
+            if abs(value - target) <= target * tolerance:
+                break
+            
+            side = value <= target
+            if side:
+                below = (x, value) if below is None or x > below[0] else below
+            else:
+                above = (x, value) if above is None or x < above[0] else above
+            same_side_count = same_side_count + 1 if side == last_side else 1
+            last_side = side
+            
+            # 下一个参数必须严格位于已知上下界之间
+            low_limit = below[0] + min_step if below else lo
+            high_limit = above[0] - min_step if above else hi
+            if low_limit > high_limit:
+                break
+            
+            if below and above and same_side_count >= 2:
+                # 连续两次落在同一侧，说明预测收敛缓慢，改用二分
+                next_x = (below[0] + above[0]) / 2
+            elif below and above:
+                # 用上下界两个测量点校准形状函数后插值
+                next_x = _solve_calibrated(shape, [below, above], target, low_limit, high_limit, integer)
+            elif len(history) >= 2:
+                # 只有单侧结果时，用最近两次测量结果做对数空间的割线外推
+                next_x = _solve_calibrated(lambda x: 1.0, history[-2:], target, low_limit, high_limit, integer)
+            else:
+                next_x = _solve_calibrated(shape, history, target, low_limit, high_limit, integer)
+            
+            x = next_x
+        
+        return probes
+    
+    def save_image(self, output_path=None, quality=None):
+        """保存处理后的图片
+        
+        如果保存格式与处理时的编码格式一致，且未指定不同的质量值，则直接写入处理时得到的编码数据，
+        保证保存的文件与处理时报告的大小完全一致。
+        """
         if not self.processed_image:
-            print("\n错误: 请先处理图片")
+            self._error("请先处理图片")
             return False
         
         try:
-            # 如果没有指定输出路径，则在原始文件名前加上"resized_"
-            if not output_path:
-                dir_name = os.path.dirname(self.source_image_path)
-                base_name = os.path.basename(self.source_image_path)
-                output_path = os.path.join(dir_name, f"resized_{base_name}")
+            output_path = self.get_output_path(output_path)
             
             # 获取保存格式
-            save_format = os.path.splitext(output_path)[1].lower().replace(".", "")
-            if save_format == "jpg":
-                save_format = "jpeg"
+            save_format = self._get_format(output_path)
             
             # 保存图片
-            if save_format.lower() in ["jpeg", "jpg"]:
-                self.processed_image.save(output_path, format=save_format, quality=quality)
-            else:
-                self.processed_image.save(output_path, format=save_format)
+            data = self.get_encoded_data(save_format, quality)
+            with self.stats.measure("write", len(data)):
+                write_file_atomic(output_path, data)
             
-            print(f"\n图片已保存到: {output_path}")
-            print(f"文件大小: {self.format_size(os.path.getsize(output_path))}")
+            self._log(f"\n图片已保存到: {output_path}")
+            self._log(f"文件大小: {self.format_size(len(data))}")
             
+            self.finish_stats(True)
             return True
         except Exception as e:
-            print(f"\n错误: 保存图片时出错: {str(e)}")
+            self._error(f"保存图片时出错: {str(e)}")
+            self.finish_stats(False)
+            return False
+    
+    def get_encoded_data(self, img_format=None, quality=None):
+        """返回处理结果的编码数据
+        
+        img_format默认为原图格式。格式与处理时的编码格式一致，且未指定不同的质量值时，
+        直接返回处理时得到的编码数据，否则重新编码。
+        """
+        img_format = normalize_format(img_format) if img_format else self.source_format
+        if self._can_reuse_encoded(img_format, quality):
+            return self.encoded_data
+        if get_strategy(img_format).lossy:
+            return self._encode(self.processed_image, img_format, quality=quality if quality is not None else 85)
+        return self._encode(self.processed_image, img_format)
+    
+    def get_output_path(self, output_path=None):
+        """获取输出路径，未指定时在原始文件名前加上resized_"""
+        if output_path:
+            return output_path
+        
+        dir_name = os.path.dirname(self.source_image_path)
+        base_name = os.path.basename(self.source_image_path)
+        return os.path.join(dir_name, f"resized_{base_name}")
+    
+    def get_processed_size(self):
+        """获取处理后图片的编码大小（字节）"""
+        if self.encoded_data is not None:
+            return len(self.encoded_data)
+        if not self.processed_image:
+            return 0
+        
+        return len(self._encode(self.processed_image, self.source_format))
+    
+    def _get_format(self, path):
+        """根据文件扩展名获取图片格式"""
+        return normalize_format(os.path.splitext(path)[1])
+    
+    def _open_source(self):
+        """重新打开原图（只读取文件头）"""
+        with lift_pixel_limit():
+            if self.source_data is not None:
+                return Image.open(io.BytesIO(self.source_data))
+            return Image.open(self.source_image_path)
+    
+    def _ensure_loaded(self):
+        """解码原图的像素数据（只在第一次使用时解码），记录解码耗时"""
+        if self._source_loaded:
+            return
+        
+        image = self.original_image
+        self._check_memory(image)
+        with self.stats.measure("decode", image.width * image.height * len(image.getbands()), dimensions=list(image.size)):
+            # 像素数据读入内存后立即关闭文件（多帧的GIF、TIFF等加载后Pillow不会自动关闭）
+            with image, lift_pixel_limit():
+                image.load()
+        self._source_loaded = True
+    
+    def _reset_stats(self, source_path):
+        """开始记录一张新图片的统计"""
+        self.stats = ProcessingStats(source_path)
+        self.last_error = ""
+        self._source_loaded = False
+        self._stats_written = False
+    
+    def finish_stats(self, success=True):
+        """结束当前图片的统计并写入stats_sink（每张图片只写入一次），返回统计对象
+        
+        保存图片时会自动调用；处理失败、未保存时由调用方调用。
+        """
+        self.stats.success = success
+        if self.stats_sink is not None and not self._stats_written:
+            self.stats_sink.write(self.stats)
+            self._stats_written = True
+        return self.stats
+    
+    def _log(self, *args):
+        """输出处理信息，安静模式下不输出"""
+        if not self.quiet:
+            print(*args)
+    
+    def _error(self, message):
+        """记录并输出错误信息"""
+        self.last_error = f"错误: {message}"
+        self._log(f"\n{self.last_error}")
+    
+    def _encode(self, image, img_format, quality=None):
+        """将图片编码到内存中，返回编码后的数据
+        
+        编码参数由格式的编码策略（format_strategies）生成：包括用户指定的编码参数，
+        以及格式支持质量值时的quality。设置了cancel_check且其返回True时抛出ProcessingCancelled。
+        """
+        if self.cancel_check and self.cancel_check():
+            raise ProcessingCancelled("处理已取消")
+        self.encode_count += 1
+        strategy = get_strategy(img_format)
+        params = strategy.save_params(quality, self.encoder_options)
+        with self.stats.measure("encode", format=img_format, dimensions=list(image.size), **params) as event:
+            buffer = io.BytesIO()
+            strategy.prepare(image, params).save(buffer, format=strategy.pil_format, **params)
+            event["bytes"] = buffer.tell()
+        return buffer.getvalue()
+    
+    def _set_encoded(self, data, img_format, **params):
+        """记录处理结果的编码数据及其编码参数"""
+        self.encoded_data = data
+        self.encoded_params = dict(params, format=img_format)
+    
+    def _clear_encoded(self):
+        """清除已记录的编码数据"""
+        self.encoded_data = None
+        self.encoded_params = None
+    
+    def _can_reuse_encoded(self, save_format, quality=None):
+        """判断保存时是否可以直接复用已有的编码数据"""
+        if self.encoded_data is None or self.encoded_params is None:
             return False
+        if self.encoded_params["format"] != save_format:
+            return False
+        return quality is None or self.encoded_params.get("quality", quality) == quality
     
     def format_size(self, size_bytes):
         """格式化文件大小显示"""
@@ -446,43 +1199,213 @@ class ImageResizer:
             return f"{size_bytes / (1024 * 1024):.2f} MB"
 
 
-def main():
-    parser = argparse.ArgumentParser(description="图片大小修改工具 - 在不改变图片格式的前提下，改变图片的大小")
-    parser.add_argument("image_path", help="要处理的图片路径")
-    parser.add_argument("-o", "--output", help="输出图片路径，默认为原始路径前加上'resized_'")
+def add_processing_arguments(parser):
+    """添加图片处理参数（单张处理与批量处理共用）"""
     parser.add_argument("-m", "--method", choices=["quality", "dimensions"], default="quality", help="处理方法: quality(调整质量) 或 dimensions(调整尺寸)，默认为quality")
     parser.add_argument("-q", "--quality", type=int, default=85, help="JPEG质量值(1-100)，默认为85")
     parser.add_argument("-t", "--target-size", type=int, default=0, help="目标文件大小(KB)，如果设置，将自动调整质量以达到目标大小")
+    parser.add_argument("--target-ssim", type=float, default=0.0, help="目标SSIM(0-1，如0.95)，如果设置，将使用解码结果的SSIM不低于该值的最小质量值（需要numpy）")
+    parser.add_argument("--target-psnr", type=float, default=0.0, help="目标PSNR(dB，如40)，如果设置，将使用解码结果的PSNR不低于该值的最小质量值（需要numpy）")
+    parser.add_argument("--metric-side", type=int, default=0, help="计算SSIM/PSNR前把亮度通道缩小到该尺寸以内，加快计算，默认为0（原始尺寸）")
     parser.add_argument("-w", "--width", type=int, default=0, help="调整后的宽度，仅在dimensions方法中使用")
     parser.add_argument("-ht", "--height", type=int, default=0, help="调整后的高度，仅在dimensions方法中使用")
     parser.add_argument("-k", "--keep-ratio", action="store_true", default=True, help="保持宽高比，仅在dimensions方法中使用，默认为True")
     parser.add_argument("-nk", "--no-keep-ratio", action="store_false", dest="keep_ratio", help="不保持宽高比，仅在dimensions方法中使用")
+    parser.add_argument("--no-fast-decode", action="store_false", dest="fast_decode", help="缩小JPEG尺寸时不使用缩放解码（draft模式），始终以原始分辨率解码")
+    parser.add_argument("--resample", choices=list(RESAMPLE_PRESETS), default="quality", help="重采样预设: quality(直接LANCZOS，质量最好)、balanced(整数倍预缩小到3倍以内再LANCZOS) 或 fast(预缩小到2倍以内再LANCZOS)，默认为quality")
+    parser.add_argument("--search", choices=["model", "bisect"], default="model", help="目标大小的查找策略: model(样本模型+插值，编码次数少) 或 bisect(二分查找)，默认为model")
+    parser.add_argument("--encoder-option", action="append", default=[], type=encoder_option_argument, dest="encoder_options",
+                        metavar="NAME=VALUE", help="编码参数，可指定多次，每种格式只使用它支持的参数。如 progressive=true、optimize=true、"
+                                                   "subsampling=4:4:4(JPEG)，method=6(WebP)，compress_level=9(PNG)，compression=tiff_lzw(TIFF)")
+    parser.add_argument("--memory-limit", type=int, default=DEFAULT_MEMORY_LIMIT_MB,
+                        help=f"原图解码后的内存上限(MB)。超过上限时，未压缩的BMP、PPM、TIFF缩小尺寸时分块处理，"
+                             f"其他情况拒绝处理，默认为{DEFAULT_MEMORY_LIMIT_MB}")
+
+
+def encoder_option_argument(text):
+    """命令行编码参数的类型转换"""
+    try:
+        return parse_encoder_option(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def add_instrumentation_arguments(parser):
+    """添加输出和统计相关的命令行参数（单张处理与批量处理共用）"""
+    parser.add_argument("--quiet", action="store_true", help="安静模式，不输出处理过程信息，只在出错时输出错误信息")
+    parser.add_argument("--stats-jsonl", help="统计文件(JSON Lines)。每张图片追加一行，记录打开、解码、缩放、每次编码和写入的耗时和字节数")
+
+
+def processing_options(args):
+    """从命令行参数中提取处理参数"""
+    return {
+        "method": args.method,
+        "quality": args.quality,
+        "target_size": args.target_size,
+        "target_ssim": args.target_ssim,
+        "target_psnr": args.target_psnr,
+        "metric_side": args.metric_side,
+        "width": args.width,
+        "height": args.height,
+        "keep_ratio": args.keep_ratio,
+        "search": args.search,
+        "fast_decode": args.fast_decode,
+        "resample": args.resample,
+        "encoder_options": dict(args.encoder_options),
+        "memory_limit": args.memory_limit,
+    }
+
+
+def create_resizer(options, quiet=False, stats_sink=None):
+    """根据处理参数创建图片处理器"""
+    return ImageResizer(search_strategy=options.get("search", "model"),
+                        fast_decode=options.get("fast_decode", True),
+                        resample=options.get("resample", "quality"),
+                        quiet=quiet,
+                        stats_sink=stats_sink,
+                        encoder_options=options.get("encoder_options"),
+                        memory_limit=options.get("memory_limit", DEFAULT_MEMORY_LIMIT_MB) * 1024 * 1024)
+
+
+def process_image_data(source, options=None, output_format=None):
+    """无状态的内存处理接口：输入图片数据和处理参数，返回编码后的数据和图片信息
     
-    args = parser.parse_args()
+    source为bytes或文件对象；options的格式与processing_options()的结果相同，缺少的项使用默认值；
+    output_format默认为输入图片的格式。每次调用使用独立的处理器，不读写磁盘、不输出信息，
+    可以在多个线程中同时调用。处理失败时抛出ValueError。
     
-    # 创建图片处理器
-    resizer = ImageResizer()
+    返回字典：data、format、width、height、quality（有损格式）、size、source_size、probes、stats。
+    """
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    # 服务的工作进程长期运行，返回前释放图片和文件
+    with create_resizer(options, quiet=True) as resizer:
+        if not (resizer.load_image_data(source) and apply_processing(resizer, options)):
+            raise ValueError(resizer.last_error or "错误: 处理失败")
+        
+        try:
+            img_format = normalize_format(output_format) if output_format else resizer.source_format
+            data = resizer.get_encoded_data(img_format)
+        except Exception as e:
+            raise ValueError(f"错误: 编码图片时出错: {str(e)}") from e
+        
+        encoded_params = resizer.encoded_params or {}
+        return {
+            "data": data,
+            "format": img_format,
+            "width": resizer.processed_image.width,
+            "height": resizer.processed_image.height,
+            "quality": encoded_params.get("quality") if encoded_params.get("format") == img_format else None,
+            "size": len(data),
+            "source_size": len(resizer.source_data),
+            "probes": resizer.last_search_probes,
+            "stats": resizer.finish_stats(True).to_dict(),
+        }
+
+
+def apply_processing(resizer, options):
+    """根据处理参数处理已加载的图片"""
+    if options["method"] == "quality":
+        return resizer.process_image_quality(options["quality"], options["target_size"],
+                                             options.get("target_ssim", 0), options.get("target_psnr", 0),
+                                             options.get("metric_side", 0))
     
-    # 加载图片
-    if not resizer.load_image(args.image_path):
-        return 1
+    # dimensions
+    if options["width"] <= 0 or options["height"] <= 0:
+        resizer._error("使用dimensions方法时，必须指定宽度和高度")
+        return False
     
-    # 根据选择的方法处理图片
-    if args.method == "quality":
-        if not resizer.process_image_quality(args.quality, args.target_size):
-            return 1
-    else:  # dimensions
-        if args.width <= 0 or args.height <= 0:
-            print("\n错误: 使用dimensions方法时，必须指定宽度和高度")
-            return 1
-        
-        if not resizer.process_image_dimensions(args.width, args.height, args.keep_ratio):
+    return resizer.process_image_dimensions(options["width"], options["height"], options["keep_ratio"])
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    
+    # 批量处理子命令
+    if argv and argv[0] == "batch":
+        from batch_processor import main as batch_main
+        return batch_main(argv[1:])
+    
+    # HTTP服务子命令
+    if argv and argv[0] == "serve":
+        from resize_server import main as serve_main
+        return serve_main(argv[1:])
+    
+    # 多尺寸变体子命令
+    if argv and argv[0] == "variants":
+        from variant_generator import main as variants_main
+        return variants_main(argv[1:])
+    
+    # 任务队列子命令
+    if argv and argv[0] == "queue":
+        from job_queue import main as queue_main
+        return queue_main(argv[1:])
+    
+    # 监视文件夹子命令
+    if argv and argv[0] == "watch":
+        from folder_watcher import main as watch_main
+        return watch_main(argv[1:])
+    
+    parser = argparse.ArgumentParser(description="图片大小修改工具 - 在不改变图片格式的前提下，改变图片的大小",
+                                     epilog="批量处理: %(prog)s batch [目录或通配符...] [参数]，详见 %(prog)s batch -h；"
+                                            "HTTP服务: %(prog)s serve [参数]，详见 %(prog)s serve -h；"
+                                            "多尺寸变体: %(prog)s variants 图片 [参数]，详见 %(prog)s variants -h；"
+                                            "任务队列: %(prog)s queue add|work|status|retry 队列数据库 [参数]，详见 %(prog)s queue -h；"
+                                            "监视文件夹: %(prog)s watch [目录...] [参数]，详见 %(prog)s watch -h")
+    parser.add_argument("image_path", help="要处理的图片路径")
+    parser.add_argument("-o", "--output", help="输出图片路径，默认为原始路径前加上'resized_'")
+    add_processing_arguments(parser)
+    add_cache_arguments(parser)
+    add_instrumentation_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    options = processing_options(args)
+    
+    # 创建图片处理器
+    stats_sink = JsonlStatsSink(args.stats_jsonl) if args.stats_jsonl else None
+    resizer = create_resizer(options, quiet=args.quiet, stats_sink=stats_sink)
+    resizer.source_image_path = args.image_path
+    output_path = resizer.get_output_path(args.output)
+    
+    # 查找结果缓存，命中时直接写入缓存的输出，无需解码
+    cache = create_cache(args)
+    cache_key = None
+    if cache:
+        resizer._reset_stats(args.image_path)
+        try:
+            with resizer.stats.measure("cache") as event:
+                cache_key = cache.make_key(args.image_path, options, resizer._get_format(output_path))
+                event["hit"] = cache.fetch(cache_key, output_path)
+        except OSError as e:
+            print(f"\n错误: 无法读取图片: {str(e)}")
             return 1
+        if event["hit"]:
+            event["bytes"] = os.path.getsize(output_path)
+            resizer.finish_stats(True)
+            if not args.quiet:
+                print(f"\n缓存命中，图片已保存到: {output_path}")
+                print(f"文件大小: {resizer.format_size(event['bytes'])}")
+            return 0
     
-    # 保存图片
-    if not resizer.save_image(args.output, args.quality):
+    # 加载图片，根据选择的方法处理图片（加载时会重置统计，保留缓存查找的记录）
+    success = resizer.load_image(args.image_path)
+    if cache:
+        resizer.stats.events.insert(0, event)
+    success = success and apply_processing(resizer, options)
+    if not success:
+        resizer.finish_stats(False)
+    
+    # 保存图片，保存后释放原图
+    success = success and resizer.save_image(output_path)
+    resizer.close()
+    if not success:
+        if args.quiet:
+            print(resizer.last_error, file=sys.stderr)
         return 1
     
+    if cache:
+        cache.store_file(cache_key, output_path)
+    
     return 0
 
 
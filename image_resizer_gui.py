@@ -3,11 +3,18 @@
 
 import os
 import sys
+import queue
+import threading
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
-from PIL import Image, ImageTk
-import io
+from concurrent.futures import ProcessPoolExecutor
+from PIL import ImageTk
 from image_resizer import ImageResizer
+from batch_processor import BatchManifest, MAX_PENDING_PER_WORKER, build_output_path, iter_input_files, process_file
+from preview_cache import PreviewCache
+
+# 后台任务进度队列的轮询间隔（毫秒）
+POLL_INTERVAL = 100
 
 class ImageResizerGUI:
     def __init__(self, root):
@@ -19,15 +26,27 @@ class ImageResizerGUI:
         # 创建图片处理器
         self.resizer = ImageResizer()
         
+        # 预览图缓存（单张预览和批量缩略图共用）
+        self.preview_cache = PreviewCache()
+        self.processed_preview_key = None
+        
         # 图片路径
         self.image_path = ""
         
         # 批量处理相关变量
         self.batch_folder = ""
-        self.batch_files = []
         self.batch_current_index = 0
         self.batch_mode = False
         
+        # 后台处理相关变量：工作线程/进程通过队列把进度发送给界面线程
+        self.task_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.busy = False
+        self.previous_result = None
+        self.batch_executor = None
+        self.batch_futures = set()
+        self.batch_state = None
+        
         # 创建界面
         self.create_widgets()
         
@@ -193,11 +212,18 @@ class ImageResizerGUI:
         buttons_frame.pack(fill=tk.X, pady=10)
         
         # 使用pack布局垂直排列按钮，每个按钮单独一行
-        process_btn = ttk.Button(buttons_frame, text="处理图片", command=self.process_image)
-        process_btn.pack(fill=tk.X, pady=(0, 5))
+        self.process_btn = ttk.Button(buttons_frame, text="处理图片", command=self.process_image)
+        self.process_btn.pack(fill=tk.X, pady=(0, 5))
+        
+        self.save_btn = ttk.Button(buttons_frame, text="保存图片", command=self.save_image, state=tk.DISABLED)
+        self.save_btn.pack(fill=tk.X, pady=(0, 5))
+        
+        self.cancel_btn = ttk.Button(buttons_frame, text="取消", command=self.cancel_processing, state=tk.DISABLED)
+        self.cancel_btn.pack(fill=tk.X)
         
-        save_btn = ttk.Button(buttons_frame, text="保存图片", command=self.save_image)
-        save_btn.pack(fill=tk.X)
+        # 处理状态
+        self.status_label = ttk.Label(buttons_frame, text="")
+        self.status_label.pack(anchor=tk.W, pady=(5, 0))
         
         # ===== 单张图片处理页面内容 =====
         # 图片选择区域（移动到单张图片处理页签内）
@@ -267,12 +293,26 @@ class ImageResizerGUI:
         folder_entry = ttk.Entry(batch_file_frame, textvariable=self.folder_var, width=50)
         folder_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         
+        # 是否同时处理子文件夹中的图片（输出时保持子文件夹结构）
+        self.recursive_var = tk.BooleanVar(value=False)
+        recursive_check = ttk.Checkbutton(batch_file_frame, text="包含子文件夹", variable=self.recursive_var)
+        recursive_check.pack(side=tk.LEFT, padx=5)
+        
         # 批量处理按钮
         batch_btn_frame = ttk.Frame(batch_frame)
         batch_btn_frame.pack(fill=tk.X, pady=5)
         
-        batch_process_btn = ttk.Button(batch_btn_frame, text="批量处理", command=self.batch_process)
-        batch_process_btn.pack(side=tk.LEFT, padx=5)
+        self.batch_process_btn = ttk.Button(batch_btn_frame, text="批量处理", command=self.batch_process)
+        self.batch_process_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.batch_cancel_btn = ttk.Button(batch_btn_frame, text="取消", command=self.cancel_processing, state=tk.DISABLED)
+        self.batch_cancel_btn.pack(side=tk.LEFT, padx=5)
+        
+        # 同时处理的图片数量
+        ttk.Label(batch_btn_frame, text="并发数:").pack(side=tk.LEFT, padx=(15, 5))
+        self.workers_var = tk.IntVar(value=os.cpu_count() or 1)
+        workers_spinbox = ttk.Spinbox(batch_btn_frame, from_=1, to=max(os.cpu_count() or 1, 1) * 2, textvariable=self.workers_var, width=5)
+        workers_spinbox.pack(side=tk.LEFT)
         
         # 批量处理进度
         progress_frame = ttk.LabelFrame(batch_frame, text="处理进度", padding="10")
@@ -322,11 +362,17 @@ class ImageResizerGUI:
         )
         
         if file_path:
+            if self.busy:
+                messagebox.showwarning("警告", "正在处理中，请等待处理完成或取消")
+                return
+            
             self.image_path = file_path
             self.path_var.set(file_path)
             
-            # 加载图片
-            if self.resizer.load_image(file_path):
+            # 加载图片（加载时会释放上一张图片的处理结果）
+            loaded = self.resizer.load_image(file_path)
+            self.save_btn.config(state=tk.DISABLED)
+            if loaded:
                 # 显示原始图片信息
                 self.update_original_info()
                 
@@ -358,19 +404,12 @@ class ImageResizerGUI:
         if not self.resizer.processed_image:
             return
         
-        # 获取处理后图片信息
-        buffer = io.BytesIO()
+        # 获取处理后图片信息（直接使用处理时得到的编码数据，无需重新编码）
         img_format = os.path.splitext(self.image_path)[1].lower().replace(".", "")
-        if img_format == "jpg":
-            img_format = "jpeg"
         
-        quality = self.quality_var.get()
-        if img_format.lower() in ["jpeg", "jpg"]:
-            self.resizer.processed_image.save(buffer, format=img_format, quality=quality)
-        else:
-            self.resizer.processed_image.save(buffer, format=img_format)
-        
-        processed_size = len(buffer.getvalue())
+        encoded_params = self.resizer.encoded_params or {}
+        quality = encoded_params.get("quality", self.quality_var.get())
+        processed_size = self.resizer.get_processed_size()
         width = self.resizer.processed_image.width
         height = self.resizer.processed_image.height
         
@@ -394,8 +433,13 @@ class ImageResizerGUI:
         if not self.resizer.original_image:
             return
         
-        # 调整图片大小以适应预览区域
-        preview_img = self.resize_for_preview(self.resizer.original_image)
+        # 调整图片大小以适应预览区域（缩放解码，并缓存预览图）；
+        # 预览不受内存上限控制，超过Pillow像素数限制的图片不显示预览
+        try:
+            preview_img = self.preview_cache.get_file_preview(self.image_path)
+        except Exception as e:
+            messagebox.showwarning("警告", f"无法显示预览：{str(e)}")
+            return
         
         # 创建PhotoImage对象
         self.preview_original = ImageTk.PhotoImage(preview_img)
@@ -408,8 +452,8 @@ class ImageResizerGUI:
         if not self.resizer.processed_image:
             return
         
-        # 调整图片大小以适应预览区域
-        preview_img = self.resize_for_preview(self.resizer.processed_image)
+        # 调整图片大小以适应预览区域（按源图片和处理参数缓存预览图）
+        preview_img = self.preview_cache.get_image_preview(self.resizer.processed_image, self.processed_preview_key)
         
         # 创建PhotoImage对象
         self.preview_processed = ImageTk.PhotoImage(preview_img)
@@ -428,25 +472,10 @@ class ImageResizerGUI:
         self.processed_info.delete(1.0, tk.END)
         self.processed_info.config(state=tk.DISABLED)
     
-    def resize_for_preview(self, img):
-        # 获取预览区域大小
-        max_width = 350
-        max_height = 300
-        
-        # 计算缩放比例
-        width, height = img.size
-        ratio = min(max_width / width, max_height / height)
-        
-        # 如果图片小于预览区域，不进行缩放
-        if ratio >= 1:
-            return img
-        
-        # 缩放图片
-        new_width = int(width * ratio)
-        new_height = int(height * ratio)
-        return img.resize((new_width, new_height), Image.LANCZOS)
-    
     def process_image(self):
+        if self.busy:
+            return
+        
         if not self.resizer.original_image:
             messagebox.showerror("错误", "请先选择图片")
             return
@@ -477,27 +506,10 @@ class ImageResizerGUI:
                                         "是否继续?"):
                     return
             
-            if not self.resizer.process_image_quality(quality, target_size):
-                messagebox.showerror("错误", "处理图片失败")
-                return
-            
-            # 检查处理后的大小是否接近目标大小
-            if target_size > 0:
-                buffer = io.BytesIO()
-                if img_format.lower() in ["jpeg", "jpg"]:
-                    self.resizer.processed_image.save(buffer, format=img_format, quality=quality)
-                else:
-                    self.resizer.processed_image.save(buffer, format=img_format)
-                
-                processed_size = len(buffer.getvalue()) / 1024  # 转换为KB
-                
-                # 如果是PNG格式且处理后大小与目标相差超过20%
-                if img_format.lower() == "png" and abs(processed_size - target_size) > target_size * 0.2:
-                    messagebox.showinfo("处理完成", 
-                                      f"图片已处理，但由于PNG格式的限制，\n" +
-                                      f"实际大小({processed_size:.2f}KB)与目标大小({target_size}KB)有差异。\n\n" +
-                                      "建议尝试调整尺寸方法或保存为JPEG格式以获得更精确的大小控制。")
+            params = (quality, target_size)
+            task = lambda: self.resizer.process_image_quality(quality, target_size)
         else:  # dimensions
+            target_size = 0
             width = self.width_var.get()
             height = self.height_var.get()
             keep_ratio = self.keep_ratio_var.get()
@@ -506,9 +518,43 @@ class ImageResizerGUI:
                 messagebox.showerror("错误", "宽度和高度必须大于0")
                 return
             
-            if not self.resizer.process_image_dimensions(width, height, keep_ratio):
-                messagebox.showerror("错误", "处理图片失败")
-                return
+            params = (width, height, keep_ratio)
+            task = lambda: self.resizer.process_image_dimensions(width, height, keep_ratio)
+        
+        # 处理结果预览图的缓存键
+        self.processed_preview_key = (os.path.abspath(self.image_path), os.path.getmtime(self.image_path), method, params,
+                                      self.resizer.search_strategy, self.resizer.fast_decode, self.resizer.resample)
+        
+        # 处理前的结果（与当前预览一致），取消或失败时恢复
+        self.previous_result = (self.resizer.processed_image, self.resizer.encoded_data, self.resizer.encoded_params)
+        
+        # 在后台线程中处理，避免界面卡顿；取消时在下一次编码前停止查找
+        def worker():
+            self.resizer.cancel_check = self.cancel_event.is_set
+            try:
+                success = task()
+            except Exception:
+                success = False
+            finally:
+                self.resizer.cancel_check = None
+            self.task_queue.put(("single_done", success, method, target_size, img_format))
+        
+        self.start_background_task("正在处理图片...")
+        threading.Thread(target=worker, daemon=True).start()
+    
+    def finish_process_image(self, success, method, target_size, img_format):
+        """单张图片处理完成后在界面线程中更新预览和信息"""
+        if not success:
+            messagebox.showerror("错误", "处理图片失败")
+            return
+        
+        # 检查处理后的大小是否接近目标大小
+        png_size_warning = False
+        if method == "quality" and target_size > 0:
+            processed_size = self.resizer.get_processed_size() / 1024  # 转换为KB
+            
+            # 如果是PNG格式且处理后大小与目标相差超过20%
+            png_size_warning = img_format.lower() == "png" and abs(processed_size - target_size) > target_size * 0.2
         
         # 显示处理后的图片预览
         self.show_processed_preview()
@@ -516,13 +562,87 @@ class ImageResizerGUI:
         # 更新处理后的图片信息
         self.update_processed_info()
         
-        # 如果不是PNG格式或没有特殊提示，显示常规成功消息
-        if not (method == "quality" and img_format.lower() == "png" and 
-                target_size > 0 and abs(processed_size - target_size) > target_size * 0.2):
+        if png_size_warning:
+            messagebox.showinfo("处理完成", 
+                              f"图片已处理，但由于PNG格式的限制，\n" +
+                              f"实际大小({processed_size:.2f}KB)与目标大小({target_size}KB)有差异。\n\n" +
+                              "建议尝试调整尺寸方法或保存为JPEG格式以获得更精确的大小控制。")
+        else:
             messagebox.showinfo("成功", "图片处理完成")
     
+    def start_background_task(self, status_text):
+        """进入后台处理状态：禁用处理按钮，启用取消按钮，并开始轮询进度队列"""
+        self.busy = True
+        self.cancel_event.clear()
+        self.status_label.config(text=status_text)
+        for button in (self.process_btn, self.save_btn, self.batch_process_btn):
+            button.config(state=tk.DISABLED)
+        for button in (self.cancel_btn, self.batch_cancel_btn):
+            button.config(state=tk.NORMAL)
+        self.root.after(POLL_INTERVAL, self.poll_queue)
+    
+    def finish_background_task(self, status_text=""):
+        """退出后台处理状态，恢复按钮（有处理结果时才能保存）"""
+        self.busy = False
+        self.status_label.config(text=status_text)
+        for button in (self.process_btn, self.batch_process_btn):
+            button.config(state=tk.NORMAL)
+        self.save_btn.config(state=tk.NORMAL if self.resizer.processed_image else tk.DISABLED)
+        for button in (self.cancel_btn, self.batch_cancel_btn):
+            button.config(state=tk.DISABLED)
+    
+    def poll_queue(self):
+        """在界面线程中处理后台任务发来的消息"""
+        try:
+            while True:
+                message = self.task_queue.get_nowait()
+                kind = message[0]
+                
+                if kind == "single_done":
+                    cancelled = self.cancel_event.is_set()
+                    if cancelled or not message[1]:
+                        # 取消或失败的处理结果不能保存，恢复为处理前的结果
+                        self.restore_previous_result()
+                    self.finish_background_task("已取消" if cancelled else "")
+                    if not cancelled:
+                        self.finish_process_image(*message[1:])
+                elif kind == "batch_submitted":
+                    self.handle_batch_submitted(message[1])
+                elif kind == "batch_skipped":
+                    self.handle_batch_skipped(message[1])
+                elif kind == "batch_scan_done":
+                    self.handle_batch_scan_done()
+                elif kind == "batch_result":
+                    self.handle_batch_result(message[1])
+        except queue.Empty:
+            pass
+        
+        if self.busy:
+            self.root.after(POLL_INTERVAL, self.poll_queue)
+    
+    def restore_previous_result(self):
+        """把单张图片的处理结果恢复为开始处理前的结果"""
+        self.resizer.processed_image, self.resizer.encoded_data, self.resizer.encoded_params = self.previous_result
+        self.previous_result = None
+    
+    def cancel_processing(self):
+        """取消正在进行的处理：单张图片在下一次编码前停止；批量处理中尚未开始的图片不再处理，正在处理的图片完成后停止"""
+        if not self.busy:
+            return
+        
+        self.cancel_event.set()
+        self.status_label.config(text="正在取消...")
+        
+        if self.batch_state is not None:
+            for future in list(self.batch_futures):
+                future.cancel()
+            self.progress_label.config(text="正在取消，等待正在处理的图片完成...")
+    
     def save_image(self):
         """保存处理后的图片"""
+        if self.busy:
+            return
+        
         if not self.resizer.processed_image:
             messagebox.showwarning("警告", "请先处理图片")
             return
@@ -551,27 +671,17 @@ class ImageResizerGUI:
         folder_path = filedialog.askdirectory(title="选择包含图片的文件夹")
         
         if folder_path:
+            # 图片在开始处理后边扫描边处理，大文件夹不需要等待扫描完成
             self.batch_folder = folder_path
             self.folder_var.set(folder_path)
-            
-            # 获取文件夹中的所有图片文件
-            self.batch_files = []
-            supported_extensions = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff", ".tif", ".webp")
-            
-            for file in os.listdir(folder_path):
-                file_path = os.path.join(folder_path, file)
-                if os.path.isfile(file_path) and file.lower().endswith(supported_extensions):
-                    self.batch_files.append(file_path)
-            
-            if self.batch_files:
-                self.progress_label.config(text=f"找到 {len(self.batch_files)} 个图片文件")
-            else:
-                self.progress_label.config(text="文件夹中没有支持的图片文件")
-                messagebox.showinfo("提示", "所选文件夹中没有支持的图片文件")
+            self.progress_label.config(text="已选择文件夹，开始处理时扫描图片")
     
     def batch_process(self):
-        """批量处理图片"""
-        if not self.batch_files:
+        """批量处理图片（在后台工作进程中并行处理）"""
+        if self.busy:
+            return
+        
+        if not self.batch_folder:
             messagebox.showerror("错误", "请先选择包含图片的文件夹")
             return
         
@@ -589,62 +699,196 @@ class ImageResizerGUI:
         height = self.height_var.get()
         keep_ratio = self.keep_ratio_var.get()
         
+        try:
+            workers = max(1, int(self.workers_var.get()))
+        except (ValueError, tk.TclError):
+            messagebox.showerror("错误", "并发数必须是正整数")
+            return
+        
         # 创建输出文件夹
         output_folder = os.path.join(self.batch_folder, "resized_images")
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
         
-        # 处理进度
-        total_files = len(self.batch_files)
-        processed_count = 0
-        success_count = 0
-        failed_count = 0
-        
-        # 批量处理
-        for file_path in self.batch_files:
-            # 更新进度
-            processed_count += 1
-            progress = (processed_count / total_files) * 100
-            self.progress_var.set(progress)
-            self.progress_label.config(text=f"处理中: {processed_count}/{total_files} - {file_path}")
-            self.root.update()
-            
-            # 加载图片
-            if not self.resizer.load_image(file_path):
-                failed_count += 1
-                continue
-            
-            # 处理图片
-            success = False
-            if method == "quality":
-                success = self.resizer.process_image_quality(quality, target_size)
-            else:  # dimensions
-                success = self.resizer.process_image_dimensions(width, height, keep_ratio)
+        # 批量处理清单，中断后重新处理时跳过已完成的图片
+        options = {
+            "method": method,
+            "quality": quality,
+            "target_size": target_size,
+            "width": width,
+            "height": height,
+            "keep_ratio": keep_ratio,
+        }
+        manifest = BatchManifest(os.path.join(output_folder, "batch_manifest.jsonl"), options)
+        
+        # 处理进度（total为已扫描到的图片数，扫描结束前不断增加）
+        self.batch_state = {
+            "total": 0,
+            "processed": 0,
+            "success": 0,
+            "failed": 0,
+            "skipped": 0,
+            "cancelled": 0,
+            "pending": 0,
+            "scanning": True,
+            "manifest": manifest,
+            "output_folder": output_folder,
+        }
+        self.progress_var.set(0)
+        self.start_background_task("正在批量处理...")
+        self.update_batch_progress()
+        
+        # 在后台线程中扫描文件夹，边扫描边把未完成的图片提交给工作进程
+        self.batch_executor = ProcessPoolExecutor(max_workers=workers)
+        self.batch_futures = set()
+        scan_thread = threading.Thread(
+            target=self.scan_batch_folder,
+            args=(self.batch_folder, self.recursive_var.get(), output_folder, options, manifest, workers),
+            daemon=True,
+        )
+        scan_thread.start()
+    
+    def scan_batch_folder(self, folder, recursive, output_folder, options, manifest, workers):
+        """扫描并提交批量任务（后台线程），通过队列通知界面线程
+        
+        同时提交给工作进程的任务数有上限，任务完成后再继续扫描，避免大文件夹的任务在内存中堆积。
+        """
+        executor = self.batch_executor
+        slots = threading.Semaphore(workers * MAX_PENDING_PER_WORKER)
+        
+        for file_path, root in iter_input_files([folder], recursive):
+            if self.cancel_event.is_set():
+                break
             
-            if not success:
-                failed_count += 1
+            # 跳过清单中已完成的图片
+            output_path = build_output_path(file_path, output_folder, root)
+            if manifest.is_done(file_path, output_path):
+                self.task_queue.put(("batch_skipped", file_path))
                 continue
             
-            # 保存图片
-            base_name = os.path.basename(file_path)
-            output_path = os.path.join(output_folder, f"resized_{base_name}")
+            # 等待空闲的名额，等待时也响应取消
+            while not slots.acquire(timeout=POLL_INTERVAL / 1000):
+                if self.cancel_event.is_set():
+                    break
+            if self.cancel_event.is_set():
+                break
             
-            if self.resizer.save_image(output_path, quality):
-                success_count += 1
+            try:
+                future = executor.submit(process_file, (file_path, output_path, options, None))
+            except RuntimeError:
+                # 窗口关闭时工作进程已停止
+                break
+            # 先通知提交再注册回调，保证界面线程先收到提交消息再收到结果
+            self.task_queue.put(("batch_submitted", future))
+            future.add_done_callback(lambda f: (slots.release(), self.task_queue.put(("batch_result", f))))
+        
+        self.task_queue.put(("batch_scan_done",))
+    
+    def handle_batch_submitted(self, future):
+        """记录一个已提交的批量任务（界面线程）"""
+        state = self.batch_state
+        state["total"] += 1
+        state["pending"] += 1
+        self.batch_futures.add(future)
+        if self.cancel_event.is_set():
+            future.cancel()
+        self.update_batch_progress()
+    
+    def handle_batch_skipped(self, file_path):
+        """记录一个清单中已完成的图片（界面线程）"""
+        state = self.batch_state
+        state["total"] += 1
+        state["skipped"] += 1
+        state["processed"] += 1
+        self.update_batch_progress(file_path)
+    
+    def handle_batch_scan_done(self):
+        """扫描结束，所有任务都已完成时结束批量处理（界面线程）"""
+        state = self.batch_state
+        state["scanning"] = False
+        self.update_batch_progress()
+        if state["pending"] == 0:
+            self.finish_batch()
+    
+    def handle_batch_result(self, future):
+        """处理一个批量任务的结果（界面线程）"""
+        state = self.batch_state
+        state["pending"] -= 1
+        state["processed"] += 1
+        # 只保留未完成的任务（取消时使用），已完成的任务及其结果不在批量处理期间累积
+        self.batch_futures.discard(future)
+        
+        if future.cancelled():
+            state["cancelled"] += 1
+        else:
+            try:
+                result = future.result()
+            except Exception as e:
+                state["failed"] += 1
+                self.update_batch_progress(f"失败: {str(e)}")
             else:
-                failed_count += 1
+                # 记录处理结果
+                state["manifest"].record(result)
+                if result["success"]:
+                    state["success"] += 1
+                else:
+                    state["failed"] += 1
+                self.update_batch_progress(result["input"])
+        
+        if state["pending"] == 0 and not state["scanning"]:
+            self.finish_batch()
+    
+    def update_batch_progress(self, current_file=""):
+        """更新批量处理进度条和进度文本"""
+        state = self.batch_state
+        progress = (state["processed"] / state["total"]) * 100 if state["total"] else 0
+        self.progress_var.set(progress)
+        if not self.cancel_event.is_set():
+            scanning = "（正在扫描）" if state["scanning"] else ""
+            self.progress_label.config(text=f"处理中: {state['processed']}/{state['total']}{scanning} - {current_file}")
+    
+    def finish_batch(self):
+        """批量处理结束后释放工作进程并显示结果"""
+        state = self.batch_state
+        self.batch_state = None
+        self.batch_futures = set()
+        if self.batch_executor is not None:
+            self.batch_executor.shutdown(wait=False)
+            self.batch_executor = None
+        
+        cancelled = self.cancel_event.is_set()
+        self.finish_background_task("已取消" if cancelled else "")
+        
+        if state["total"] == 0 and not cancelled:
+            self.progress_var.set(0)
+            self.progress_label.config(text="文件夹中没有支持的图片文件")
+            messagebox.showinfo("提示", "所选文件夹中没有支持的图片文件")
+            return
         
         # 更新进度
         self.progress_var.set(100)
-        self.progress_label.config(text=f"处理完成: 成功 {success_count} 个, 失败 {failed_count} 个")
+        summary = f"成功 {state['success']} 个, 失败 {state['failed']} 个, 跳过 {state['skipped']} 个"
+        if cancelled:
+            summary += f", 取消 {state['cancelled']} 个"
+        self.progress_label.config(text=("已取消: " if cancelled else "处理完成: ") + summary)
         
         # 显示结果
-        messagebox.showinfo("批量处理完成", 
-                          f"处理完成:\n" +
-                          f"- 总计: {total_files} 个文件\n" +
-                          f"- 成功: {success_count} 个\n" +
-                          f"- 失败: {failed_count} 个\n\n" +
-                          f"处理后的图片保存在:\n{output_folder}")
+        messagebox.showinfo("批量处理已取消" if cancelled else "批量处理完成", 
+                          f"处理{'已取消' if cancelled else '完成'}:\n" +
+                          f"- 总计: {state['total']} 个文件\n" +
+                          f"- 成功: {state['success']} 个\n" +
+                          f"- 失败: {state['failed']} 个\n" +
+                          f"- 跳过: {state['skipped']} 个（之前已完成）\n" +
+                          (f"- 取消: {state['cancelled']} 个\n" if cancelled else "") +
+                          f"\n处理后的图片保存在:\n{state['output_folder']}")
+    
+    def on_close(self):
+        """关闭窗口时取消尚未开始的批量任务"""
+        if self.busy:
+            self.cancel_processing()
+        if self.batch_executor is not None:
+            self.batch_executor.shutdown(wait=False)
+        self.root.quit()
     
     def browse_save_path(self):
         """选择保存路径"""
@@ -657,7 +901,7 @@ def main():
     root = tk.Tk()
     app = ImageResizerGUI(root)
     # 添加窗口关闭事件处理
-    root.protocol("WM_DELETE_WINDOW", root.quit)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
     root.mainloop()
 
 
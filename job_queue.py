@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import queue
+import contextlib
+import multiprocessing
+from image_resizer import add_processing_arguments, add_instrumentation_arguments, processing_options
+from batch_processor import (add_input_arguments, create_file_filter, iter_input_files, build_output_path,
+                             process_file, print_result, print_failure)
+from result_cache import add_cache_arguments
+from processing_stats import JsonlStatsSink
+
+# 默认的租约时长（秒）：工作进程在租约期间定期续约，崩溃后租约过期，任务由其他工作进程重新领取
+DEFAULT_LEASE_SECONDS = 300
+
+# 默认的最多领取次数：租约反复过期（如图片导致工作进程崩溃）的任务达到该次数后标记为失败
+DEFAULT_MAX_ATTEMPTS = 3
+
+# 没有可领取的任务、但其他工作进程仍持有租约时，等待的间隔（秒）
+POLL_INTERVAL = 2.0
+
+# 等待其他进程释放数据库锁的超时（秒）
+LOCK_TIMEOUT = 60
+
+# 添加任务时每个事务写入的任务数，避免长时间持有数据库锁
+ADD_CHUNK_SIZE = 1000
+
+# 任务状态
+STATUSES = ("pending", "leased", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    input TEXT NOT NULL UNIQUE,
+    output TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    input_size INTEGER,
+    input_mtime_ns INTEGER,
+    output_size INTEGER,
+    probes INTEGER,
+    cache TEXT,
+    elapsed REAL,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+
+def default_worker_id():
+    """当前进程的工作进程标识：主机名:进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """基于SQLite的任务队列：多个工作进程（或共享文件系统上的多台机器）从同一个队列领取任务
+
+    每个任务是一个输入文件及其输出路径和处理参数。工作进程领取任务时获得有期限的租约，
+    处理期间定期续约；工作进程崩溃后租约过期，任务由其他工作进程重新领取，
+    领取次数达到max_attempts后标记为失败。每个任务的处理结果（大小、耗时、错误信息）保存在队列中。
+
+    所有修改都在BEGIN IMMEDIATE事务中进行，多个进程同时领取时不会领到同一个任务。
+    数据库使用SQLite默认的回滚日志（不使用WAL，WAL不支持网络文件系统），
+    多台机器共享时文件系统必须支持文件锁，且各机器的时钟基本一致（租约按时间戳判断是否过期）。
+    """
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # 事务由_transaction显式管理
+        self.conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        with self._transaction():
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    self.conn.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """关闭数据库连接"""
+        self.conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """写事务：开始时立即获取写锁，其他进程的写事务等待（最多LOCK_TIMEOUT秒）"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def add(self, jobs):
+        """添加任务，jobs为(输入路径, 输出路径, 处理参数)的可迭代对象
+
+        输入路径转换为绝对路径，已在队列中的输入不会重复添加。返回新添加的任务数。
+        """
+        added = 0
+        chunk = []
+        for file_path, output_path, options in jobs:
+            chunk.append((os.path.abspath(file_path), os.path.abspath(output_path),
+                          json.dumps(options, sort_keys=True), time.time()))
+            if len(chunk) >= ADD_CHUNK_SIZE:
+                added += self._insert(chunk)
+                chunk = []
+        if chunk:
+            added += self._insert(chunk)
+        return added
+
+    def _insert(self, rows):
+        """在一个事务中写入一组任务，返回新添加的任务数"""
+        before = self.conn.total_changes
+        with self._transaction():
+            self.conn.executemany("INSERT OR IGNORE INTO jobs (input, output, options, updated) VALUES (?, ?, ?, ?)", rows)
+        return self.conn.total_changes - before
+
+    def lease(self, worker):
+        """领取一个任务，返回字典（id、input、output、options、attempts），没有可领取的任务时返回None
+
+        可领取的任务包括等待中的任务和租约已过期的任务；租约已过期且领取次数已达上限的任务标记为失败。
+        """
+        now = time.time()
+        with self._transaction():
+            self.conn.execute("UPDATE jobs SET status = 'failed', error = ?, worker = NULL, lease_expires = NULL, updated = ? "
+                              "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                              (f"错误: 租约过期{self.max_attempts}次（工作进程可能在处理时崩溃）", now, now, self.max_attempts))
+            row = self.conn.execute("SELECT id, input, output, options, attempts FROM jobs "
+                                    "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                                    "ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                              "updated = ? WHERE id = ?", (worker, now + self.lease_seconds, now, row["id"]))
+
+        return {
+            "id": row["id"],
+            "input": row["input"],
+            "output": row["output"],
+            "options": json.loads(row["options"]),
+            "attempts": row["attempts"] + 1,
+        }
+
+    def renew(self, job_id, worker):
+        """延长任务的租约，租约已被其他工作进程领取时返回False"""
+        now = time.time()
+        with self._transaction():
+            cursor = self.conn.execute("UPDATE jobs SET lease_expires = ?, updated = ? "
+                                       "WHERE id = ? AND worker = ? AND status = 'leased'",
+                                       (now + self.lease_seconds, now, job_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, result):
+        """记录任务的处理结果（batch_processor.process_file的结果），租约已被其他工作进程领取时不记录，返回False"""
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_expires = NULL, input_size = ?, input_mtime_ns = ?, "
+                "output_size = ?, probes = ?, cache = ?, elapsed = ?, error = ?, updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                ("done" if result["success"] else "failed", worker, result["input_size"], result["input_mtime_ns"],
+                 result["output_size"], result["probes"], result["cache"], round(result["elapsed"], 4),
+                 result["error"], time.time(), job_id, worker))
+        return cursor.rowcount == 1
+
+    def retry_failed(self):
+        """把失败的任务重新设为等待中（领取次数清零），返回任务数"""
+        with self._transaction():
+            cursor = self.conn.execute("UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL, error = NULL, "
+                                       "updated = ? WHERE status = 'failed'", (time.time(),))
+        return cursor.rowcount
+
+    def counts(self):
+        """各状态的任务数，expired为其中租约已过期的任务数"""
+        counts = dict.fromkeys(STATUSES, 0)
+        for row in self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[row[0]] = row[1]
+        counts["expired"] = self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'leased' AND lease_expires < ?",
+                                              (time.time(),)).fetchone()[0]
+        return counts
+
+    def records(self, status=None):
+        """逐个返回任务记录（字典），status为None时返回所有任务"""
+        query = "SELECT * FROM jobs"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        for row in self.conn.execute(query + " ORDER BY id", params):
+            record = dict(row)
+            record["options"] = json.loads(record["options"])
+            yield record
+
+
+def _renew_lease(path, worker, lease_seconds, current, stop):
+    """在后台线程中定期续约当前处理的任务，处理时间超过租约时长的大图片不会被其他工作进程重复领取"""
+    with JobQueue(path, lease_seconds) as job_queue:
+        while not stop.wait(lease_seconds / 3):
+            job_id = current.get("id")
+            if job_id is not None:
+                try:
+                    job_queue.renew(job_id, worker)
+                except sqlite3.Error:
+                    # 数据库暂时被锁定，下次再续约
+                    pass
+
+
+def run_worker(path, cache_config=None, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+               wait=True, quiet=False, stats_jsonl=None):
+    """工作进程：反复领取并处理任务，直到队列中没有可领取的任务，返回汇总信息
+
+    wait为True时，其他工作进程仍持有租约的情况下继续等待，它们崩溃后可以接手过期的任务；
+    为False时没有可领取的任务就结束。
+    """
+    worker = default_worker_id()
+    summary = {"worker": worker, "success": 0, "failed": 0, "lost": 0}
+    stats_sink = JsonlStatsSink(stats_jsonl) if stats_jsonl else None
+    on_result = print_failure if quiet else print_result
+
+    current = {}
+    stop = threading.Event()
+    renewer = threading.Thread(target=_renew_lease, args=(path, worker, lease_seconds, current, stop), daemon=True)
+    renewer.start()
+
+    try:
+        with JobQueue(path, lease_seconds, max_attempts) as job_queue:
+            while True:
+                job = job_queue.lease(worker)
+                if job is None:
+                    if not wait or job_queue.counts()["leased"] == 0:
+                        break
+                    time.sleep(POLL_INTERVAL)
+                    continue
+
+                current["id"] = job["id"]
+                try:
+                    result = process_file((job["input"], job["output"], job["options"], cache_config))
+                finally:
+                    current["id"] = None
+
+                if not job_queue.complete(job["id"], worker, result):
+                    # 租约已过期并被其他工作进程领取，以其结果为准
+                    summary["lost"] += 1
+                    continue
+                summary["success" if result["success"] else "failed"] += 1
+                if stats_sink and result["stats"]:
+                    stats_sink.write(result["stats"])
+                on_result(result, summary["success"] + summary["failed"], None)
+    finally:
+        stop.set()
+        renewer.join()
+
+    return summary
+
+
+def _worker_main(path, results, kwargs):
+    """独立工作进程的入口：处理队列，把汇总信息放入results"""
+    results.put(run_worker(path, **kwargs))
+
+
+def run_workers(path, workers=1, **kwargs):
+    """启动多个工作进程处理同一个队列，返回每个工作进程的汇总信息；参数与run_worker相同
+
+    每个工作进程都是独立的进程（不使用进程池：进程池中一个进程崩溃会终止其他所有进程），
+    一个工作进程崩溃后其他工作进程继续处理，并在租约过期后接手它未完成的任务。
+    崩溃的工作进程的汇总信息中exitcode为其退出码，处理数量未知（记为0）。
+    """
+    if workers == 1:
+        # 单进程时直接在当前进程处理，便于调试
+        return [run_worker(path, **kwargs)]
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_worker_main, args=(path, results, kwargs)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    # 先取出汇总信息再等待进程结束，避免进程因队列未读完而无法退出
+    summaries = {}
+    while len(summaries) < workers and any(process.is_alive() for process in processes):
+        try:
+            summary = results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        summaries[summary["worker"]] = summary
+    while True:
+        try:
+            summary = results.get_nowait()
+        except queue.Empty:
+            break
+        summaries[summary["worker"]] = summary
+    for process in processes:
+        process.join()
+
+    hostname = socket.gethostname()
+    for process in processes:
+        worker = f"{hostname}:{process.pid}"
+        if worker not in summaries:
+            summaries[worker] = {"worker": worker, "success": 0, "failed": 0, "lost": 0, "exitcode": process.exitcode}
+    return [summaries[f"{hostname}:{process.pid}"] for process in processes]
+
+
+def print_counts(counts):
+    """打印队列中各状态的任务数"""
+    print(f"- 等待: {counts['pending']} 个")
+    print(f"- 处理中: {counts['leased']} 个（其中租约已过期 {counts['expired']} 个）")
+    print(f"- 完成: {counts['done']} 个")
+    print(f"- 失败: {counts['failed']} 个")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="image_resizer.py queue",
+                                     description="任务队列 - 多个工作进程（或共享文件系统上的多台机器）通过同一个SQLite数据库分工处理大量图片")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="扫描图片并添加到队列，处理参数随任务一起保存")
+    add_parser.add_argument("database", help="队列数据库文件，不存在时自动创建")
+    add_input_arguments(add_parser)
+    add_parser.add_argument("-o", "--output-dir", help="输出文件夹，默认为原图所在文件夹下的resized_images。"
+                            "扫描子文件夹时在输出文件夹中保持原来的子文件夹结构")
+    add_processing_arguments(add_parser)
+
+    work_parser = subparsers.add_parser("work", help="领取并处理队列中的任务，直到没有可领取的任务")
+    work_parser.add_argument("database", help="队列数据库文件")
+    work_parser.add_argument("-j", "--workers", type=int, default=0, help="工作进程数，默认为CPU核心数")
+    work_parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS,
+                             help=f"租约时长(秒)，工作进程崩溃后任务在租约过期后重新处理，默认为{DEFAULT_LEASE_SECONDS}")
+    work_parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                             help=f"每个任务最多领取的次数，租约反复过期的任务标记为失败，默认为{DEFAULT_MAX_ATTEMPTS}")
+    work_parser.add_argument("--no-wait", action="store_false", dest="wait",
+                             help="没有可领取的任务时立即结束，不等待其他工作进程的租约过期")
+    add_cache_arguments(work_parser)
+    add_instrumentation_arguments(work_parser)
+
+    status_parser = subparsers.add_parser("status", help="显示队列中各状态的任务数和失败的文件")
+    status_parser.add_argument("database", help="队列数据库文件")
+    status_parser.add_argument("--jsonl", action="store_true", help="以JSON Lines格式输出所有任务的处理结果")
+
+    retry_parser = subparsers.add_parser("retry", help="把失败的任务重新设为等待中")
+    retry_parser.add_argument("database", help="队列数据库文件")
+
+    args = parser.parse_args(argv)
+
+    if args.command != "add" and not os.path.exists(args.database):
+        print(f"\n错误: 队列数据库不存在: {args.database}")
+        return 1
+
+    if args.command == "add":
+        if args.method == "dimensions" and (args.width <= 0 or args.height <= 0):
+            print("\n错误: 使用dimensions方法时，必须指定宽度和高度")
+            return 1
+        options = processing_options(args)
+        files = iter_input_files(args.inputs, args.recursive, create_file_filter(args),
+                                 skip_dirs=[args.output_dir] if args.output_dir else ())
+        found = 0
+
+        def iter_jobs():
+            nonlocal found
+            for file_path, root in files:
+                found += 1
+                yield file_path, build_output_path(file_path, args.output_dir, root), options
+
+        with JobQueue(args.database) as job_queue:
+            added = job_queue.add(iter_jobs())
+        if found == 0:
+            print("\n错误: 没有找到支持的图片文件")
+            return 1
+        print(f"已添加 {added} 个任务（{found - added} 个文件已在队列中）")
+        return 0
+
+    if args.command == "work":
+        if args.lease <= 0 or args.max_attempts < 1:
+            print("\n错误: 租约时长必须大于0，最多领取次数必须大于0")
+            return 1
+        workers = args.workers if args.workers > 0 else os.cpu_count() or 1
+        cache_config = (args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+
+        start_time = time.perf_counter()
+        summaries = run_workers(args.database, workers, cache_config=cache_config, lease_seconds=args.lease,
+                                max_attempts=args.max_attempts, wait=args.wait, quiet=args.quiet,
+                                stats_jsonl=args.stats_jsonl)
+        elapsed = time.perf_counter() - start_time
+        failed = sum(summary["failed"] for summary in summaries)
+        for summary in summaries:
+            if "exitcode" in summary:
+                print(f"\n错误: 工作进程 {summary['worker']} 异常退出（退出码 {summary['exitcode']}），"
+                      f"其未完成的任务在租约过期后由其他工作进程处理")
+
+        if not args.quiet:
+            print(f"\n队列处理完成:")
+            print(f"- 工作进程: {workers} 个")
+            print(f"- 成功: {sum(summary['success'] for summary in summaries)} 个")
+            print(f"- 失败: {failed} 个")
+            lost = sum(summary["lost"] for summary in summaries)
+            if lost:
+                print(f"- 租约丢失: {lost} 个（租约过期后已由其他工作进程处理）")
+            print(f"- 耗时: {elapsed:.2f}s")
+            with JobQueue(args.database) as job_queue:
+                counts = job_queue.counts()
+            print(f"\n队列状态:")
+            print_counts(counts)
+        return 0 if failed == 0 else 1
+
+    with JobQueue(args.database) as job_queue:
+        if args.command == "retry":
+            print(f"已重新设为等待中: {job_queue.retry_failed()} 个任务")
+            return 0
+
+        # status
+        if args.jsonl:
+            for record in job_queue.records():
+                print(json.dumps(record, ensure_ascii=False))
+            return 0
+
+        print(f"队列: {args.database}")
+        print_counts(job_queue.counts())
+        failed = list(job_queue.records("failed"))
+        if failed:
+            print(f"\n失败的文件:")
+            for record in failed:
+                print(f"- {record['input']}: {record['error']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
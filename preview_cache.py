@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+from collections import OrderedDict
+from PIL import Image
+
+# 预览区域大小
+PREVIEW_SIZE = (350, 300)
+
+# 默认最多缓存的预览图数量
+DEFAULT_MAX_ENTRIES = 64
+
+
+class PreviewCache:
+    """界面预览图的内存缓存
+
+    预览图以(图片, 预览区域大小, 处理参数)为键缓存，重复显示和重绘同一张图片时直接复用；
+    超过数量上限时按最近最少使用（LRU）的顺序淘汰。单张预览和批量缩略图共用同一个缓存。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_file_preview(self, path, size=PREVIEW_SIZE):
+        """返回图片文件的预览图
+
+        JPEG不解码原始分辨率，直接以1/2、1/4或1/8比例解码；
+        其它格式在解码后先用整数倍缩小，再用快速滤镜缩放到预览大小。
+        """
+        stat = os.stat(path)
+        key = ("file", os.path.abspath(path), stat.st_mtime_ns, stat.st_size, tuple(size))
+        preview = self._get(key)
+        if preview is not None:
+            return preview
+
+        with Image.open(path) as img:
+            # JPEG缩放解码，只解码不小于预览大小的最小比例
+            img.draft(img.mode, size)
+            preview = self._make_thumbnail(img, size)
+
+        self._put(key, preview)
+        return preview
+
+    def get_image_preview(self, image, key, size=PREVIEW_SIZE):
+        """返回内存中图片（如处理结果）的预览图，key需唯一标识图片内容，如源文件和处理参数"""
+        key = ("image", key, tuple(size))
+        preview = self._get(key)
+        if preview is not None:
+            return preview
+
+        preview = self._make_thumbnail(image, size)
+        self._put(key, preview)
+        return preview
+
+    def clear(self):
+        """清空缓存"""
+        self.entries.clear()
+
+    def _make_thumbnail(self, image, size):
+        """按比例缩放到预览区域内，小于预览区域的图片不放大"""
+        width, height = image.size
+        ratio = min(size[0] / width, size[1] / height)
+        if ratio >= 1:
+            image.load()
+            return image.copy()
+
+        # 先用整数倍缩小（reducing_gap），再用快速的双线性滤镜缩放，不复制原图
+        new_size = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+        return image.resize(new_size, Image.BILINEAR, reducing_gap=2.0)
+
+    def _get(self, key):
+        preview = self.entries.get(key)
+        if preview is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return preview
+
+    def _put(self, key, preview):
+        self.entries[key] = preview
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # Windows下没有resource模块
+    resource = None
+
+
+class ProcessingStats:
+    """单张图片处理过程中各阶段的耗时和字节数
+
+    每个阶段（open、decode、resize、encode、write等）的每一次执行记录为一个事件，
+    包括耗时（秒）、字节数和附加信息，如编码时的格式、尺寸和质量值。
+    """
+
+    def __init__(self, source_path=""):
+        self.source_path = source_path
+        self.start_time = time.time()
+        self.events = []
+        self.success = None
+
+    def record(self, stage, seconds, size=0, **info):
+        """记录一个阶段事件"""
+        event = dict(info, stage=stage, seconds=seconds, bytes=size)
+        self.events.append(event)
+        return event
+
+    @contextlib.contextmanager
+    def measure(self, stage, size=0, **info):
+        """计时一个阶段，返回的事件可以在with块中补充字节数等信息"""
+        event = self.record(stage, 0.0, size, **info)
+        start_time = time.perf_counter()
+        try:
+            yield event
+        finally:
+            event["seconds"] = time.perf_counter() - start_time
+
+    def stage_totals(self):
+        """按阶段汇总次数、耗时和字节数"""
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault(event["stage"], {"count": 0, "seconds": 0.0, "bytes": 0})
+            total["count"] += 1
+            total["seconds"] += event["seconds"]
+            total["bytes"] += event["bytes"]
+        return totals
+
+    def to_dict(self):
+        """转换为可以序列化为JSON的字典"""
+        stages = self.stage_totals()
+        for total in stages.values():
+            total["seconds"] = round(total["seconds"], 6)
+        return {
+            "input": self.source_path,
+            "success": self.success,
+            "time": self.start_time,
+            "seconds": round(sum(event["seconds"] for event in self.events), 6),
+            "stages": stages,
+            "events": [dict(event, seconds=round(event["seconds"], 6)) for event in self.events],
+        }
+
+
+class JsonlStatsSink:
+    """把每张图片的处理统计以JSON Lines格式追加写入文件，每张图片一行"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, stats):
+        """写入一条统计，stats为ProcessingStats或其to_dict()的结果"""
+        if isinstance(stats, ProcessingStats):
+            stats = stats.to_dict()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(stats, ensure_ascii=False) + "\n")
+
+
+def count_open_files():
+    """当前进程打开的文件描述符数量，无法获取时（如Windows）返回None"""
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            # 列出目录本身会临时打开一个文件描述符
+            return len(os.listdir(fd_dir)) - 1
+        except OSError:
+            continue
+    return None
+
+
+def peak_rss():
+    """当前进程的峰值内存（RSS，字节），无法获取时返回None"""
+    # Linux下优先读取VmHWM：ru_maxrss在fork后会保留父进程的峰值
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak if sys.platform == "darwin" else peak * 1024
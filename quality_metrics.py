@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+# numpy是可选依赖，只有按目标SSIM/PSNR查找质量值时才需要
+import numpy as np
+
+# 支持的质量指标
+METRICS = ("ssim", "psnr")
+
+# SSIM的窗口大小和稳定常数（8位图片）
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# 分条计算指标时每条最多包含的窗口（PSNR为像素）数，每条的中间结果约256KB
+METRIC_STRIP_SIZE = 32768
+
+# 两张图片完全相同时的PSNR（dB）
+PSNR_MAX = 100.0
+
+
+def luma_array(image, max_side=0):
+    """把图片转换为亮度通道的uint8数组（计算指标时再按条转换为浮点数）
+
+    max_side大于0且图片超过该尺寸时，先按整数倍盒式缩小（Image.reduce）再转换，加快计算。
+    缩小会平滑掉部分压缩瑕疵，参考图和编码结果必须使用相同的max_side。
+    """
+    luma = image if image.mode == "L" else image.convert("L")
+    if max_side and max(luma.size) > max_side:
+        luma = luma.reduce(math.ceil(max(luma.size) / max_side))
+    return np.asarray(luma, dtype=np.uint8)
+
+
+def _box_sum(values, window):
+    """计算每个window x window窗口内的和（只保留完整的窗口），返回float64数组
+
+    先按行、再按列累加window个错位的float32切片。values为亮度值或其乘积（不超过255 * 255的整数）时
+    窗口和不超过2 ** 24，float32的累加结果是精确的。
+    """
+    rows = values.shape[0] - window + 1
+    cols = values.shape[1] - window + 1
+    vertical = values[:rows].copy()
+    for offset in range(1, window):
+        vertical += values[offset:offset + rows]
+    total = vertical[:, :cols].copy()
+    for offset in range(1, window):
+        total += vertical[:, offset:offset + cols]
+    return total.astype(np.float64)
+
+
+def _strips(shape, window):
+    """把完整窗口的行分条，返回每条在数组中的(起始行, 结束行)，相邻两条重叠window - 1行"""
+    rows = shape[0] - window + 1
+    step = max(1, METRIC_STRIP_SIZE // (shape[1] - window + 1))
+    return [(top, min(rows, top + step) + window - 1) for top in range(0, rows, step)]
+
+
+def _ssim_map_sum(reference, image, window):
+    """计算一条中各窗口的SSIM之和，reference和image为float32数组"""
+    count = window * window
+    mean_x = _box_sum(reference, window) / count
+    mean_y = _box_sum(image, window) / count
+    # 方差和协方差在float64中由精确的窗口和计算，避免float32相减的精度损失
+    var_x = _box_sum(reference * reference, window) / count - mean_x * mean_x
+    var_y = _box_sum(image * image, window) / count - mean_y * mean_y
+    cov_xy = _box_sum(reference * image, window) / count - mean_x * mean_y
+
+    ssim_map = (((2 * mean_x * mean_y + SSIM_C1) * (2 * cov_xy + SSIM_C2))
+                / ((mean_x * mean_x + mean_y * mean_y + SSIM_C1) * (var_x + var_y + SSIM_C2)))
+    return float(ssim_map.sum())
+
+
+def compute_ssim(reference, image):
+    """计算两个亮度数组（uint8）的平均SSIM（均匀窗口），取值不超过1，越大越接近
+
+    分条计算，中间结果只按条分配，不按整张图片分配。
+    """
+    window = min(SSIM_WINDOW, reference.shape[0], reference.shape[1])
+    total = 0.0
+    for top, bottom in _strips(reference.shape, window):
+        total += _ssim_map_sum(reference[top:bottom].astype(np.float32), image[top:bottom].astype(np.float32), window)
+    return total / ((reference.shape[0] - window + 1) * (reference.shape[1] - window + 1))
+
+
+def compute_psnr(reference, image):
+    """计算两个亮度数组（uint8）的PSNR（dB），完全相同时返回PSNR_MAX"""
+    squared = 0.0
+    for top, bottom in _strips(reference.shape, 1):
+        squared += float(np.square(reference[top:bottom].astype(np.float64) - image[top:bottom]).sum())
+    mse = squared / reference.size
+    if mse == 0:
+        return PSNR_MAX
+    return min(PSNR_MAX, 10 * math.log10(255 * 255 / mse))
+
+
+class MetricReference:
+    """查找质量值时的参考图：亮度数组只计算一次"""
+
+    def __init__(self, image, max_side=0):
+        self.max_side = max_side
+        self.luma = luma_array(image, max_side)
+
+    def compare(self, metric, image):
+        """计算图片（如编码后再解码的结果）相对参考图的SSIM或PSNR"""
+        luma = luma_array(image, self.max_side)
+        if luma.shape != self.luma.shape:
+            raise ValueError(f"图片尺寸不一致: {self.luma.shape} 和 {luma.shape}")
+
+        if metric == "psnr":
+            return compute_psnr(self.luma, luma)
+        if metric != "ssim":
+            raise ValueError(f"未知的质量指标: {metric}")
+        return compute_ssim(self.luma, luma)
+
+
+def metric_score(metric, value):
+    """把指标值转换为随质量值近似线性、始终为正的分数，供插值查找使用
+
+    SSIM接近1时变化很小，使用-log(1 - SSIM)；PSNR本身以dB为单位，直接使用。
+    """
+    if metric == "ssim":
+        return max(-math.log(max(1.0 - value, 1e-10)), 1e-6)
+    return max(value, 1e-6)
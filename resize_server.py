@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+from image_resizer import DEFAULT_OPTIONS, RESAMPLE_PRESETS, process_image_data
+from format_strategies import parse_encoder_option
+from tiled_processing import DEFAULT_MEMORY_LIMIT_MB
+
+# 默认监听地址和端口（只监听本机）
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# 默认的上传大小上限（MB）和单个请求的处理超时（秒）
+DEFAULT_MAX_UPLOAD_MB = 50
+DEFAULT_TIMEOUT = 60
+
+# 编码参数的前缀，如 encoder.progressive=true
+ENCODER_OPTION_PREFIX = "encoder."
+
+# 客户端可以在查询字符串中指定的处理参数；内存上限等资源限制只能由服务端配置
+REQUEST_OPTIONS = ("method", "quality", "target_size", "target_ssim", "target_psnr", "metric_side",
+                   "width", "height", "keep_ratio", "search", "fast_decode", "resample")
+
+# 取值受限的处理参数
+OPTION_CHOICES = {
+    "method": ("quality", "dimensions"),
+    "search": ("model", "bisect"),
+    "resample": tuple(RESAMPLE_PRESETS),
+}
+
+# 输出格式对应的Content-Type
+CONTENT_TYPES = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "webp": "image/webp",
+    "bmp": "image/bmp",
+    "tiff": "image/tiff",
+}
+
+
+def parse_options(query):
+    """从查询字符串中解析处理参数和输出格式，参数无效时抛出ValueError"""
+    options = {}
+    output_format = None
+
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name == "format":
+            output_format = value or None
+            continue
+        if name.startswith(ENCODER_OPTION_PREFIX):
+            try:
+                knob, knob_value = parse_encoder_option(f"{name[len(ENCODER_OPTION_PREFIX):]}={value}")
+            except ValueError as e:
+                raise ValueError(f"错误: {e}")
+            options.setdefault("encoder_options", {})[knob] = knob_value
+            continue
+        if name not in REQUEST_OPTIONS:
+            raise ValueError(f"错误: 未知的参数: {name}")
+
+        default = DEFAULT_OPTIONS[name]
+        if isinstance(default, bool):
+            if value.lower() not in ("1", "0", "true", "false", "yes", "no"):
+                raise ValueError(f"错误: 参数{name}必须是true或false")
+            options[name] = value.lower() in ("1", "true", "yes")
+        elif isinstance(default, int):
+            try:
+                options[name] = int(value)
+            except ValueError:
+                raise ValueError(f"错误: 参数{name}必须是整数")
+        elif isinstance(default, float):
+            try:
+                options[name] = float(value)
+            except ValueError:
+                raise ValueError(f"错误: 参数{name}必须是数字")
+        else:
+            if name in OPTION_CHOICES and value not in OPTION_CHOICES[name]:
+                raise ValueError(f"错误: 参数{name}必须是 {'、'.join(OPTION_CHOICES[name])} 之一")
+            options[name] = value
+
+    return options, output_format
+
+
+class ResizeServer(ThreadingHTTPServer):
+    """图片处理HTTP服务：请求由线程接收，图片在工作进程池中处理
+
+    同时处理和排队的请求总数不超过workers + max_queue，超出时直接返回503，
+    避免请求堆积导致内存和延迟无限增长。memory_limit为每个请求原图解码后的内存上限（MB）。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, max_queue=None, max_upload=DEFAULT_MAX_UPLOAD_MB * 1024 * 1024,
+                 timeout=DEFAULT_TIMEOUT, verbose=False, memory_limit=DEFAULT_MEMORY_LIMIT_MB):
+        super().__init__(address, ResizeRequestHandler)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue if max_queue is not None else self.workers * 2
+        self.max_upload = max_upload
+        self.request_timeout = timeout
+        self.memory_limit = memory_limit
+        self.verbose = verbose
+
+        # 工作进程异常退出（如被OOM终止）后进程池无法再使用，由replace_executor替换
+        self.executor_lock = threading.Lock()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+
+        self.counters_lock = threading.Lock()
+        self.counters = {
+            "requests": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "active": 0,
+            "pool_restarts": 0,
+        }
+
+    def count(self, name, delta=1):
+        """更新请求计数"""
+        with self.counters_lock:
+            self.counters[name] += delta
+
+    def submit(self, fn, *args):
+        """把任务提交给进程池，返回(future, 进程池)
+
+        进程池已损坏时替换为新的进程池后重试一次，仍然失败时抛出BrokenProcessPool。
+        """
+        with self.executor_lock:
+            executor = self.executor
+        try:
+            return executor.submit(fn, *args), executor
+        except BrokenProcessPool:
+            executor = self.replace_executor(executor)
+            return executor.submit(fn, *args), executor
+
+    def replace_executor(self, broken):
+        """用新的进程池替换已损坏的进程池，返回当前的进程池
+
+        多个请求同时发现同一个进程池损坏时只替换一次。
+        """
+        with self.executor_lock:
+            if self.executor is broken:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                broken.shutdown(wait=False)
+                self.count("pool_restarts")
+            return self.executor
+
+    def status(self):
+        """返回服务状态"""
+        with self.counters_lock:
+            counters = dict(self.counters)
+        return dict(counters, workers=self.workers, max_queue=self.max_queue, max_upload=self.max_upload)
+
+    def server_close(self):
+        super().server_close()
+        # 绑定端口失败时（如端口已被占用）进程池还未创建
+        executor = getattr(self, "executor", None)
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class ResizeRequestHandler(BaseHTTPRequestHandler):
+    """处理 POST /resize 和 GET /health 请求"""
+
+    server_version = "ImageResizer/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/health":
+            self.send_json(404, {"error": "错误: 未知的路径"})
+            return
+        self.send_json(200, self.server.status())
+
+    def do_POST(self):
+        server = self.server
+        server.count("requests")
+
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.send_json(411, {"error": "错误: 缺少Content-Length"}, close=True)
+            return
+        if length > server.max_upload:
+            self.send_json(413, {"error": f"错误: 图片超过大小上限({server.max_upload}字节)"}, close=True)
+            return
+
+        url = urlsplit(self.path)
+        if url.path != "/resize":
+            self.discard_body(length)
+            self.send_json(404, {"error": "错误: 未知的路径"})
+            return
+        if length <= 0:
+            self.send_json(400, {"error": "错误: 请求中没有图片数据"})
+            return
+
+        try:
+            options, output_format = parse_options(url.query)
+            options["memory_limit"] = server.memory_limit
+        except ValueError as e:
+            self.discard_body(length)
+            self.send_json(400, {"error": str(e)})
+            return
+
+        # 准入控制：处理和排队的请求已满时直接拒绝，上传的数据读取后丢弃，不占用内存
+        if not server.slots.acquire(blocking=False):
+            server.count("rejected")
+            self.discard_body(length)
+            self.send_json(503, {"error": "错误: 服务繁忙，请稍后重试"}, headers={"Retry-After": "1"})
+            return
+
+        server.count("active")
+        start_time = time.perf_counter()
+        release_slot = True
+        try:
+            data = self.rfile.read(length)
+            try:
+                future, executor = server.submit(process_image_data, data, options, output_format)
+            except BrokenProcessPool:
+                server.count("failed")
+                self.send_json(503, {"error": "错误: 工作进程不可用，请稍后重试"}, headers={"Retry-After": "1"})
+                return
+            try:
+                result = future.result(timeout=server.request_timeout)
+            except FutureTimeoutError:
+                # 已经开始的处理无法中断，工作进程处理完成后才释放名额，避免超时的请求使进程池超载
+                if not future.cancel():
+                    release_slot = False
+                    future.add_done_callback(lambda f: server.slots.release())
+                server.count("timeouts")
+                self.send_json(504, {"error": "错误: 处理超时"})
+                return
+            except BrokenProcessPool:
+                # 处理这个请求（或同时处理的其他请求）的工作进程异常退出，替换进程池，后续请求不受影响
+                server.replace_executor(executor)
+                server.count("failed")
+                self.send_json(500, {"error": "错误: 工作进程异常退出，处理失败"})
+                return
+            except ValueError as e:
+                server.count("failed")
+                self.send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                server.count("failed")
+                self.send_json(500, {"error": f"错误: 处理图片时出错: {str(e)}"})
+                return
+        finally:
+            server.count("active", -1)
+            if release_slot:
+                server.slots.release()
+
+        server.count("completed")
+        total_time = time.perf_counter() - start_time
+        processing_time = result["stats"]["seconds"]
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES.get(result["format"], "application/octet-stream"))
+        self.send_header("Content-Length", str(result["size"]))
+        self.send_header("X-Image-Format", result["format"])
+        self.send_header("X-Image-Width", str(result["width"]))
+        self.send_header("X-Image-Height", str(result["height"]))
+        if result["quality"] is not None:
+            self.send_header("X-Image-Quality", str(result["quality"]))
+        self.send_header("X-Original-Size", str(result["source_size"]))
+        self.send_header("X-Processed-Size", str(result["size"]))
+        self.send_header("X-Encode-Probes", str(result["probes"]))
+        self.send_header("X-Processing-Time", f"{processing_time:.4f}")
+        self.send_header("X-Queue-Time", f"{max(0.0, total_time - processing_time):.4f}")
+        self.send_header("X-Total-Time", f"{total_time:.4f}")
+        self.end_headers()
+        self.wfile.write(result["data"])
+
+    def discard_body(self, length, chunk_size=64 * 1024):
+        """分块读取并丢弃请求数据，使客户端能正常收到响应"""
+        while length > 0:
+            chunk = self.rfile.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def send_json(self, status, body, close=False, headers=None):
+        """发送JSON响应；close为True时响应后关闭连接（未读取请求数据时必须关闭）"""
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="image_resizer.py serve",
+                                     description="图片处理HTTP服务 - 在本机常驻运行，通过HTTP上传图片并返回处理结果")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"监听地址，默认为{DEFAULT_HOST}（只允许本机访问）")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"监听端口，默认为{DEFAULT_PORT}")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="工作进程数，默认为CPU核心数")
+    parser.add_argument("--max-queue", type=int, help="最多排队等待的请求数，超出时返回503，默认为工作进程数的2倍")
+    parser.add_argument("--max-upload", type=int, default=DEFAULT_MAX_UPLOAD_MB, help=f"上传图片的大小上限(MB)，默认为{DEFAULT_MAX_UPLOAD_MB}")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help=f"单个请求的处理超时(秒)，超时返回504，默认为{DEFAULT_TIMEOUT}")
+    parser.add_argument("--memory-limit", type=int, default=DEFAULT_MEMORY_LIMIT_MB,
+                        help=f"每个请求原图解码后的内存上限(MB)，超过时返回400，默认为{DEFAULT_MEMORY_LIMIT_MB}")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出每个请求的访问日志")
+
+    args = parser.parse_args(argv)
+
+    try:
+        server = ResizeServer((args.host, args.port), args.workers, args.max_queue, args.max_upload * 1024 * 1024,
+                              args.timeout, args.verbose, args.memory_limit)
+    except OSError as e:
+        print(f"\n错误: 无法监听 {args.host}:{args.port}: {e.strerror or e}")
+        return 1
+    host, port = server.server_address[:2]
+    print(f"图片处理服务已启动: http://{host}:{port}/resize （工作进程: {server.workers} 个，最多排队: {server.max_queue} 个）")
+    print("按 Ctrl+C 停止服务")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n服务已停止")
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import tempfile
+
+# 缓存格式版本，处理算法变化导致输出不同时应递增，使旧缓存失效
+CACHE_VERSION = 2
+
+# 默认缓存大小上限（MB）
+DEFAULT_CACHE_SIZE_MB = 1024
+
+# 当前进程的umask，原子写入时用于设置临时文件的权限（mkstemp创建的文件只有所有者可读写）
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def add_cache_arguments(parser):
+    """添加结果缓存相关的命令行参数"""
+    parser.add_argument("--cache-dir", help="结果缓存目录。设置后，相同内容和参数的图片直接使用缓存的输出，不再解码和编码")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE_MB, help=f"结果缓存的大小上限(MB)，超出时按最近最少使用淘汰，默认为{DEFAULT_CACHE_SIZE_MB}")
+
+
+def create_cache(args):
+    """根据命令行参数创建结果缓存，未设置缓存目录时返回None"""
+    if not args.cache_dir:
+        return None
+    return ResultCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_file_atomic(path, data):
+    """先写入同一文件夹下的临时文件，再重命名为目标文件
+
+    重命名是原子操作，其他进程不会读到写了一半的文件；写入中断时不会留下不完整的输出。
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(temp_path, 0o666 & ~_UMASK)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class ResultCache:
+    """以源图片内容哈希和完整处理参数为键的处理结果磁盘缓存
+
+    每个缓存项是cache_dir下的一个文件，文件的修改时间即最近使用时间；
+    缓存总大小超过上限时，按最近最少使用（LRU）的顺序淘汰。
+    写入使用临时文件加重命名，多个进程可以安全地共享同一个缓存目录。
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_size = sum(size for _, size, _ in self._scan_entries())
+
+    def make_key(self, source_path, options, output_format, source_data=None):
+        """根据源文件内容哈希、处理参数和输出格式生成缓存键，已读入源文件数据时直接计算其哈希"""
+        params = {
+            "version": CACHE_VERSION,
+            "source": hashlib.sha256(source_data).hexdigest() if source_data is not None else hash_file(source_path),
+            "options": options,
+            "output_format": output_format,
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def fetch(self, key, output_path):
+        """缓存命中时把缓存的输出写入output_path并返回True，否则返回False"""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+
+        write_file_atomic(output_path, data)
+
+        # 更新修改时间，记录最近使用
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return True
+
+    def store(self, key, data):
+        """把输出数据写入缓存，必要时淘汰最近最少使用的缓存项"""
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+        write_file_atomic(entry_path, data)
+
+        self.stores += 1
+        self.total_size += len(data)
+        if self.total_size > self.max_size:
+            self._evict()
+
+    def store_file(self, key, path):
+        """把已保存的输出文件写入缓存"""
+        with open(path, "rb") as f:
+            self.store(key, f.read())
+
+    def stats(self):
+        """返回缓存的命中统计"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "total_size": self.total_size,
+            "max_size": self.max_size,
+        }
+
+    def _entry_path(self, key):
+        """缓存项的文件路径，按键的前两位分目录存放"""
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _scan_entries(self):
+        """列出所有缓存项 (路径, 大小, 最近使用时间)"""
+        entries = []
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        """淘汰最近最少使用的缓存项，直到总大小不超过上限"""
+        entries = sorted(self._scan_entries(), key=lambda entry: entry[2])
+        self.total_size = sum(size for _, size, _ in entries)
+
+        for path, size, _ in entries:
+            if self.total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_size -= size
+            self.evictions += 1
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import threading
+import contextlib
+from PIL import Image, ImageFile
+
+# 默认内存上限（MB）：原图解码后超过该大小时分块处理，无法分块处理时拒绝处理
+DEFAULT_MEMORY_LIMIT_MB = 1024
+
+# LANCZOS滤波器的支撑半径（缩小时以输出像素计），分块缩放时每块上下多读取的源图片行数由它决定
+LANCZOS_SUPPORT = 3
+
+# EXIF方向标签，方向不为1的TIFF在解码时会被旋转，无法分块读取
+EXIF_ORIENTATION = 0x0112
+
+# lift_pixel_limit的嵌套计数和进入前的Image.MAX_IMAGE_PIXELS
+_pixel_limit_lock = threading.Lock()
+_pixel_limit_depth = 0
+_saved_pixel_limit = None
+
+
+def decoded_bytes(size, mode):
+    """估计图片解码后占用的内存（字节）
+
+    Pillow中1、L、P模式每像素占1字节，I;16占2字节，其他模式（包括RGB）每像素占4字节。
+    """
+    if mode in ("1", "L", "P"):
+        pixel_size = 1
+    elif mode.startswith("I;16"):
+        pixel_size = 2
+    else:
+        pixel_size = 4
+    return size[0] * size[1] * pixel_size
+
+
+@contextlib.contextmanager
+def lift_pixel_limit():
+    """在with块内取消Pillow按像素数拒绝大图片的限制（约1.8亿像素），退出后恢复
+
+    只用于解码大小已由内存上限检查（或分块读取）控制的地方，其他代码仍受Pillow的限制保护。
+    可以嵌套和在多个线程中同时使用，最后一个退出时恢复原来的值。
+    """
+    global _pixel_limit_depth, _saved_pixel_limit
+    with _pixel_limit_lock:
+        if _pixel_limit_depth == 0:
+            _saved_pixel_limit = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+        _pixel_limit_depth += 1
+    try:
+        yield
+    finally:
+        with _pixel_limit_lock:
+            _pixel_limit_depth -= 1
+            if _pixel_limit_depth == 0:
+                Image.MAX_IMAGE_PIXELS = _saved_pixel_limit
+
+
+class BandReader:
+    """按行读取图片的一部分（横条），不解码整张图片
+
+    只支持像素数据未压缩的图片（如BMP、PPM和未压缩的TIFF）：每个数据块都是raw格式，
+    可以根据行跨度算出任意一行在文件中的位置。JPEG、PNG和压缩的TIFF只能整张解码。
+    opener每次调用返回一个新打开（只读取了文件头）的原图。
+    """
+
+    def __init__(self, opener):
+        self.opener = opener
+        with opener() as image:
+            self.size = image.size
+            self.mode = image.mode
+            self.tiles = self._raw_tiles(image)
+
+    @property
+    def supported(self):
+        """图片是否可以分块读取"""
+        return self.tiles is not None
+
+    @staticmethod
+    def _raw_tiles(image):
+        """把数据块整理为(区域, 偏移, 解码模式, 行跨度, 行方向, 其他参数)，无法分块读取时返回None"""
+        tiles = []
+        for codec, extents, offset, args in image.tile:
+            if codec != "raw" or offset < 0:
+                return None
+            if isinstance(args, str):
+                args = (args,)
+            rawmode = args[0]
+            stride = args[1] if len(args) > 1 else 0
+            orientation = args[2] if len(args) > 2 else 1
+            if orientation not in (1, -1):
+                return None
+
+            if stride <= 0:
+                # 未指定行跨度时每行数据紧密排列，用打包一行像素的长度计算
+                try:
+                    stride = len(Image.new(image.mode, (extents[2] - extents[0], 1)).tobytes("raw", rawmode))
+                except (ValueError, OSError):
+                    return None
+            tiles.append((extents, offset, rawmode, stride, orientation, tuple(args[3:])))
+
+        # 只在确认全部是raw数据块后读取EXIF（某些格式读取EXIF时会解码整张图片）
+        if not tiles or image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+            return None
+        return tiles
+
+    def read(self, top, bottom):
+        """读取第top行到第bottom行（不含）组成的横条"""
+        image = self.opener()
+        tiles = []
+        for (x0, y0, x1, y1), offset, rawmode, stride, orientation, extra in self.tiles:
+            first, last = max(y0, top), min(y1, bottom)
+            if first >= last:
+                continue
+            # 行方向为-1（如BMP）时数据块中的行从下往上存储
+            skip = first - y0 if orientation == 1 else y1 - last
+            tile = ("raw", (x0, first - top, x1, last - top), offset + skip * stride, (rawmode, stride, orientation) + extra)
+            # Pillow 11起数据块为命名元组
+            tiles.append(ImageFile._Tile(*tile) if hasattr(ImageFile, "_Tile") else tile)
+
+        image._size = (self.size[0], bottom - top)
+        if hasattr(image, "_tile_size"):
+            # TIFF按_tile_size分配解码后的图片，不修改会分配整张图片的内存
+            image._tile_size = image.size
+        image.tile = tiles
+        # 读取后立即关闭文件，返回的横条只包含内存中的像素数据；横条大小由调用方按内存上限确定
+        with image, lift_pixel_limit():
+            image.load()
+        return image
+
+
+def resize_in_bands(reader, size, band_bytes, reducing_gap=None, stats=None):
+    """分块缩放：每次读取原图的一个横条，缩放得到输出图片中对应的行，粘贴到输出图片中
+
+    band_bytes为每个横条解码后的大小上限。每个横条上下多读取滤波器支撑范围内的行，
+    缩放时用box参数指定输出行对应的源区域，结果与整张缩放相同（reducing_gap的整数倍缩小
+    在横条边界附近可能有细微差异）。stats不为None时记录读取和缩放的总耗时。返回(输出图片, 横条数)。
+    """
+    src_width, src_height = reader.size
+    width, height = size
+    scale = src_height / height
+    margin = math.ceil(LANCZOS_SUPPORT * max(scale, 1.0)) + 1
+
+    # 每个横条对应的输出行数：横条（包括上下多读的行）不超过band_bytes
+    src_rows = band_bytes // max(1, decoded_bytes((src_width, 1), reader.mode)) - 2 * margin
+    rows_per_band = max(1, int(src_rows / scale))
+
+    output = None
+    bands = 0
+    read_seconds = resize_seconds = 0.0
+    read_bytes = 0
+    for out_top in range(0, height, rows_per_band):
+        out_bottom = min(height, out_top + rows_per_band)
+        src_top, src_bottom = out_top * scale, out_bottom * scale
+        read_top = max(0, int(src_top) - margin)
+        read_bottom = min(src_height, math.ceil(src_bottom) + margin)
+
+        start_time = time.perf_counter()
+        band = reader.read(read_top, read_bottom)
+        read_seconds += time.perf_counter() - start_time
+        read_bytes += decoded_bytes(band.size, band.mode)
+
+        start_time = time.perf_counter()
+        box = (0, src_top - read_top, src_width, src_bottom - read_top)
+        part = band.resize((width, out_bottom - out_top), Image.LANCZOS, box=box, reducing_gap=reducing_gap)
+        del band
+        if output is None:
+            output = Image.new(part.mode, size)
+            if part.mode == "P":
+                output.putpalette(part.getpalette())
+        output.paste(part, (0, out_top))
+        resize_seconds += time.perf_counter() - start_time
+        bands += 1
+
+    if stats is not None:
+        stats.record("decode", read_seconds, read_bytes, dimensions=[src_width, src_height], tiled=True, bands=bands)
+        stats.record("resize", resize_seconds, source=[src_width, src_height], target=[width, height],
+                     tiled=True, bands=bands)
+    return output, bands
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import argparse
+from image_resizer import RESAMPLE_PRESETS, add_instrumentation_arguments, create_resizer, encoder_option_argument
+from tiled_processing import DEFAULT_MEMORY_LIMIT_MB
+from processing_stats import JsonlStatsSink
+from result_cache import write_file_atomic
+
+# 默认的变体宽度（常用的响应式图片尺寸）
+DEFAULT_WIDTHS = "320,640,1280,2560"
+
+
+def parse_variants(spec):
+    """解析变体列表，如 "320,640:q70,1280:t200,2560"
+
+    每项为宽度，可以附加 :q质量值 或 :t目标大小(KB)。格式错误时抛出ValueError。
+    """
+    variants = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+
+        width, _, setting = item.partition(":")
+        try:
+            variant = {"width": int(width), "quality": None, "target_size": 0}
+            if setting[:1] == "q":
+                variant["quality"] = int(setting[1:])
+            elif setting[:1] == "t":
+                variant["target_size"] = int(setting[1:])
+            elif setting:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"无效的变体: {item}（格式为 宽度、宽度:q质量值 或 宽度:t目标大小）")
+
+        if variant["width"] <= 0:
+            raise ValueError(f"无效的变体: {item}（宽度必须大于0）")
+        if variant["quality"] is not None and not 1 <= variant["quality"] <= 100:
+            raise ValueError(f"无效的变体: {item}（质量值必须在1-100之间）")
+        if variant["target_size"] < 0:
+            raise ValueError(f"无效的变体: {item}（目标大小不能小于0）")
+        variants.append(variant)
+
+    if not variants:
+        raise ValueError("请至少指定一个变体")
+    return variants
+
+
+def build_variant_path(image_path, width, output_dir=None):
+    """生成变体的输出路径，如 photos/resized_a_640w.jpg"""
+    name, ext = os.path.splitext(os.path.basename(image_path))
+    return os.path.join(output_dir or os.path.dirname(image_path), f"resized_{name}_{width}w{ext}")
+
+
+def build_manifest_path(image_path, output_dir=None):
+    """生成变体清单的默认路径，如 photos/resized_a_variants.json"""
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(output_dir or os.path.dirname(image_path), f"resized_{name}_variants.json")
+
+
+def generate_variants(image_path, variants, options, output_dir=None, manifest_path=None, quiet=False, stats_sink=None):
+    """解码一次原图，生成并保存所有变体，写入一个描述所有输出的清单
+
+    返回 (清单, 处理器)，失败时清单为None，错误信息在处理器的last_error中。
+    """
+    start_time = time.perf_counter()
+    resizer = create_resizer(options, quiet=quiet, stats_sink=stats_sink)
+
+    if not resizer.load_image(image_path):
+        resizer.finish_stats(False)
+        return None, resizer
+
+    results = resizer.process_variants(variants, options.get("quality", 85))
+    if results is None:
+        resizer.close()
+        resizer.finish_stats(False)
+        return None, resizer
+
+    manifest = {
+        "input": os.path.abspath(image_path),
+        "input_size": os.path.getsize(image_path),
+        "format": resizer.source_format,
+        "width": resizer.original_image.width,
+        "height": resizer.original_image.height,
+        "variants": [],
+    }
+    # 所有变体已编码到内存中，立即释放原图
+    resizer.close()
+
+    try:
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        # 宽度超过原图时不放大，多个变体可能得到相同的尺寸，只保存一次
+        written = {}
+        for result in results:
+            output_path = build_variant_path(image_path, result["width"], output_dir)
+            if output_path not in written:
+                with resizer.stats.measure("write", len(result["data"]), variant=result["width"]):
+                    write_file_atomic(output_path, result["data"])
+                written[output_path] = result
+                resizer._log(f"变体已保存到: {output_path} ({resizer.format_size(len(result['data']))})")
+
+            manifest["variants"].append({
+                "width": result["width"],
+                "height": result["height"],
+                "quality": result["quality"],
+                "target_size": result["target_size"],
+                "size": len(result["data"]),
+                "output": os.path.abspath(output_path),
+                "resized_from": result["source"],
+            })
+
+        manifest["elapsed"] = round(time.perf_counter() - start_time, 4)
+        manifest_path = manifest_path or build_manifest_path(image_path, output_dir)
+        write_file_atomic(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+        resizer._log(f"\n变体清单已保存到: {manifest_path}")
+    except Exception as e:
+        resizer._error(f"保存变体时出错: {str(e)}")
+        resizer.finish_stats(False)
+        return None, resizer
+
+    resizer.finish_stats(True)
+    return manifest, resizer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="image_resizer.py variants",
+                                     description="生成多尺寸变体 - 原图只解码一次，一次生成多个宽度的图片（如响应式图片）")
+    parser.add_argument("image_path", help="要处理的图片路径")
+    parser.add_argument("-s", "--sizes", default=DEFAULT_WIDTHS,
+                        help=f"变体列表，以逗号分隔的宽度，可附加 :q质量值 或 :t目标大小(KB)，"
+                             f"如 '320:q70,640,1280:t200'，默认为{DEFAULT_WIDTHS}")
+    parser.add_argument("-o", "--output-dir", help="输出文件夹，默认为原图所在文件夹")
+    parser.add_argument("--manifest", help="变体清单文件(JSON)，默认为输出文件夹下的 resized_<文件名>_variants.json")
+    parser.add_argument("-q", "--quality", type=int, default=85, help="未指定质量值的变体使用的JPEG质量值(1-100)，默认为85")
+    parser.add_argument("--no-fast-decode", action="store_false", dest="fast_decode", help="不使用JPEG缩放解码（draft模式），始终以原始分辨率解码")
+    parser.add_argument("--resample", choices=list(RESAMPLE_PRESETS), default="quality", help="重采样预设，与单张处理相同，默认为quality")
+    parser.add_argument("--search", choices=["model", "bisect"], default="model", help="目标大小的查找策略，与单张处理相同，默认为model")
+    parser.add_argument("--encoder-option", action="append", default=[], type=encoder_option_argument, dest="encoder_options",
+                        metavar="NAME=VALUE", help="编码参数，可指定多次，与单张处理相同")
+    parser.add_argument("--memory-limit", type=int, default=DEFAULT_MEMORY_LIMIT_MB, help=f"原图解码后的内存上限(MB)，与单张处理相同，默认为{DEFAULT_MEMORY_LIMIT_MB}")
+    add_instrumentation_arguments(parser)
+
+    args = parser.parse_args(argv)
+    try:
+        variants = parse_variants(args.sizes)
+    except ValueError as e:
+        parser.error(str(e))
+
+    options = {
+        "quality": args.quality,
+        "search": args.search,
+        "fast_decode": args.fast_decode,
+        "resample": args.resample,
+        "encoder_options": dict(args.encoder_options),
+        "memory_limit": args.memory_limit,
+    }
+    stats_sink = JsonlStatsSink(args.stats_jsonl) if args.stats_jsonl else None
+    manifest, resizer = generate_variants(args.image_path, variants, options, args.output_dir, args.manifest,
+                                          quiet=args.quiet, stats_sink=stats_sink)
+    if manifest is None:
+        if args.quiet:
+            print(resizer.last_error, file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())